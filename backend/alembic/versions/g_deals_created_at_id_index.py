@@ -0,0 +1,31 @@
+"""Add composite index on deals (created_at DESC, id DESC) for keyset pagination
+
+Revision ID: g_deals_created_at_id_index
+Revises: f_fix_balance_change_type_crypto
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'g_deals_created_at_id_index'
+down_revision: Union[str, None] = 'f_fix_balance_change_type_crypto'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индекс под сортировку списка сделок: ORDER BY created_at DESC, id DESC
+    op.create_index(
+        'ix_deals_created_at_id',
+        'deals',
+        [sa.text('created_at DESC'), sa.text('id DESC')],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deals_created_at_id', table_name='deals')
@@ -0,0 +1,65 @@
+"""Add deal_daily_stats and deal_daily_route_stats rollup tables
+
+Revision ID: h_deal_daily_stats
+Revises: g_deals_created_at_id_index
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'h_deal_daily_stats'
+down_revision: Union[str, None] = 'g_deals_created_at_id_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'deal_daily_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('client_id', sa.Integer(), nullable=False),
+        sa.Column('deals_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_eur', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('total_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('total_cost_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('net_profit_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('debt_amount', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('debt_deals_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['client_id'], ['clients.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'status', 'client_id', name='uq_deal_daily_stats')
+    )
+    op.create_index(op.f('ix_deal_daily_stats_id'), 'deal_daily_stats', ['id'], unique=False)
+    op.create_index(op.f('ix_deal_daily_stats_day'), 'deal_daily_stats', ['day'], unique=False)
+    
+    op.create_table(
+        'deal_daily_route_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('route_type', sa.String(), nullable=False),
+        sa.Column('transactions_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_cost_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'status', 'route_type', name='uq_deal_daily_route_stats')
+    )
+    op.create_index(op.f('ix_deal_daily_route_stats_id'), 'deal_daily_route_stats', ['id'], unique=False)
+    op.create_index(op.f('ix_deal_daily_route_stats_day'), 'deal_daily_route_stats', ['day'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_deal_daily_route_stats_day'), table_name='deal_daily_route_stats')
+    op.drop_index(op.f('ix_deal_daily_route_stats_id'), table_name='deal_daily_route_stats')
+    op.drop_table('deal_daily_route_stats')
+    op.drop_index(op.f('ix_deal_daily_stats_day'), table_name='deal_daily_stats')
+    op.drop_index(op.f('ix_deal_daily_stats_id'), table_name='deal_daily_stats')
+    op.drop_table('deal_daily_stats')
@@ -0,0 +1,71 @@
+"""Store running balance/average on exchange_rate_transactions
+
+Revision ID: i_exchange_rate_running_totals
+Revises: h_deal_daily_stats
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+from decimal import Decimal
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'i_exchange_rate_running_totals'
+down_revision: Union[str, None] = 'h_deal_daily_stats'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('exchange_rate_transactions', sa.Column('balance_after', sa.Numeric(precision=15, scale=4), nullable=True))
+    op.add_column('exchange_rate_transactions', sa.Column('total_value_after', sa.Numeric(precision=15, scale=4), nullable=True))
+    op.add_column('exchange_rate_transactions', sa.Column('average_rate_after', sa.Numeric(precision=12, scale=6), nullable=True))
+    op.create_index(
+        'ix_exchange_rate_transactions_pair_created',
+        'exchange_rate_transactions',
+        ['currency_from', 'currency_to', 'created_at', 'id'],
+        unique=False
+    )
+    
+    # Backfill: replay existing history per currency pair (same logic the history endpoint used)
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("""
+        SELECT id, currency_from, currency_to, transaction_type, amount, value_in_target_currency
+        FROM exchange_rate_transactions
+        ORDER BY currency_from, currency_to, created_at, id
+    """)).fetchall()
+    
+    state = {}
+    for row in rows:
+        pair = (row.currency_from, row.currency_to)
+        balance, total_value = state.get(pair, (Decimal(0), Decimal(0)))
+        
+        if str(row.transaction_type).lower() == 'income':
+            balance += row.amount
+            total_value += row.value_in_target_currency
+        else:
+            if balance > 0 and total_value > 0:
+                value_reduced = row.amount * (total_value / balance)
+            else:
+                value_reduced = Decimal(0)
+            balance -= row.amount
+            total_value -= value_reduced
+        
+        state[pair] = (balance, total_value)
+        average_rate = total_value / balance if balance > 0 else Decimal(0)
+        
+        conn.execute(sa.text("""
+            UPDATE exchange_rate_transactions
+            SET balance_after = :balance, total_value_after = :total_value, average_rate_after = :average_rate
+            WHERE id = :id
+        """), {"balance": balance, "total_value": total_value, "average_rate": average_rate, "id": row.id})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_exchange_rate_transactions_pair_created', table_name='exchange_rate_transactions')
+    op.drop_column('exchange_rate_transactions', 'average_rate_after')
+    op.drop_column('exchange_rate_transactions', 'total_value_after')
+    op.drop_column('exchange_rate_transactions', 'balance_after')
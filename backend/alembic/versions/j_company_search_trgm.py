@@ -0,0 +1,53 @@
+"""Trigram indexes for company name / account number search on the deal list
+
+Revision ID: j_company_search_trgm
+Revises: i_exchange_rate_running_totals
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'j_company_search_trgm'
+down_revision: Union[str, None] = 'i_exchange_rate_running_totals'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Полу-соединение транзакций с компаниями клиента и сделками (фильтры списка сделок)
+    op.create_index('ix_transactions_client_company_id', 'transactions', ['client_company_id'])
+    op.create_index('ix_transactions_deal_id', 'transactions', ['deal_id'])
+    op.create_index('ix_company_accounts_company_id', 'company_accounts', ['company_id'])
+
+    # ILIKE '%...%' по названию компании и номеру счёта/IBAN - только PostgreSQL (pg_trgm)
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index(
+        'ix_companies_name_trgm',
+        'companies',
+        ['name'],
+        postgresql_using='gin',
+        postgresql_ops={'name': 'gin_trgm_ops'},
+    )
+    op.create_index(
+        'ix_company_accounts_account_number_trgm',
+        'company_accounts',
+        ['account_number'],
+        postgresql_using='gin',
+        postgresql_ops={'account_number': 'gin_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_company_accounts_account_number_trgm', table_name='company_accounts')
+        op.drop_index('ix_companies_name_trgm', table_name='companies')
+    op.drop_index('ix_company_accounts_company_id', table_name='company_accounts')
+    op.drop_index('ix_transactions_deal_id', table_name='transactions')
+    op.drop_index('ix_transactions_client_company_id', table_name='transactions')
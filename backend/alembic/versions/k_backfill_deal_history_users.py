@@ -0,0 +1,47 @@
+"""Backfill denormalized user fields in deal_history
+
+Revision ID: k_backfill_deal_history_users
+Revises: j_company_search_trgm
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'k_backfill_deal_history_users'
+down_revision: Union[str, None] = 'j_company_search_trgm'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Строк deal_history на один UPDATE (каждая порция фиксируется отдельно)
+BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    # Старые записи истории без user_email/user_name/user_role заполняем из users,
+    # чтобы эндпоинты истории не догружали пользователей
+    bind = op.get_bind()
+    min_id, max_id = bind.execute(sa.text('SELECT min(id), max(id) FROM deal_history')).one()
+    if min_id is None:
+        return
+
+    backfill = sa.text("""
+        UPDATE deal_history SET
+            user_email = COALESCE(user_email, (SELECT email FROM users WHERE users.id = deal_history.user_id)),
+            user_name = COALESCE(user_name, (SELECT full_name FROM users WHERE users.id = deal_history.user_id)),
+            user_role = COALESCE(user_role, (SELECT role FROM users WHERE users.id = deal_history.user_id))
+        WHERE id >= :low AND id < :high
+          AND (user_email IS NULL OR user_name IS NULL OR user_role IS NULL)
+    """)
+    with op.get_context().autocommit_block():
+        for low in range(min_id, max_id + 1, BATCH_SIZE):
+            bind.execute(backfill, {'low': low, 'high': low + BATCH_SIZE})
+
+
+def downgrade() -> None:
+    # Заполненные данные не откатываются: они совпадают с тем, что раньше подставлялось при чтении
+    pass
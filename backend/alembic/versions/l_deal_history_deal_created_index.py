@@ -0,0 +1,31 @@
+"""Composite index on deal_history(deal_id, created_at DESC, id DESC)
+
+Revision ID: l_deal_history_deal_created_index
+Revises: k_backfill_deal_history_users
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'l_deal_history_deal_created_index'
+down_revision: Union[str, None] = 'k_backfill_deal_history_users'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # История сделки постранично: WHERE deal_id = ? ORDER BY created_at DESC, id DESC
+    op.create_index(
+        'ix_deal_history_deal_id_created_at',
+        'deal_history',
+        ['deal_id', sa.text('created_at DESC'), sa.text('id DESC')],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_deal_history_deal_id_created_at', table_name='deal_history')
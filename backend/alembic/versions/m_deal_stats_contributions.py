@@ -0,0 +1,93 @@
+"""Per-deal contributions to deal_daily_stats for incremental rollup maintenance
+
+Revision ID: m_deal_stats_contributions
+Revises: l_deal_history_deal_created_index
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'm_deal_stats_contributions'
+down_revision: Union[str, None] = 'l_deal_history_deal_created_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'deal_stats_contributions',
+        sa.Column('deal_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('client_id', sa.Integer(), nullable=True),
+        sa.Column('total_eur', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('total_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('total_cost_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('net_profit_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('debt_amount', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.Column('debt_deals_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['deal_id'], ['deals.id'], ),
+        sa.PrimaryKeyConstraint('deal_id')
+    )
+    op.create_table(
+        'deal_route_stats_contributions',
+        sa.Column('deal_id', sa.Integer(), nullable=False),
+        sa.Column('route_type', sa.String(), nullable=False),
+        sa.Column('transactions_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_cost_usdt', sa.Numeric(precision=20, scale=2), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['deal_id'], ['deals.id'], ),
+        sa.PrimaryKeyConstraint('deal_id', 'route_type')
+    )
+
+    # Вклады текущих сделок и агрегаты как их суммы (то же, что rebuild_deal_daily_stats):
+    # после миграции агрегаты обновляются приращениями от этих вкладов
+    op.execute("""
+        INSERT INTO deal_stats_contributions (
+            deal_id, day, status, client_id, total_eur, total_usdt, total_cost_usdt,
+            net_profit_usdt, debt_amount, debt_deals_count
+        )
+        SELECT
+            id, created_at::date, status, client_id, total_eur_request,
+            COALESCE(total_usdt_calculated, 0), COALESCE(total_cost_usdt, 0), COALESCE(net_profit_usdt, 0),
+            CASE WHEN is_client_debt AND client_debt_amount > 0 THEN client_debt_amount ELSE 0 END,
+            CASE WHEN is_client_debt AND client_debt_amount > 0 THEN 1 ELSE 0 END
+        FROM deals
+    """)
+    op.execute("""
+        INSERT INTO deal_route_stats_contributions (deal_id, route_type, transactions_count, total_cost_usdt)
+        SELECT deal_id, route_type, COUNT(id), COALESCE(SUM(cost_usdt), 0)
+        FROM transactions
+        WHERE route_type IS NOT NULL
+        GROUP BY deal_id, route_type
+    """)
+    op.execute("DELETE FROM deal_daily_stats")
+    op.execute("DELETE FROM deal_daily_route_stats")
+    op.execute("""
+        INSERT INTO deal_daily_stats (
+            day, status, client_id, deals_count, total_eur, total_usdt, total_cost_usdt,
+            net_profit_usdt, debt_amount, debt_deals_count
+        )
+        SELECT day, status, client_id, COUNT(deal_id), SUM(total_eur), SUM(total_usdt), SUM(total_cost_usdt),
+               SUM(net_profit_usdt), SUM(debt_amount), SUM(debt_deals_count)
+        FROM deal_stats_contributions
+        WHERE day IS NOT NULL
+        GROUP BY day, status, client_id
+    """)
+    op.execute("""
+        INSERT INTO deal_daily_route_stats (day, status, route_type, transactions_count, total_cost_usdt)
+        SELECT c.day, c.status, r.route_type, SUM(r.transactions_count), SUM(r.total_cost_usdt)
+        FROM deal_route_stats_contributions r
+        JOIN deal_stats_contributions c ON c.deal_id = r.deal_id
+        WHERE c.day IS NOT NULL
+        GROUP BY c.day, c.status, r.route_type
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('deal_route_stats_contributions')
+    op.drop_table('deal_stats_contributions')
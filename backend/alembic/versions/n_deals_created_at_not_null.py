@@ -0,0 +1,59 @@
+"""Backfill deals.created_at and make it NOT NULL
+
+Revision ID: n_deals_created_at_not_null
+Revises: m_deal_stats_contributions
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'n_deals_created_at_not_null'
+down_revision: Union[str, None] = 'm_deal_stats_contributions'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset-курсор списка сделок и порядок (created_at DESC, id DESC) требуют created_at у каждой сделки
+    op.execute("""
+        UPDATE deals
+        SET created_at = COALESCE(updated_at, approved_at, now())
+        WHERE created_at IS NULL
+    """)
+    op.alter_column('deals', 'created_at', existing_type=sa.DateTime(), nullable=False)
+
+    # Сделки без даты не входили в дневные агрегаты: переносим их вклады в день создания
+    op.execute("""
+        UPDATE deal_stats_contributions c
+        SET day = d.created_at::date
+        FROM deals d
+        WHERE d.id = c.deal_id AND c.day IS NULL
+    """)
+    op.execute("DELETE FROM deal_daily_stats")
+    op.execute("DELETE FROM deal_daily_route_stats")
+    op.execute("""
+        INSERT INTO deal_daily_stats (
+            day, status, client_id, deals_count, total_eur, total_usdt, total_cost_usdt,
+            net_profit_usdt, debt_amount, debt_deals_count
+        )
+        SELECT day, status, client_id, COUNT(deal_id), SUM(total_eur), SUM(total_usdt), SUM(total_cost_usdt),
+               SUM(net_profit_usdt), SUM(debt_amount), SUM(debt_deals_count)
+        FROM deal_stats_contributions
+        GROUP BY day, status, client_id
+    """)
+    op.execute("""
+        INSERT INTO deal_daily_route_stats (day, status, route_type, transactions_count, total_cost_usdt)
+        SELECT c.day, c.status, r.route_type, SUM(r.transactions_count), SUM(r.total_cost_usdt)
+        FROM deal_route_stats_contributions r
+        JOIN deal_stats_contributions c ON c.deal_id = r.deal_id
+        GROUP BY c.day, c.status, r.route_type
+    """)
+
+
+def downgrade() -> None:
+    op.alter_column('deals', 'created_at', existing_type=sa.DateTime(), nullable=True)
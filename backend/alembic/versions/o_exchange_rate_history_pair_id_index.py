@@ -0,0 +1,40 @@
+"""Order exchange rate history by id: index exchange_rate_transactions(currency_from, currency_to, id)
+
+Revision ID: o_exchange_rate_history_pair_id_index
+Revises: n_deals_created_at_not_null
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'o_exchange_rate_history_pair_id_index'
+down_revision: Union[str, None] = 'n_deals_created_at_not_null'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Постинг получает id под блокировкой пары, поэтому история по id идёт
+    # в том же порядке, в котором считались balance_after/average_rate_after
+    op.create_index(
+        'ix_exchange_rate_transactions_pair_id',
+        'exchange_rate_transactions',
+        ['currency_from', 'currency_to', 'id'],
+        unique=False
+    )
+    op.drop_index('ix_exchange_rate_transactions_pair_created', table_name='exchange_rate_transactions')
+
+
+def downgrade() -> None:
+    op.create_index(
+        'ix_exchange_rate_transactions_pair_created',
+        'exchange_rate_transactions',
+        ['currency_from', 'currency_to', 'created_at', 'id'],
+        unique=False
+    )
+    op.drop_index('ix_exchange_rate_transactions_pair_id', table_name='exchange_rate_transactions')
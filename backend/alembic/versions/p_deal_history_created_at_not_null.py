@@ -0,0 +1,41 @@
+"""Backfill deal_history.created_at and make it NOT NULL
+
+Revision ID: p_deal_history_created_at_not_null
+Revises: o_exchange_rate_history_pair_id_index
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'p_deal_history_created_at_not_null'
+down_revision: Union[str, None] = 'o_exchange_rate_history_pair_id_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset-курсор истории (created_at DESC, id DESC) требует created_at у каждой записи.
+    # Запись без даты получает дату создания сделки: внутри сделки порядок сохраняет id
+    op.execute("""
+        UPDATE deal_history h
+        SET created_at = COALESCE(d.created_at, now())
+        FROM deals d
+        WHERE d.id = h.deal_id AND h.created_at IS NULL
+    """)
+    op.execute("UPDATE deal_history SET created_at = now() WHERE created_at IS NULL")
+    op.alter_column(
+        'deal_history', 'created_at',
+        existing_type=sa.DateTime(), existing_server_default=sa.text('now()'), nullable=False
+    )
+
+
+def downgrade() -> None:
+    op.alter_column(
+        'deal_history', 'created_at',
+        existing_type=sa.DateTime(), existing_server_default=sa.text('now()'), nullable=True
+    )
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 from decimal import Decimal
 from datetime import datetime
 from pydantic import BaseModel
@@ -16,6 +16,9 @@ from app.models.account_balance import AccountBalance
 from app.models.account_balance_history import AccountBalanceHistory, BalanceChangeType
 from app.schemas.deal import DealResponse, DealCreate, DealListResponse
 from app.services.deal_calculator import DealCalculator
+from app.services.deal_list import build_deal_list_query, build_deal_list_response
+from app.services.deal_stats_rollup import refresh_deal_daily_stats
+from app.services.deal_recalculation import recalculate_open_deals
 
 router = APIRouter(prefix="/accountant", tags=["accountant"])
 
@@ -47,6 +50,37 @@ def calculate_preview(
     return convert_decimals(result)
 
 
+class RecalculateOpenDealsRequest(BaseModel):
+    dry_run: bool = True  # what-if: только расчёт, без записи
+    commission_percent_overrides: Dict[int, Decimal] = {}  # id комиссии -> новый процент
+    exchange_rate_overrides: Dict[str, Decimal] = {}  # "EUR/USDT" -> новый курс
+
+
+@router.post("/recalculate-open-deals")
+def recalculate_open_deals_endpoint(
+    data: RecalculateOpenDealsRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_permission("exchanges.deals.update"))
+):
+    """Пакетный пересчёт всех незавершённых сделок (what-if при dry_run=true)"""
+    rate_overrides = {}
+    for pair, rate in data.exchange_rate_overrides.items():
+        currencies = pair.split("/")
+        if len(currencies) != 2:
+            raise HTTPException(status_code=400, detail=f"Invalid currency pair: {pair}. Expected FROM/TO")
+        rate_overrides[(currencies[0], currencies[1])] = rate
+    
+    try:
+        return recalculate_open_deals(
+            db,
+            dry_run=data.dry_run,
+            commission_percent_overrides=data.commission_percent_overrides,
+            exchange_rate_overrides=rate_overrides
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/deals", response_model=DealResponse, status_code=status.HTTP_201_CREATED)
 def create_deal_as_accountant(
     deal_data: DealCreate,
@@ -152,6 +186,7 @@ def create_deal_as_accountant(
         )
         db.add(copy_history)
     
+    refresh_deal_daily_stats(db, db_deal)
     db.commit()
     db.refresh(db_deal)
     return db_deal
@@ -163,29 +198,9 @@ def get_client_debts(
     current_user: User = Depends(require_permission("exchanges.debts.read"))
 ):
     """Получить список сделок с задолженностями"""
-    deals = db.query(Deal).filter(
+    rows = build_deal_list_query(db).filter(
         Deal.is_client_debt == True,
         Deal.client_debt_amount > 0
     ).order_by(Deal.created_at.desc()).all()
     
-    result = []
-    for deal in deals:
-        transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
-        paid_count = sum(1 for t in transactions if (t.status.value if hasattr(t.status, 'value') else str(t.status)) == "paid")
-        
-        result.append(DealListResponse(
-            id=deal.id,
-            client_id=deal.client_id,
-            client_name=deal.client.name if deal.client else None,
-            total_eur_request=deal.total_eur_request,
-            total_usdt_calculated=deal.total_usdt_calculated,
-            status=deal.status,
-            created_at=deal.created_at,
-            transactions_count=len(transactions),
-            paid_transactions_count=paid_count,
-            client_debt_amount=deal.client_debt_amount,
-            client_paid_amount=deal.client_paid_amount
-        ))
-    
-    return result
-
+    return build_deal_list_response(rows)
@@ -1,9 +1,12 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from app.core.database import get_db
-from app.core.security import verify_password, get_password_hash, create_access_token
+from app.core.security import (
+    verify_password_async, get_password_hash_async, create_access_token, PasswordPoolSaturated
+)
 from app.core.config import settings
 from app.core.dependencies import get_current_active_user
 from app.schemas.user import UserCreate, UserResponse, Token
@@ -11,11 +14,30 @@ from app.models.user import User, UserRole
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# Эндпоинты асинхронные: bcrypt выполняется в отдельном пуле (core.security.password_pool),
+# запросы к БД - в общем threadpool, чтобы не блокировать event loop.
+password_pool_busy = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Authentication is temporarily overloaded, please retry",
+    headers={"Retry-After": "1"},
+)
+
+
+def _get_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def _save_user(db: Session, user: User) -> User:
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     # Проверяем, существует ли пользователь
-    db_user = db.query(User).filter(User.email == user_data.email).first()
+    db_user = await run_in_threadpool(_get_user_by_email, db, user_data.email)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -23,7 +45,10 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Создаем нового пользователя
-    hashed_password = get_password_hash(user_data.password)
+    try:
+        hashed_password = await get_password_hash_async(user_data.password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy
     # Убеждаемся, что используем значение enum (например, "senior_manager"), а не имя константы
     # user_data.role - это UserRole enum, берем его значение
     role_value = user_data.role.value if isinstance(user_data.role, UserRole) else str(user_data.role)
@@ -34,19 +59,20 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
         full_name=user_data.full_name,
         role=role_value
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await run_in_threadpool(_save_user, db, db_user)
 
 
 @router.post("/login", response_model=Token)
-def login(
+async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = db.query(User).filter(User.email == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(_get_user_by_email, db, form_data.username)
+    try:
+        password_ok = user is not None and await verify_password_async(form_data.password, user.hashed_password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -1,17 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional, Dict
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, case, type_coerce, Numeric
+from typing import List, Optional, Dict, Tuple
 from decimal import Decimal
-from app.core.database import get_db
-from app.core.dependencies import get_current_active_user
-from app.core.permissions import require_permission
+from app.core.database import get_async_db
+from app.core.permissions import require_permission_async
 from app.models.user import User
 from app.models.internal_company import InternalCompany
 from app.models.internal_company_account import InternalCompanyAccount
 from app.models.account_balance import AccountBalance
 from app.models.deal import Deal, DealStatus
 from app.models.transaction import Transaction, TransactionStatus
+from app.services.balance_summary_cache import get_balance_summary
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/company-balances", tags=["company-balances"])
@@ -41,215 +42,254 @@ class ProjectedCompanyBalancesResponse(BaseModel):
     projected: CompanyBalancesSummaryResponse
 
 
-@router.get("/summary", response_model=CompanyBalancesSummaryResponse)
-def get_company_balances_summary(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("balances.read"))
-):
-    """Получить сводку остатков компаний и криптовалют"""
-    
-    # Получаем все внутренние компании со счетами
-    companies = db.query(InternalCompany).all()
+# Криптовалюты: балансы счетов в них округляются до 4 знаков, остальные (фиат) - до 2
+CRYPTO_CURRENCIES = {
+    'BTC', 'ETH', 'USDT', 'USDC', 'BNB', 'SOL', 'ADA', 'DOT', 'MATIC', 'AVAX', 'LINK', 'UNI', 'ATOM', 'XRP',
+    'DOGE', 'LTC', 'BCH', 'XLM', 'ALGO', 'VET', 'TRX', 'EOS', 'AAVE', 'MKR', 'COMP', 'SNX', 'SUSHI', 'CRV',
+    'YFI', '1INCH'
+}
+
+
+def load_balance_rows(db: Session) -> Tuple[list, list]:
+    """
+    Точные остатки двумя запросами: активные счета внутренних компаний с итогом
+    по (компания, валюта), посчитанным в SQL оконной суммой, и крипто-счета.
+    """
+    currency_total = func.sum(InternalCompanyAccount.balance).over(
+        partition_by=(InternalCompanyAccount.company_id, InternalCompanyAccount.currency)
+    )
+    rows = db.query(
+        InternalCompany.id,
+        InternalCompany.name,
+        InternalCompanyAccount.id,
+        InternalCompanyAccount.account_name,
+        InternalCompanyAccount.account_number,
+        InternalCompanyAccount.currency,
+        InternalCompanyAccount.balance,
+        currency_total
+    ).join(
+        InternalCompanyAccount, InternalCompanyAccount.company_id == InternalCompany.id
+    ).filter(
+        InternalCompanyAccount.is_active == True
+    ).order_by(
+        InternalCompany.id, InternalCompanyAccount.currency, InternalCompanyAccount.id
+    ).all()
+    crypto_rows = db.query(
+        AccountBalance.id, AccountBalance.account_name, AccountBalance.balance, AccountBalance.currency
+    ).order_by(AccountBalance.id).all()
+    return rows, crypto_rows
+
+
+def summarize_balances(rows: list, crypto_rows: list) -> CompanyBalancesSummaryResponse:
+    """Сводка остатков из строк load_balance_rows с округлением для ответа"""
+    # Строки уже отсортированы по (компания, валюта): одна запись ответа на группу
     company_balances = []
     total_company_balance = Decimal(0)
-    
-    for company in companies:
-        accounts = db.query(InternalCompanyAccount).filter(
-            InternalCompanyAccount.company_id == company.id,
-            InternalCompanyAccount.is_active == True
-        ).all()
-        
-        # Группируем по валютам
-        currency_totals = {}
-        account_details = []
-        
-        for account in accounts:
-            currency = account.currency
-            if currency not in currency_totals:
-                currency_totals[currency] = Decimal(0)
-            currency_totals[currency] += account.balance
-            
-            # Нормализуем баланс счета - 2 знака для фиата, 4 для крипты
-            is_crypto = currency in ['BTC', 'ETH', 'USDT', 'USDC', 'BNB', 'SOL', 'ADA', 'DOT', 'MATIC', 'AVAX', 'LINK', 'UNI', 'ATOM', 'XRP', 'DOGE', 'LTC', 'BCH', 'XLM', 'ALGO', 'VET', 'TRX', 'EOS', 'AAVE', 'MKR', 'COMP', 'SNX', 'SUSHI', 'CRV', 'YFI', '1INCH']
-            normalized_account_balance = account.balance.quantize(Decimal('0.0001') if is_crypto else Decimal('0.01'))
-            account_details.append({
-                "id": account.id,
-                "account_name": account.account_name,
-                "account_number": account.account_number,
-                "balance": float(normalized_account_balance),
-                "currency": currency
-            })
-        
-        # Создаем ответ для каждой валюты компании
-        for currency, balance in currency_totals.items():
+    current = None
+    for company_id, company_name, account_id, account_name, account_number, currency, balance, total in rows:
+        if current is None or (current.company_id, current.currency) != (company_id, currency):
+            total = Decimal(str(total))
             # Нормализуем Decimal - 2 знака для фиата (счета компаний всегда фиат)
-            normalized_balance = balance.quantize(Decimal('0.01'))
-            company_balances.append(CompanyBalanceResponse(
-                company_id=company.id,
-                company_name=company.name,
-                total_balance=normalized_balance,
+            current = CompanyBalanceResponse(
+                company_id=company_id,
+                company_name=company_name,
+                total_balance=total.quantize(Decimal('0.01')),
                 currency=currency,
-                accounts=[acc for acc in account_details if acc["currency"] == currency]
-            ))
-            total_company_balance += balance
+                accounts=[]
+            )
+            company_balances.append(current)
+            total_company_balance += total
+        
+        # Нормализуем баланс счета - 2 знака для фиата, 4 для крипты
+        is_crypto = currency in CRYPTO_CURRENCIES
+        normalized_account_balance = balance.quantize(Decimal('0.0001') if is_crypto else Decimal('0.01'))
+        current.accounts.append({
+            "id": account_id,
+            "account_name": account_name,
+            "account_number": account_number,
+            "balance": float(normalized_account_balance),
+            "currency": currency
+        })
     
-    # Получаем остатки в криптовалютах (из AccountBalance)
-    crypto_balances = db.query(AccountBalance).all()
+    # Остатки в криптовалютах (из AccountBalance)
     crypto_list = []
     total_crypto_balance = Decimal(0)
     
-    for balance in crypto_balances:
+    for account_id, account_name, balance, currency in crypto_rows:
         # Нормализуем Decimal для крипты - до 4 знаков после запятой
-        normalized_balance = balance.balance.quantize(Decimal('0.0001'))
         crypto_list.append(CryptoBalanceResponse(
-            account_id=balance.id,
-            account_name=balance.account_name,
-            balance=normalized_balance,
-            currency=balance.currency or "UNKNOWN"
+            account_id=account_id,
+            account_name=account_name,
+            balance=balance.quantize(Decimal('0.0001')),
+            currency=currency or "UNKNOWN"
         ))
-        total_crypto_balance += balance.balance
-    
-    # Нормализуем итоговые балансы
-    normalized_total_company = total_company_balance.quantize(Decimal('0.01'))
-    normalized_total_crypto = total_crypto_balance.quantize(Decimal('0.0001'))
+        total_crypto_balance += balance
     
     return CompanyBalancesSummaryResponse(
         companies=company_balances,
         crypto_balances=crypto_list,
-        total_company_balance=normalized_total_company,
-        total_crypto_balance=normalized_total_crypto
+        total_company_balance=total_company_balance.quantize(Decimal('0.01')),
+        total_crypto_balance=total_crypto_balance.quantize(Decimal('0.0001'))
     )
 
 
+def build_company_balances_summary(db: Session) -> CompanyBalancesSummaryResponse:
+    """Сводка остатков по текущему состоянию БД"""
+    return summarize_balances(*load_balance_rows(db))
+
+
+def company_balances_summary(db: Session) -> CompanyBalancesSummaryResponse:
+    """Сводка остатков из кэша (собирается build_company_balances_summary при промахе)"""
+    return get_balance_summary(lambda: build_company_balances_summary(db))
+
+
+@router.get("/summary", response_model=CompanyBalancesSummaryResponse)
+async def get_company_balances_summary(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("balances.read"))
+):
+    """Получить сводку остатков компаний и криптовалют (кэшируется на несколько секунд)"""
+    return await db.run_sync(company_balances_summary)
+
+
+# Сделки, по которым ещё ожидаются списания с наших счетов
+PENDING_DEAL_STATUSES = [
+    DealStatus.SENIOR_MANAGER_APPROVED.value,
+    DealStatus.CLIENT_AGREED_TO_PAY.value,
+    DealStatus.AWAITING_CLIENT_PAYMENT.value,
+    DealStatus.CLIENT_PARTIALLY_PAID.value,
+    DealStatus.EXECUTION.value
+]
+
+
+def _pending_debit_amount():
+    """
+    Сумма списания по неоплаченному маршруту (SQL-выражение):
+    - direct: amount_from_account со счёта компании
+    - exchange: exchange_amount (с учётом комиссий), иначе amount_from_account × crypto_exchange_rate,
+      иначе amount_for_client - с крипто-счёта; пустые и нулевые значения пропускаются
+    - partner / partner_50_50: USDT партнёру
+    """
+    # Тип результата - как у балансов: ветки имеют разный масштаб (2 и 4 знака, произведение - 8)
+    return type_coerce(case(
+        (Transaction.route_type == "direct", Transaction.amount_from_account),
+        (Transaction.route_type == "exchange", func.coalesce(
+            func.nullif(Transaction.exchange_amount, 0),
+            func.nullif(Transaction.amount_from_account, 0) * func.nullif(Transaction.crypto_exchange_rate, 0),
+            func.nullif(Transaction.amount_for_client, 0)
+        )),
+        (Transaction.route_type == "partner", Transaction.amount_to_partner_usdt),
+        (Transaction.route_type == "partner_50_50", Transaction.amount_to_partner_50_50_usdt),
+    ), Numeric(30, 10))
+
+
+def get_pending_debits(db: Session) -> Tuple[Dict[int, Decimal], Dict[int, Decimal]]:
+    """
+    Предстоящие списания по неоплаченным транзакциям неисполненных сделок.
+
+    Один агрегирующий запрос по (тип маршрута, счёт компании, крипто-счёт).
+    Партнёрские маршруты списываются с первого USDT-счёта.
+
+    Returns:
+        (списания по счетам внутренних компаний, списания по крипто-счетам) - положительные суммы
+    """
+    rows = db.query(
+        Transaction.route_type,
+        Transaction.internal_company_account_id,
+        Transaction.crypto_account_id,
+        func.sum(_pending_debit_amount())
+    ).join(Deal, Deal.id == Transaction.deal_id).filter(
+        Deal.status.in_(PENDING_DEAL_STATUSES),
+        Transaction.status != TransactionStatus.PAID,
+        Transaction.route_type.in_(["direct", "exchange", "partner", "partner_50_50"])
+    ).group_by(
+        Transaction.route_type,
+        Transaction.internal_company_account_id,
+        Transaction.crypto_account_id
+    ).all()
+
+    company_debits: Dict[int, Decimal] = {}  # {internal_company_account_id: amount}
+    crypto_debits: Dict[int, Decimal] = {}   # {crypto_account_id: amount}
+    partner_debit = Decimal(0)
+    for route_type, company_account_id, crypto_account_id, amount in rows:
+        if not amount:
+            continue
+        amount = Decimal(str(amount))
+        if route_type == "direct" and company_account_id:
+            company_debits[company_account_id] = company_debits.get(company_account_id, Decimal(0)) + amount
+        elif route_type == "exchange" and crypto_account_id:
+            crypto_debits[crypto_account_id] = crypto_debits.get(crypto_account_id, Decimal(0)) + amount
+        elif route_type in ("partner", "partner_50_50"):
+            partner_debit += amount
+
+    if partner_debit:
+        usdt_account_id = db.query(AccountBalance.id).filter(
+            AccountBalance.currency == "USDT"
+        ).order_by(AccountBalance.id).limit(1).scalar()
+        if usdt_account_id:
+            crypto_debits[usdt_account_id] = crypto_debits.get(usdt_account_id, Decimal(0)) + partner_debit
+
+    return company_debits, crypto_debits
+
+
 @router.get("/projected", response_model=ProjectedCompanyBalancesResponse)
-def get_projected_company_balances(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("balances.read"))
+async def get_projected_company_balances(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("balances.read"))
 ):
     """Получить текущие и предполагаемые остатки с учетом неисполненных сделок"""
+    return await db.run_sync(build_projected_company_balances)
+
+
+def build_projected_company_balances(db: Session) -> ProjectedCompanyBalancesResponse:
+    """
+    Текущие и предполагаемые остатки (sync Session: вызывается через AsyncSession.run_sync).
+
+    Сводка из кэша здесь не используется: текущие остатки, точные балансы счетов
+    компаний и крипто-счетов для проекции берутся из одних и тех же строк
+    load_balance_rows, поэтому current и projected не расходятся.
+    """
+    rows, crypto_rows = load_balance_rows(db)
+    current = summarize_balances(rows, crypto_rows)
     
-    # Получаем текущие остатки
-    current = get_company_balances_summary(db=db, current_user=current_user)
-    
-    # Получаем неисполненные сделки (сохраненные, рассчитанные, отправленные на выполнение)
-    pending_deals = db.query(Deal).filter(
-        Deal.status.in_([
-            DealStatus.SENIOR_MANAGER_APPROVED.value,
-            DealStatus.CLIENT_AGREED_TO_PAY.value,
-            DealStatus.AWAITING_CLIENT_PAYMENT.value,
-            DealStatus.CLIENT_PARTIALLY_PAID.value,
-            DealStatus.EXECUTION.value
-        ])
-    ).all()
-    
-    # Рассчитываем изменения балансов на основе транзакций неисполненных сделок
-    # ВАЖНО: разделяем изменения для компаний и крипто, чтобы ID не смешивались
-    company_account_changes = {}  # {internal_company_account_id: change_amount}
-    crypto_account_changes = {}   # {crypto_account_id: change_amount}
+    # Предстоящие списания - одним агрегирующим запросом
+    # ВАЖНО: изменения для компаний и крипто раздельно, чтобы ID не смешивались
+    company_account_debits, crypto_account_debits = get_pending_debits(db)
     
-    for deal in pending_deals:
-        transactions = db.query(Transaction).filter(
-            Transaction.deal_id == deal.id,
-            Transaction.status != TransactionStatus.PAID.value
-        ).all()
-        
-        for transaction in transactions:
-            # Для прямого перевода - списание с нашего счета (InternalCompanyAccount)
-            if transaction.route_type == "direct" and transaction.internal_company_account_id:
-                account_id = transaction.internal_company_account_id
-                if account_id not in company_account_changes:
-                    company_account_changes[account_id] = Decimal(0)
-                # Списываем сумму перевода
-                if transaction.amount_from_account:
-                    company_account_changes[account_id] -= transaction.amount_from_account
-            
-            # Для биржи - изменения в криптовалютных балансах (AccountBalance)
-            elif transaction.route_type == "exchange" and transaction.crypto_account_id:
-                account_id = transaction.crypto_account_id
-                if account_id not in crypto_account_changes:
-                    crypto_account_changes[account_id] = Decimal(0)
-                # Списываем сумму крипты
-                # Используем exchange_amount (рассчитанная сумма с учётом комиссий)
-                # Если нет exchange_amount, используем приближение: amount_from_account * crypto_exchange_rate
-                if transaction.exchange_amount:
-                    crypto_account_changes[account_id] -= transaction.exchange_amount
-                elif transaction.amount_from_account and transaction.crypto_exchange_rate:
-                    crypto_amount = transaction.amount_from_account * transaction.crypto_exchange_rate
-                    crypto_account_changes[account_id] -= crypto_amount
-                elif transaction.amount_for_client:
-                    crypto_account_changes[account_id] -= transaction.amount_for_client
-            
-            # Для партнёра - списание USDT с нашего крипто-баланса
-            elif transaction.route_type == "partner" and transaction.amount_to_partner_usdt:
-                # Находим USDT аккаунт
-                usdt_account = db.query(AccountBalance).filter(
-                    AccountBalance.currency == "USDT"
-                ).first()
-                if usdt_account:
-                    if usdt_account.id not in crypto_account_changes:
-                        crypto_account_changes[usdt_account.id] = Decimal(0)
-                    crypto_account_changes[usdt_account.id] -= transaction.amount_to_partner_usdt
-            
-            # Для партнёра 50-50 - списание USDT с нашего крипто-баланса
-            elif transaction.route_type == "partner_50_50" and transaction.amount_to_partner_50_50_usdt:
-                # Находим USDT аккаунт
-                usdt_account = db.query(AccountBalance).filter(
-                    AccountBalance.currency == "USDT"
-                ).first()
-                if usdt_account:
-                    if usdt_account.id not in crypto_account_changes:
-                        crypto_account_changes[usdt_account.id] = Decimal(0)
-                    crypto_account_changes[usdt_account.id] -= transaction.amount_to_partner_50_50_usdt
+    # Точные балансы (в current они уже округлены)
+    account_balances = {account_id: balance for _, _, account_id, _, _, _, balance, _ in rows}
+    crypto_account_balances = {account_id: balance for account_id, _, balance, _ in crypto_rows}
     
     # Создаем проекцию остатков
-    # Для компаний - ВАЖНО: фильтруем счета по валюте, чтобы не смешивать EUR/USD/etc
+    # Для компаний - счета уже сгруппированы по компании и валюте в current
     projected_companies = []
     for company_balance in current.companies:
-        # Находим изменения только для счетов этой компании В ЭТОЙ ВАЛЮТЕ
-        company = db.query(InternalCompany).filter(InternalCompany.id == company_balance.company_id).first()
-        if company:
-            # Фильтруем счета по компании И по валюте
-            accounts = db.query(InternalCompanyAccount).filter(
-                InternalCompanyAccount.company_id == company.id,
-                InternalCompanyAccount.currency == company_balance.currency,  # ← Ключевое исправление!
-                InternalCompanyAccount.is_active == True
-            ).all()
-            
-            projected_accounts = []
-            projected_total = Decimal(0)
-            
-            for account in accounts:
-                # Используем company_account_changes для счетов внутренних компаний
-                change = company_account_changes.get(account.id, Decimal(0))
-                projected_balance = account.balance + change
-                projected_total += projected_balance
-                
-                projected_accounts.append({
-                    "id": account.id,
-                    "account_name": account.account_name,
-                    "account_number": account.account_number,
-                    "balance": float(projected_balance),
-                    "currency": account.currency
-                })
-            
-            # Нормализуем projected_total
-            normalized_projected_total = projected_total.quantize(Decimal('0.01'))
+        projected_accounts = []
+        projected_total = Decimal(0)
+        
+        for account in company_balance.accounts:
+            balance = account_balances.get(account["id"], Decimal(0))
+            projected_balance = balance - company_account_debits.get(account["id"], Decimal(0))
+            projected_total += projected_balance
             
-            # Всегда создаём projected запись с обновлёнными счетами
-            projected_companies.append(CompanyBalanceResponse(
-                company_id=company_balance.company_id,
-                company_name=company_balance.company_name,
-                total_balance=normalized_projected_total,
-                currency=company_balance.currency,
-                accounts=projected_accounts
-            ))
+            projected_accounts.append({**account, "balance": float(projected_balance)})
+        
+        # Нормализуем projected_total
+        normalized_projected_total = projected_total.quantize(Decimal('0.01'))
+        
+        projected_companies.append(CompanyBalanceResponse(
+            company_id=company_balance.company_id,
+            company_name=company_balance.company_name,
+            total_balance=normalized_projected_total,
+            currency=company_balance.currency,
+            accounts=projected_accounts
+        ))
     
-    # Для криптовалют - используем crypto_account_changes
+    # Для криптовалют
     projected_crypto = []
     for crypto_balance in current.crypto_balances:
-        # Используем crypto_account_changes для криптовалютных балансов
-        change = crypto_account_changes.get(crypto_balance.account_id, Decimal(0))
-        projected_balance = crypto_balance.balance + change
+        balance = crypto_account_balances[crypto_balance.account_id]
+        projected_balance = balance - crypto_account_debits.get(crypto_balance.account_id, Decimal(0))
         # Нормализуем до 4 знаков для крипты
         normalized_projected_crypto = projected_balance.quantize(Decimal('0.0001'))
         
@@ -260,8 +300,8 @@ def get_projected_company_balances(
             currency=crypto_balance.currency
         ))
     
-    projected_total_company = sum(cb.total_balance for cb in projected_companies)
-    projected_total_crypto = sum(cb.balance for cb in projected_crypto)
+    projected_total_company = sum((cb.total_balance for cb in projected_companies), Decimal(0))
+    projected_total_crypto = sum((cb.balance for cb in projected_crypto), Decimal(0))
     
     # Нормализуем итоговые projected балансы
     normalized_projected_total_company = projected_total_company.quantize(Decimal('0.01'))
@@ -278,4 +318,3 @@ def get_projected_company_balances(
         current=current,
         projected=projected
     )
-
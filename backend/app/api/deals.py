@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session, joinedload, selectinload, noload
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Tuple
 from decimal import Decimal
-from app.core.database import get_db
-from app.core.dependencies import get_current_active_user
+from datetime import datetime
+from app.core.database import get_db, get_async_db
+from app.core.dependencies import get_current_active_user, get_current_active_user_async
 from app.core.permissions import require_permission
 from app.core.deal_history_localization import (
     format_client_rate_history,
@@ -17,9 +21,25 @@ from app.models.deal_history import DealHistory, DealHistoryAction
 from app.models.manager_commission import ManagerCommission
 from app.schemas.deal import DealCreate, DealResponse, DealUpdate, DealListResponse, DealHistoryResponse, DealIncomeResponse
 from app.schemas.transaction import TransactionCreate
+from app.services.deal_list import (
+    build_deal_list_query,
+    build_deal_list_response,
+    encode_deal_cursor,
+    decode_deal_cursor,
+    apply_deal_cursor,
+    apply_deal_filters,
+    stream_deals_csv
+)
+from app.services.deal_stats_rollup import refresh_deal_daily_stats
+from app.services.deal_recalculation import summarize_deal_income
 
 router = APIRouter(prefix="/deals", tags=["deals"])
 
+# Записей истории в GET /deals/{deal_id}?include_history=true по умолчанию (остальные - через /history)
+DEAL_DETAIL_HISTORY_LIMIT = 20
+# Максимальный размер страницы истории
+DEAL_HISTORY_MAX_LIMIT = 200
+
 
 def add_deal_history(
     db: Session,
@@ -50,47 +70,15 @@ def add_deal_history(
 
 
 def calculate_deal_income(deal: Deal, db: Session) -> dict:
-    """Рассчитать доход и прибыль по сделке
-    
-    Формулы:
-    - Клиент отправляет = Σ(сумма_для_клиента × курс) × (1 + Ставка_клиента%)
-    - Затраты на сделку = Σ Route Income
-    - Доход = Клиент отправляет − Затраты на сделку
-    - Комиссия менеджера = Доход × %комиссии
-    - Чистая прибыль = Доход − Комиссия менеджера
-    """
-    # Считаем суммы по транзакциям
-    total_route_income = Decimal("0")  # Затраты на сделку (сумма Route Income)
-    total_amount_times_rate = Decimal("0")  # Σ(сумма_для_клиента × курс)
-    
-    for trans in deal.transactions:
-        # Route Income (затраты)
-        if trans.calculated_route_income:
-            total_route_income += Decimal(str(trans.calculated_route_income))
-        
-        # Сумма для клиента × курс
-        amount_for_client = Decimal(str(trans.amount_from_account or trans.amount_eur or 0))
-        exchange_rate = Decimal(str(trans.exchange_rate or 1))
-        total_amount_times_rate += amount_for_client * exchange_rate
-    
-    # Ставка клиента
-    client_rate = Decimal(str(deal.client_rate_percent or 0))
-    
-    # Клиент отправляет = Σ(сумма × курс) × (1 + ставка%)
-    client_should_send = total_amount_times_rate * (1 + client_rate / 100)
-    
-    # Затраты на сделку = Σ Route Income
-    deal_costs = total_route_income
-    
-    # Доход = Клиент отправляет − Затраты на сделку
-    income_amount = client_should_send - deal_costs
-    
-    # Доход в процентах от затрат
-    income_percent = Decimal("0")
-    if deal_costs > 0:
-        income_percent = (income_amount / deal_costs) * 100
-    
-    is_profitable = income_amount >= 0
+    """Рассчитать доход и прибыль по сделке (формулы - services.deal_recalculation.summarize_deal_income)"""
+    routes = [
+        (
+            trans.calculated_route_income,
+            Decimal(str(trans.amount_from_account or trans.amount_eur or 0)),
+            Decimal(str(trans.exchange_rate or 1))
+        )
+        for trans in deal.transactions
+    ]
     
     # Получаем комиссию менеджера
     manager_commission = db.query(ManagerCommission).filter(
@@ -100,23 +88,57 @@ def calculate_deal_income(deal: Deal, db: Session) -> dict:
     
     manager_commission_percent = Decimal(str(manager_commission.commission_percent)) if manager_commission else Decimal("0")
     
-    # Комиссия менеджера = Доход × %комиссии (только если прибыльно)
-    manager_commission_amount = income_amount * (manager_commission_percent / 100) if is_profitable else Decimal("0")
+    return summarize_deal_income(
+        routes,
+        client_rate_percent=deal.client_rate_percent,
+        manager_commission_percent=manager_commission_percent,
+        currency=deal.client_sends_currency
+    )
+
+
+def build_history_responses(db: Session, records: List[DealHistory]) -> List[DealHistoryResponse]:
+    """
+    История сделки для ответа.
     
-    # Чистая прибыль = Доход − Комиссия менеджера
-    net_profit = income_amount - manager_commission_amount
+    Данные пользователя денормализованы в deal_history (для старых строк - миграция
+    k_backfill_deal_history_users). Если у каких-то строк их всё же нет, пользователи
+    загружаются одним IN-запросом на весь ответ.
+    """
+    result = [DealHistoryResponse.model_validate(h) for h in records]
     
-    return {
-        "client_should_send": float(round(client_should_send, 2)),  # Клиент отправляет
-        "deal_costs": float(round(deal_costs, 2)),  # Затраты на сделку (Route Income)
-        "income_amount": float(round(income_amount, 2)),  # Доход
-        "income_percent": float(round(income_percent, 2)),  # Доход в %
-        "is_profitable": is_profitable,
-        "manager_commission_percent": float(round(manager_commission_percent, 2)),
-        "manager_commission_amount": float(round(manager_commission_amount, 2)),
-        "net_profit": float(round(net_profit, 2)),
-        "currency": deal.client_sends_currency or "USDT"
-    }
+    missing_user_ids = {h.user_id for h in result if not (h.user_email and h.user_name and h.user_role)}
+    if missing_user_ids:
+        users = {u.id: u for u in db.query(User).filter(User.id.in_(missing_user_ids)).all()}
+        for h in result:
+            user = users.get(h.user_id)
+            if user:
+                h.user_email = h.user_email or user.email
+                h.user_name = h.user_name or user.full_name
+                h.user_role = h.user_role or user.role
+    
+    return result
+
+
+def query_deal_history(
+    db: Session,
+    deal_id: int,
+    limit: int,
+    cursor_value: Tuple[datetime, int] | None = None,
+    actions: List[DealHistoryActionRU] | None = None
+) -> List[DealHistory]:
+    """Страница истории сделки в порядке (created_at DESC, id DESC) - по индексу ix_deal_history_deal_id_created_at"""
+    query = db.query(DealHistory).filter(DealHistory.deal_id == deal_id)
+    if actions:
+        query = query.filter(DealHistory.action.in_([a.value for a in actions]))
+    if cursor_value:
+        query = query.filter(tuple_(DealHistory.created_at, DealHistory.id) < tuple_(*cursor_value))
+    return query.order_by(DealHistory.created_at.desc(), DealHistory.id.desc()).limit(limit).all()
+
+
+def set_history_cursor(response: Response, records: List[DealHistory], limit: int):
+    """Курсор следующей страницы истории в заголовке X-Next-Cursor (если страница заполнена)"""
+    if records and len(records) == limit:
+        response.headers["X-Next-Cursor"] = encode_deal_cursor(records[-1])
 
 
 @router.post("", response_model=DealResponse, status_code=status.HTTP_201_CREATED)
@@ -164,114 +186,146 @@ def create_deal(
         user=current_user
     )
     
+    refresh_deal_daily_stats(db, db_deal)
     db.commit()
     db.refresh(db_deal)
     return db_deal
 
 
 @router.get("", response_model=List[DealListResponse])
-def get_deals(
+async def get_deals(
+    response: Response,
     status_filter: str | None = Query(None, description="Filter by deal status"),
     client_id: int | None = Query(None, description="Filter by client ID"),
-    company_name: str | None = Query(None, description="Filter by company name (searches in transaction target_company)"),
-    account_number: str | None = Query(None, description="Filter by account number/IBAN (searches in transaction recipient_details)"),
+    company_name: str | None = Query(None, description="Filter by client company name of the deal transactions (substring)"),
+    account_number: str | None = Query(None, description="Filter by account number/IBAN of the client company (substring)"),
     limit: int = 100,
     offset: int = 0,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    cursor: str | None = Query(None, description="Opaque cursor from X-Next-Cursor header (keyset pagination, offset is ignored)"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user_async)
 ):
     """Получить список заявок (с фильтрацией по роли).
 
     Важно для бухгалтера:
     - без status_filter он видит все сделки со всеми статусами,
       и уже на фронтенде может фильтровать/сортировать по статусу, дате и сумме.
+
+    Пагинация: limit/offset или курсор. Если страница заполнена целиком,
+    курсор следующей страницы возвращается в заголовке X-Next-Cursor.
     """
-    query = db.query(Deal)
-    
-    # Row Level Security: Менеджер видит только свои сделки
-    if current_user.role == UserRole.MANAGER:
-        query = query.filter(Deal.manager_id == current_user.id)
-    
-    # Применяем фильтр по статусу (если передан)
-    if status_filter:
-        # Проверяем, что статус валидный
-        try:
-            # Пытаемся найти статус в enum
-            status_enum = DealStatus(status_filter)
-            status_value = status_enum.value
-        except ValueError:
-            # Если не найден в enum, используем строку как есть (для обратной совместимости)
-            status_value = status_filter
-        
-        query = query.filter(Deal.status == status_value)
-    
-    # Фильтр по клиенту
-    if client_id:
-        query = query.filter(Deal.client_id == client_id)
-    
-    # Фильтр по компании (через транзакции)
-    if company_name:
-        # Находим сделки, у которых есть транзакции с указанной компанией
-        deals_with_company_ids = db.query(Transaction.deal_id).filter(
-            Transaction.target_company.ilike(f"%{company_name}%")
-        ).distinct().all()
-        deal_ids = [row[0] for row in deals_with_company_ids]
-        if deal_ids:
-            query = query.filter(Deal.id.in_(deal_ids))
-        else:
-            # Если нет сделок с такой компанией, возвращаем пустой результат
-            query = query.filter(Deal.id == -1)  # Невозможный ID
-    
-    # Фильтр по счету/IBAN (через транзакции)
-    if account_number:
-        # Находим сделки, у которых есть транзакции с указанным IBAN/счетом
-        deals_with_account_ids = db.query(Transaction.deal_id).filter(
-            Transaction.recipient_details.ilike(f"%{account_number}%")
-        ).distinct().all()
-        deal_ids = [row[0] for row in deals_with_account_ids]
-        if deal_ids:
-            query = query.filter(Deal.id.in_(deal_ids))
-        else:
-            # Если нет сделок с таким счетом, возвращаем пустой результат
-            query = query.filter(Deal.id == -1)  # Невозможный ID
+    return await db.run_sync(
+        build_deal_list, response, current_user,
+        status_filter, client_id, company_name, account_number, limit, offset, cursor
+    )
+
+
+def build_deal_list(
+    db: Session,
+    response: Response,
+    current_user,
+    status_filter: str | None = None,
+    client_id: int | None = None,
+    company_name: str | None = None,
+    account_number: str | None = None,
+    limit: int = 100,
+    offset: int = 0,
+    cursor: str | None = None
+) -> List[DealListResponse]:
+    """Страница списка заявок (sync Session: вызывается через AsyncSession.run_sync)"""
+    query = build_deal_list_query(db)
+    
+    query = apply_deal_filters(
+        query, current_user,
+        status_filter=status_filter,
+        client_id=client_id,
+        company_name=company_name,
+        account_number=account_number
+    )
 
     # Пагинация и сортировка: последние сделки первыми
-    query = query.order_by(Deal.created_at.desc()).limit(limit).offset(offset)
-    deals = query.all()
-    
-    # Формируем ответ с прогрессом
-    result = []
-    for deal in deals:
-        transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
-        paid_count = sum(1 for t in transactions if (t.status.value if hasattr(t.status, 'value') else str(t.status)) == "paid")
-        
-        result.append(DealListResponse(
-            id=deal.id,
-            client_id=deal.client_id,
-            client_name=deal.client.name if deal.client else None,
-            total_eur_request=deal.total_eur_request,
-            total_usdt_calculated=deal.total_usdt_calculated,
-            status=deal.status,
-            created_at=deal.created_at,
-            progress={"paid": paid_count, "total": len(transactions)} if transactions else None,
-            transactions_count=len(transactions),
-            paid_transactions_count=paid_count,
-            client_debt_amount=deal.client_debt_amount,
-            client_paid_amount=deal.client_paid_amount
-        ))
+    query = query.order_by(Deal.created_at.desc(), Deal.id.desc())
+    if cursor:
+        cursor_value = decode_deal_cursor(cursor)
+        if cursor_value is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = apply_deal_cursor(query, *cursor_value).limit(limit)
+    else:
+        query = query.limit(limit).offset(offset)
     
-    return result
+    # Сделки, имя клиента и прогресс по транзакциям - одним запросом
+    rows = query.all()
+    
+    if rows and len(rows) == limit:
+        last_deal = rows[-1][0]
+        response.headers["X-Next-Cursor"] = encode_deal_cursor(last_deal)
+    
+    return build_deal_list_response(rows)
+
+
+@router.get("/export")
+def export_deals(
+    status_filter: str | None = Query(None, description="Filter by deal status"),
+    client_id: int | None = Query(None, description="Filter by client ID"),
+    company_name: str | None = Query(None, description="Filter by company name"),
+    account_number: str | None = Query(None, description="Filter by account number/IBAN"),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Потоковый CSV-экспорт сделок с транзакциями и расчётом дохода (фильтры как в GET /deals).
+
+    XLSX не поддерживается: см. stream_deals_csv.
+    """
+    filename = f"deals_{datetime.utcnow():%Y%m%d_%H%M%S}.csv"
+    return StreamingResponse(
+        stream_deals_csv(
+            current_user,
+            status_filter=status_filter,
+            client_id=client_id,
+            company_name=company_name,
+            account_number=account_number
+        ),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 @router.get("/{deal_id}", response_model=DealResponse)
-def get_deal(
+async def get_deal(
     deal_id: int,
+    response: Response,
     include_history: bool = Query(False, description="Включать ли историю изменений"),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    history_limit: int = Query(
+        DEAL_DETAIL_HISTORY_LIMIT, ge=1, le=DEAL_HISTORY_MAX_LIMIT,
+        description="Сколько последних записей истории включать (следующие - через /history с курсором из X-Next-Cursor)"
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user_async)
 ):
-    """Получить детали заявки"""
-    deal = db.query(Deal).filter(Deal.id == deal_id).first()
+    """Получить детали заявки.
+
+    history заполняется только при include_history=true (последние
+    history_limit записей). Без него history = null: раньше поле
+    содержало всю историю сделки, теперь она читается только по запросу.
+    """
+    return await db.run_sync(build_deal_detail, response, deal_id, current_user, include_history, history_limit)
+
+
+def build_deal_detail(
+    db: Session,
+    response: Response,
+    deal_id: int,
+    current_user,
+    include_history: bool = False,
+    history_limit: int = DEAL_DETAIL_HISTORY_LIMIT
+) -> DealResponse:
+    """Детали заявки (sync Session: вызывается через AsyncSession.run_sync)"""
+    # Три запроса: сделка с создателем и менеджером (JOIN), транзакции, последние записи истории
+    deal = db.query(Deal).options(
+        joinedload(Deal.created_by_user),
+        joinedload(Deal.manager),
+        selectinload(Deal.transactions),
+        noload(Deal.history)  # история загружается ниже страницей, а не целиком
+    ).filter(Deal.id == deal_id).first()
     if not deal:
         raise HTTPException(status_code=404, detail="Deal not found")
     
@@ -280,67 +334,57 @@ def get_deal(
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
     # Формируем ответ с дополнительными данными
-    response = DealResponse.model_validate(deal)
+    deal_response = DealResponse.model_validate(deal)
     
     # Добавляем информацию о создателе
-    if deal.created_by_id:
-        created_by = db.query(User).filter(User.id == deal.created_by_id).first()
-        if created_by:
-            response.created_by_email = created_by.email
-            response.created_by_name = created_by.full_name
+    if deal.created_by_user:
+        deal_response.created_by_email = deal.created_by_user.email
+        deal_response.created_by_name = deal.created_by_user.full_name
     
     # Добавляем информацию о менеджере
-    if deal.manager_id:
-        manager = db.query(User).filter(User.id == deal.manager_id).first()
-        if manager:
-            response.manager_email = manager.email
-            response.manager_name = manager.full_name
+    if deal.manager:
+        deal_response.manager_email = deal.manager.email
+        deal_response.manager_name = deal.manager.full_name
     
-    # Добавляем историю, если запрошена
+    # Добавляем историю, если запрошена (иначе null, а не пустой список из noload)
+    deal_response.history = None
     if include_history:
-        history_records = db.query(DealHistory).filter(
-            DealHistory.deal_id == deal_id
-        ).order_by(DealHistory.created_at.desc()).all()
-        
-        history_list = []
-        for h in history_records:
-            # Используем денормализованные данные или загружаем из БД
-            user_email = h.user_email
-            user_name = h.user_name
-            user_role = h.user_role
-            
-            if not user_name or not user_email or not user_role:
-                user = db.query(User).filter(User.id == h.user_id).first()
-                if user:
-                    user_email = user_email or user.email
-                    user_name = user_name or user.full_name
-                    user_role = user_role or user.role
-            
-            history_list.append(DealHistoryResponse(
-                id=h.id,
-                deal_id=h.deal_id,
-                user_id=h.user_id,
-                user_email=user_email,
-                user_name=user_name,
-                user_role=user_role,
-                action=h.action,
-                changes=h.changes,
-                comment=h.comment,
-                created_at=h.created_at
-            ))
-        response.history = history_list
-    
-    return response
+        history_records = query_deal_history(db, deal_id, history_limit)
+        set_history_cursor(response, history_records, history_limit)
+        deal_response.history = build_history_responses(db, history_records)
+    
+    return deal_response
 
 
 @router.get("/{deal_id}/history", response_model=List[DealHistoryResponse])
-def get_deal_history(
+async def get_deal_history(
     deal_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    response: Response,
+    limit: int = Query(50, ge=1, le=DEAL_HISTORY_MAX_LIMIT, description="Page size"),
+    cursor: str | None = Query(None, description="Opaque cursor from X-Next-Cursor header"),
+    action: List[DealHistoryActionRU] | None = Query(None, description="Filter by action as stored in history, e.g. Создано (repeatable)"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user_async)
 ):
-    """Получить историю изменений сделки"""
-    deal = db.query(Deal).filter(Deal.id == deal_id).first()
+    """Получить историю изменений сделки (новые записи первыми).
+
+    Если страница заполнена целиком, курсор следующей страницы
+    возвращается в заголовке X-Next-Cursor.
+    """
+    return await db.run_sync(build_deal_history_page, response, deal_id, current_user, limit, cursor, action)
+
+
+def build_deal_history_page(
+    db: Session,
+    response: Response,
+    deal_id: int,
+    current_user,
+    limit: int = 50,
+    cursor: str | None = None,
+    action: List[DealHistoryActionRU] | None = None
+) -> List[DealHistoryResponse]:
+    """Страница истории сделки (sync Session: вызывается через AsyncSession.run_sync)"""
+    deal = db.query(Deal.id, Deal.manager_id).filter(Deal.id == deal_id).first()
     if not deal:
         raise HTTPException(status_code=404, detail="Deal not found")
     
@@ -348,38 +392,16 @@ def get_deal_history(
     if current_user.role == UserRole.MANAGER and deal.manager_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    history_records = db.query(DealHistory).filter(
-        DealHistory.deal_id == deal_id
-    ).order_by(DealHistory.created_at.desc()).all()
+    cursor_value = None
+    if cursor:
+        cursor_value = decode_deal_cursor(cursor)
+        if cursor_value is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    result = []
-    for h in history_records:
-        # Используем денормализованные данные или загружаем из БД
-        user_email = h.user_email
-        user_name = h.user_name
-        user_role = h.user_role
-        
-        if not user_name or not user_email or not user_role:
-            user = db.query(User).filter(User.id == h.user_id).first()
-            if user:
-                user_email = user_email or user.email
-                user_name = user_name or user.full_name
-                user_role = user_role or user.role
-        
-        result.append(DealHistoryResponse(
-            id=h.id,
-            deal_id=h.deal_id,
-            user_id=h.user_id,
-            user_email=user_email,
-            user_name=user_name,
-            user_role=user_role,
-            action=h.action,
-            changes=h.changes,
-            comment=h.comment,
-            created_at=h.created_at
-        ))
+    history_records = query_deal_history(db, deal_id, limit, cursor_value, actions=action)
+    set_history_cursor(response, history_records, limit)
     
-    return result
+    return build_history_responses(db, history_records)
 
 
 @router.get("/{deal_id}/income", response_model=DealIncomeResponse)
@@ -834,6 +856,7 @@ def update_deal(
             user=current_user
         )
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -857,6 +880,7 @@ def submit_for_calculation(
         raise HTTPException(status_code=400, detail="Deal cannot be submitted")
     
     deal.status = DealStatus.CALCULATION_PENDING.value
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -884,6 +908,7 @@ def client_agreed_to_pay(
     
     from datetime import datetime
     deal.status = DealStatus.CLIENT_AGREED_TO_PAY.value
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -930,6 +955,7 @@ def confirm_client_payment(
         deal.is_client_debt = False
         deal.status = DealStatus.EXECUTION.value
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -978,6 +1004,7 @@ def pay_debt(
         if deal.status == DealStatus.CLIENT_PARTIALLY_PAID.value:
             deal.status = DealStatus.EXECUTION.value
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
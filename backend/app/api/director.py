@@ -6,6 +6,8 @@ from app.core.permissions import require_permission
 from app.models.user import User, UserRole
 from app.models.deal import Deal, DealStatus
 from app.schemas.deal import DealResponse, DealListResponse
+from app.services.deal_list import build_deal_list_query, build_deal_list_response
+from app.services.deal_stats_rollup import refresh_deal_daily_stats
 
 router = APIRouter(prefix="/director", tags=["director"])
 
@@ -16,30 +18,11 @@ def get_pending_approvals(
     current_user: User = Depends(require_permission("exchanges.deals.read_all"))
 ):
     """Список заявок на утверждение (ФинДиректор)"""
-    deals = db.query(Deal).filter(
+    rows = build_deal_list_query(db).filter(
         Deal.status == DealStatus.DIRECTOR_APPROVAL_PENDING.value
     ).order_by(Deal.created_at.desc()).all()
     
-    result = []
-    for deal in deals:
-        from app.models.transaction import Transaction, TransactionStatus
-        transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
-        paid_count = sum(1 for t in transactions if t.status == TransactionStatus.PAID)
-        
-        result.append(DealListResponse(
-            id=deal.id,
-            client_id=deal.client_id,
-            client_name=deal.client.name if deal.client else None,
-            total_eur_request=deal.total_eur_request,
-            total_usdt_calculated=deal.total_usdt_calculated,
-            status=deal.status,
-            created_at=deal.created_at,
-            progress={"paid": paid_count, "total": len(transactions)} if transactions else None,
-            client_debt_amount=deal.client_debt_amount,
-            client_paid_amount=deal.client_paid_amount
-        ))
-    
-    return result
+    return build_deal_list_response(rows)
 
 
 @router.post("/{deal_id}/approve", response_model=DealResponse)
@@ -61,6 +44,7 @@ def approve_deal(
     deal.approved_at = datetime.utcnow()
     deal.approved_by = current_user.id
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -84,6 +68,7 @@ def reject_deal(
     deal.status = DealStatus.DIRECTOR_REJECTED.value
     deal.director_comment = comment
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import desc, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from typing import List
 from decimal import Decimal
 from datetime import datetime
-from app.core.database import get_db
-from app.core.dependencies import get_current_active_user
-from app.core.permissions import require_permission
+from app.core.database import get_db, get_async_db
+from app.core.permissions import require_permission, require_permission_async
 from app.models.user import User
 from app.models.exchange_rate_transaction import ExchangeRateTransaction, TransactionType
 from app.models.exchange_rate_average import ExchangeRateAverage
@@ -37,21 +38,24 @@ def update_exchange_rate_average(
     - INCOME: Add to balance and total_value, recalculate average_rate
     - EXPENSE: Reduce balance and total_value proportionally, keep average_rate unchanged
     """
-    # Get or create the average record
-    avg_record = db.query(ExchangeRateAverage).filter(
-        ExchangeRateAverage.currency_from == currency_from,
-        ExchangeRateAverage.currency_to == currency_to
-    ).first()
-    
-    if not avg_record:
-        avg_record = ExchangeRateAverage(
+    # Get or create the average record. INSERT ... ON CONFLICT DO NOTHING lets
+    # concurrent first postings for a new pair race safely on uq_currency_pair.
+    db.execute(
+        pg_insert(ExchangeRateAverage).values(
             currency_from=currency_from,
             currency_to=currency_to,
             balance=Decimal(0),
             total_value=Decimal(0),
             average_rate=Decimal(0)
-        )
-        db.add(avg_record)
+        ).on_conflict_do_nothing(constraint='uq_currency_pair')
+    )
+    
+    # Lock the pair row (SELECT ... FOR UPDATE) until the caller commits,
+    # so concurrent postings are applied one after another without lost updates
+    avg_record = db.query(ExchangeRateAverage).filter(
+        ExchangeRateAverage.currency_from == currency_from,
+        ExchangeRateAverage.currency_to == currency_to
+    ).with_for_update().populate_existing().one()
     
     if transaction_type == TransactionType.INCOME:
         # Income: Add to balance, add to total value, recalculate average
@@ -91,12 +95,59 @@ def update_exchange_rate_average(
         # Average rate stays the same (not recalculated)
     
     avg_record.last_updated = datetime.utcnow()
-    db.commit()
-    db.refresh(avg_record)
+    # Flush only: the caller commits the posting, its history and the average together
+    db.flush()
     
     return avg_record
 
 
+def record_exchange_rate_transaction(
+    db: Session,
+    transaction_data: ExchangeRateTransactionCreate,
+    transaction_type: TransactionType,
+    value_in_target: Decimal,
+    created_by: int
+) -> ExchangeRateTransaction:
+    """
+    Apply a posting to the pair average and add its transaction record.
+    
+    The record is created only after update_exchange_rate_average has locked
+    the pair row, so its id and created_at are taken in the same order in which
+    postings update the running totals, and history ordered by id shows the
+    stored balance_after/average_rate_after in the order they were computed.
+    """
+    avg_record = update_exchange_rate_average(
+        db=db,
+        currency_from=transaction_data.currency_from,
+        currency_to=transaction_data.currency_to,
+        transaction_type=transaction_type,
+        amount=transaction_data.amount,
+        exchange_rate=transaction_data.exchange_rate
+    )
+    
+    # Store the pair state after this posting so history needs no replay
+    transaction = ExchangeRateTransaction(
+        internal_company_account_id=transaction_data.internal_company_account_id,
+        crypto_account_id=transaction_data.crypto_account_id,
+        transaction_type=transaction_type,
+        amount=transaction_data.amount,
+        currency_from=transaction_data.currency_from,
+        currency_to=transaction_data.currency_to,
+        exchange_rate=transaction_data.exchange_rate,
+        value_in_target_currency=value_in_target,
+        balance_after=avg_record.balance,
+        total_value_after=avg_record.total_value,
+        average_rate_after=avg_record.average_rate,
+        comment=transaction_data.comment,
+        created_by=created_by,
+        created_at=datetime.utcnow()
+    )
+    db.add(transaction)
+    db.flush()
+    
+    return transaction
+
+
 @router.post("/income", response_model=ExchangeRateTransactionResponse)
 def create_income_transaction(
     transaction_data: ExchangeRateTransactionCreate,
@@ -115,19 +166,19 @@ def create_income_transaction(
     if transaction_data.internal_company_account_id and transaction_data.crypto_account_id:
         raise HTTPException(status_code=400, detail="Specify only one account type")
     
-    # Validate account exists and get it
+    # Validate account exists and lock it for the balance update
     account = None
     if transaction_data.internal_company_account_id:
         account = db.query(InternalCompanyAccount).filter(
             InternalCompanyAccount.id == transaction_data.internal_company_account_id
-        ).first()
+        ).with_for_update().first()
         if not account:
             raise HTTPException(status_code=404, detail="Company account not found")
     
     if transaction_data.crypto_account_id:
         account = db.query(AccountBalance).filter(
             AccountBalance.id == transaction_data.crypto_account_id
-        ).first()
+        ).with_for_update().first()
         if not account:
             raise HTTPException(status_code=404, detail="Crypto account not found")
     
@@ -164,29 +215,9 @@ def create_income_transaction(
         )
         db.add(history)
     
-    # Create transaction record
-    transaction = ExchangeRateTransaction(
-        internal_company_account_id=transaction_data.internal_company_account_id,
-        crypto_account_id=transaction_data.crypto_account_id,
-        transaction_type=TransactionType.INCOME,
-        amount=transaction_data.amount,
-        currency_from=transaction_data.currency_from,
-        currency_to=transaction_data.currency_to,
-        exchange_rate=transaction_data.exchange_rate,
-        value_in_target_currency=value_in_target,
-        comment=transaction_data.comment,
-        created_by=current_user.id
-    )
-    db.add(transaction)
-    
-    # Update average exchange rate
-    update_exchange_rate_average(
-        db=db,
-        currency_from=transaction_data.currency_from,
-        currency_to=transaction_data.currency_to,
-        transaction_type=TransactionType.INCOME,
-        amount=transaction_data.amount,
-        exchange_rate=transaction_data.exchange_rate
+    # Update average exchange rate and create transaction record
+    transaction = record_exchange_rate_transaction(
+        db, transaction_data, TransactionType.INCOME, value_in_target, current_user.id
     )
     
     db.commit()
@@ -213,19 +244,19 @@ def create_expense_transaction(
     if transaction_data.internal_company_account_id and transaction_data.crypto_account_id:
         raise HTTPException(status_code=400, detail="Specify only one account type")
     
-    # Validate account exists and get it
+    # Validate account exists and lock it for the balance update
     account = None
     if transaction_data.internal_company_account_id:
         account = db.query(InternalCompanyAccount).filter(
             InternalCompanyAccount.id == transaction_data.internal_company_account_id
-        ).first()
+        ).with_for_update().first()
         if not account:
             raise HTTPException(status_code=404, detail="Company account not found")
     
     if transaction_data.crypto_account_id:
         account = db.query(AccountBalance).filter(
             AccountBalance.id == transaction_data.crypto_account_id
-        ).first()
+        ).with_for_update().first()
         if not account:
             raise HTTPException(status_code=404, detail="Crypto account not found")
     
@@ -269,29 +300,9 @@ def create_expense_transaction(
         )
         db.add(history)
     
-    # Create transaction record
-    transaction = ExchangeRateTransaction(
-        internal_company_account_id=transaction_data.internal_company_account_id,
-        crypto_account_id=transaction_data.crypto_account_id,
-        transaction_type=TransactionType.EXPENSE,
-        amount=transaction_data.amount,
-        currency_from=transaction_data.currency_from,
-        currency_to=transaction_data.currency_to,
-        exchange_rate=transaction_data.exchange_rate,
-        value_in_target_currency=value_in_target,
-        comment=transaction_data.comment,
-        created_by=current_user.id
-    )
-    db.add(transaction)
-    
-    # Update average exchange rate (balance reduces, average stays same)
-    update_exchange_rate_average(
-        db=db,
-        currency_from=transaction_data.currency_from,
-        currency_to=transaction_data.currency_to,
-        transaction_type=TransactionType.EXPENSE,
-        amount=transaction_data.amount,
-        exchange_rate=transaction_data.exchange_rate
+    # Update average exchange rate and create transaction record (balance reduces, average stays same)
+    transaction = record_exchange_rate_transaction(
+        db, transaction_data, TransactionType.EXPENSE, value_in_target, current_user.id
     )
     
     db.commit()
@@ -301,75 +312,55 @@ def create_expense_transaction(
 
 
 @router.get("/averages", response_model=List[ExchangeRateAverageResponse])
-def get_exchange_rate_averages(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("balances.read"))
+async def get_exchange_rate_averages(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("balances.read"))
 ):
     """Get all currency pair average exchange rates"""
     
-    averages = db.query(ExchangeRateAverage).order_by(
+    averages = await db.scalars(select(ExchangeRateAverage).order_by(
         ExchangeRateAverage.currency_from,
         ExchangeRateAverage.currency_to
-    ).all()
+    ))
     
-    return averages
+    return averages.all()
 
 
 @router.get("/history", response_model=List[ExchangeRateHistoryItem])
-def get_exchange_rate_history(
+async def get_exchange_rate_history(
     currency_from: str = Query(..., description="Source currency (e.g., EUR)"),
     currency_to: str = Query(..., description="Target currency (e.g., USD)"),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("balances.read"))
+    limit: int | None = Query(None, ge=1, description="Page size (full history if not set)"),
+    offset: int = Query(0, ge=0, description="Number of transactions to skip"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("balances.read"))
 ):
     """Get transaction history for a specific currency pair with running calculations"""
     
-    # Get all transactions for this currency pair, ordered by date
-    transactions = db.query(ExchangeRateTransaction).filter(
+    # Running balance/average are stored on each transaction at posting time,
+    # and ids are taken under the pair lock in posting order, so a page is a
+    # plain range scan over ix_exchange_rate_transactions_pair_id
+    query = select(ExchangeRateTransaction).where(
         ExchangeRateTransaction.currency_from == currency_from,
         ExchangeRateTransaction.currency_to == currency_to
-    ).order_by(ExchangeRateTransaction.created_at).all()
-    
-    # Calculate running balance and average rate
-    history_items = []
-    running_balance = Decimal(0)
-    running_total_value = Decimal(0)
-    
-    for trans in transactions:
-        if trans.transaction_type == TransactionType.INCOME:
-            # Income: Add to balance and total value
-            running_balance += trans.amount
-            running_total_value += trans.value_in_target_currency
-        elif trans.transaction_type == TransactionType.EXPENSE:
-            # Expense: Reduce balance proportionally
-            if running_balance > 0 and running_total_value > 0:
-                current_avg = running_total_value / running_balance
-                value_reduced = trans.amount * current_avg
-            else:
-                value_reduced = Decimal(0)
-            
-            running_balance -= trans.amount
-            running_total_value -= value_reduced
-        
-        # Calculate average rate after this transaction
-        if running_balance > 0:
-            avg_rate_after = running_total_value / running_balance
-        else:
-            avg_rate_after = Decimal(0)
-        
-        history_items.append(ExchangeRateHistoryItem(
+    ).order_by(ExchangeRateTransaction.id).offset(offset)
+    if limit:
+        query = query.limit(limit)
+    transactions = await db.scalars(query)
+    
+    return [
+        ExchangeRateHistoryItem(
             id=trans.id,
             transaction_type=trans.transaction_type,
             amount=trans.amount,
             exchange_rate=trans.exchange_rate,
             value_in_target_currency=trans.value_in_target_currency,
-            balance_after=running_balance,
-            total_value_after=running_total_value,
-            average_rate_after=avg_rate_after,
+            balance_after=trans.balance_after,
+            total_value_after=trans.total_value_after,
+            average_rate_after=trans.average_rate_after,
             comment=trans.comment,
             created_at=trans.created_at,
             created_by=trans.created_by
-        ))
-    
-    return history_items
-
+        )
+        for trans in transactions
+    ]
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from datetime import datetime
 from decimal import Decimal
-from app.core.database import get_db
-from app.core.dependencies import get_current_active_user
-from app.core.permissions import require_permission
+from app.core.database import get_db, get_async_db
+from app.core.dependencies import get_current_active_user_async
+from app.core.permissions import require_permission, require_permission_async
 from app.models.user import User
 from app.models.client import Client
 from app.models.company import Company
@@ -15,6 +17,7 @@ from app.models.route_commission import RouteCommission
 from app.models.internal_company import InternalCompany
 from app.models.internal_company_account import InternalCompanyAccount
 from app.models.currency import Currency
+from app.services.commission_cache import invalidate_commission_cache
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/reference", tags=["reference"])
@@ -48,13 +51,13 @@ class ClientResponse(BaseModel):
 
 
 @router.get("/clients", response_model=List[ClientResponse])
-def get_clients(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+async def get_clients(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить список клиентов"""
-    clients = db.query(Client).filter(Client.is_active == True).all()
-    return clients
+    clients = await db.scalars(select(Client).where(Client.is_active == True))
+    return clients.all()
 
 
 @router.post("/clients", response_model=ClientResponse, status_code=status.HTTP_201_CREATED)
@@ -149,27 +152,27 @@ class CompanyResponse(BaseModel):
 
 
 @router.get("/companies", response_model=List[CompanyResponse])
-def get_companies(
+async def get_companies(
     client_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.companies.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.companies.read"))
 ):
     """Получить список компаний"""
-    query = db.query(Company)
+    query = select(Company)
     if client_id:
-        query = query.filter(Company.client_id == client_id)
-    companies = query.all()
-    return companies
+        query = query.where(Company.client_id == client_id)
+    companies = await db.scalars(query)
+    return companies.all()
 
 
 @router.get("/companies/{company_id}", response_model=CompanyResponse)
-def get_company(
+async def get_company(
     company_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.companies.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.companies.read"))
 ):
     """Получить компанию по ID"""
-    company = db.query(Company).filter(Company.id == company_id).first()
+    company = await db.get(Company, company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     return company
@@ -266,30 +269,30 @@ class CompanyAccountResponse(BaseModel):
 
 
 @router.get("/company-accounts", response_model=List[CompanyAccountResponse])
-def get_company_accounts(
+async def get_company_accounts(
     company_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.accounts.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.accounts.read"))
 ):
     """Получить список счетов компаний"""
-    query = db.query(CompanyAccount).filter(CompanyAccount.is_active == True)
+    query = select(CompanyAccount).where(CompanyAccount.is_active == True)
     if company_id:
-        query = query.filter(CompanyAccount.company_id == company_id)
-    accounts = query.all()
-    return accounts
+        query = query.where(CompanyAccount.company_id == company_id)
+    accounts = await db.scalars(query)
+    return accounts.all()
 
 
 @router.get("/company-accounts/{account_id}", response_model=CompanyAccountResponse)
-def get_company_account(
+async def get_company_account(
     account_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.accounts.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.accounts.read"))
 ):
     """Получить счет компании по ID"""
-    account = db.query(CompanyAccount).filter(
+    account = await db.scalar(select(CompanyAccount).where(
         CompanyAccount.id == account_id,
         CompanyAccount.is_active == True
-    ).first()
+    ))
     if not account:
         raise HTTPException(status_code=404, detail="Company account not found")
     return account
@@ -378,13 +381,13 @@ class AgentResponse(BaseModel):
         from_attributes = True
 
 @router.get("/agents", response_model=List[AgentResponse])
-def get_agents(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+async def get_agents(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить список агентов"""
-    agents = db.query(Agent).filter(Agent.is_active == True).all()
-    return agents
+    agents = await db.scalars(select(Agent).where(Agent.is_active == True))
+    return agents.all()
 
 @router.post("/agents", response_model=AgentResponse, status_code=status.HTTP_201_CREATED)
 def create_agent(
@@ -476,17 +479,17 @@ class RouteCommissionResponse(BaseModel):
         from_attributes = True
 
 @router.get("/route-commissions", response_model=List[RouteCommissionResponse])
-def get_route_commissions(
+async def get_route_commissions(
     route_type: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить список комиссий маршрутов"""
-    query = db.query(RouteCommission).filter(RouteCommission.is_active == True)
+    query = select(RouteCommission).where(RouteCommission.is_active == True)
     if route_type:
-        query = query.filter(RouteCommission.route_type == route_type)
-    commissions = query.all()
-    return commissions
+        query = query.where(RouteCommission.route_type == route_type)
+    commissions = await db.scalars(query)
+    return commissions.all()
 
 @router.post("/route-commissions", response_model=RouteCommissionResponse, status_code=status.HTTP_201_CREATED)
 def create_route_commission(
@@ -516,6 +519,7 @@ def create_route_commission(
     )
     db.add(db_commission)
     db.commit()
+    invalidate_commission_cache()
     db.refresh(db_commission)
     return db_commission
 
@@ -535,6 +539,7 @@ def update_route_commission(
         setattr(commission, field, value)
     
     db.commit()
+    invalidate_commission_cache()
     db.refresh(commission)
     return commission
 
@@ -551,6 +556,7 @@ def delete_route_commission(
     
     commission.is_active = False
     db.commit()
+    invalidate_commission_cache()
     return None
 
 
@@ -577,22 +583,22 @@ class InternalCompanyResponse(BaseModel):
         from_attributes = True
 
 @router.get("/internal-companies", response_model=List[InternalCompanyResponse])
-def get_internal_companies(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.companies.read"))
+async def get_internal_companies(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.companies.read"))
 ):
     """Получить список внутренних компаний"""
-    companies = db.query(InternalCompany).all()
-    return companies
+    companies = await db.scalars(select(InternalCompany))
+    return companies.all()
 
 @router.get("/internal-companies/{company_id}", response_model=InternalCompanyResponse)
-def get_internal_company(
+async def get_internal_company(
     company_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.companies.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.companies.read"))
 ):
     """Получить внутреннюю компанию по ID"""
-    company = db.query(InternalCompany).filter(InternalCompany.id == company_id).first()
+    company = await db.get(InternalCompany, company_id)
     if not company:
         raise HTTPException(status_code=404, detail="Internal company not found")
     return company
@@ -680,17 +686,17 @@ class InternalCompanyAccountResponse(BaseModel):
         from_attributes = True
 
 @router.get("/internal-company-accounts", response_model=List[InternalCompanyAccountResponse])
-def get_internal_company_accounts(
+async def get_internal_company_accounts(
     company_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.accounts.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.accounts.read"))
 ):
     """Получить список счетов внутренних компаний"""
-    query = db.query(InternalCompanyAccount).filter(InternalCompanyAccount.is_active == True)
+    query = select(InternalCompanyAccount).where(InternalCompanyAccount.is_active == True)
     if company_id:
-        query = query.filter(InternalCompanyAccount.company_id == company_id)
-    accounts = query.all()
-    return accounts
+        query = query.where(InternalCompanyAccount.company_id == company_id)
+    accounts = await db.scalars(query)
+    return accounts.all()
 
 @router.post("/internal-company-accounts", response_model=InternalCompanyAccountResponse, status_code=status.HTTP_201_CREATED)
 def create_internal_company_account(
@@ -769,23 +775,23 @@ class CompanyAccountHistoryResponse(BaseModel):
 
 
 @router.get("/internal-company-accounts/{account_id}/history", response_model=List[CompanyAccountHistoryResponse])
-def get_company_account_history(
+async def get_company_account_history(
     account_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user_async)
 ):
     """Получить историю изменений баланса фиатного счёта компании"""
     from app.models.internal_company_account_history import InternalCompanyAccountHistory
     
-    account = db.query(InternalCompanyAccount).filter(InternalCompanyAccount.id == account_id).first()
-    if not account:
+    account_exists = await db.scalar(select(InternalCompanyAccount.id).where(InternalCompanyAccount.id == account_id))
+    if not account_exists:
         raise HTTPException(status_code=404, detail="Internal company account not found")
     
-    history = db.query(InternalCompanyAccountHistory).filter(
+    history = await db.scalars(select(InternalCompanyAccountHistory).where(
         InternalCompanyAccountHistory.account_id == account_id
-    ).order_by(InternalCompanyAccountHistory.created_at.desc()).all()
+    ).order_by(InternalCompanyAccountHistory.created_at.desc()))
     
-    return history
+    return history.all()
 
 
 # ========== Валюты ==========
@@ -812,13 +818,13 @@ class CurrencyResponse(BaseModel):
         from_attributes = True
 
 @router.get("/currencies", response_model=List[CurrencyResponse])
-def get_currencies(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+async def get_currencies(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить список валют"""
-    currencies = db.query(Currency).filter(Currency.is_active == True).all()
-    return currencies
+    currencies = await db.scalars(select(Currency).where(Currency.is_active == True))
+    return currencies.all()
 
 @router.post("/currencies", response_model=CurrencyResponse, status_code=status.HTTP_201_CREATED)
 def create_currency(
@@ -904,23 +910,22 @@ class ManagerCommissionUpdate(BaseModel):
 
 
 @router.get("/manager-commissions", response_model=List[ManagerCommissionResponse])
-def get_manager_commissions(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+async def get_manager_commissions(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить список комиссий менеджеров (с информацией о пользователях)"""
     from app.models.user import User as UserModel
     
-    # Получаем всех пользователей
-    users = db.query(UserModel).filter(UserModel.is_active == "true").all()
+    # Активные пользователи с комиссией (не более одной на пользователя) - одним запросом
+    rows = await db.execute(
+        select(UserModel, ManagerCommission).outerjoin(
+            ManagerCommission, ManagerCommission.user_id == UserModel.id
+        ).where(UserModel.is_active == "true")
+    )
     
     result = []
-    for user in users:
-        # Ищем комиссию для пользователя
-        commission = db.query(ManagerCommission).filter(
-            ManagerCommission.user_id == user.id
-        ).first()
-        
+    for user, commission in rows:
         result.append(ManagerCommissionResponse(
             id=commission.id if commission else 0,
             user_id=user.id,
@@ -1002,23 +1007,23 @@ class SystemSettingUpdate(BaseModel):
 
 
 @router.get("/settings", response_model=List[SystemSettingResponse])
-def get_system_settings(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+async def get_system_settings(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить все системные настройки"""
-    settings = db.query(SystemSetting).all()
-    return settings
+    settings = await db.scalars(select(SystemSetting))
+    return settings.all()
 
 
 @router.get("/settings/{key}", response_model=SystemSettingResponse)
-def get_system_setting(
+async def get_system_setting(
     key: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("references.clients.read"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("references.clients.read"))
 ):
     """Получить системную настройку по ключу"""
-    setting = db.query(SystemSetting).filter(SystemSetting.key == key).first()
+    setting = await db.scalar(select(SystemSetting).where(SystemSetting.key == key))
     if not setting:
         raise HTTPException(status_code=404, detail="Setting not found")
     return setting
@@ -1050,11 +1055,11 @@ def update_system_setting(
 
 
 @router.get("/default-client-rate")
-def get_default_client_rate(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+async def get_default_client_rate(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_active_user_async)
 ):
     """Получить ставку клиента по умолчанию"""
-    setting = db.query(SystemSetting).filter(SystemSetting.key == "default_client_rate").first()
-    return {"default_client_rate": setting.value if setting else "2.0"}
+    value = await db.scalar(select(SystemSetting.value).where(SystemSetting.key == "default_client_rate"))
+    return {"default_client_rate": value if value is not None else "2.0"}
 
@@ -9,6 +9,8 @@ from app.models.user import User, UserRole
 from app.models.deal import Deal, DealStatus
 from app.models.transaction import Transaction, RouteType
 from app.schemas.deal import DealResponse, DealListResponse
+from app.services.deal_list import build_deal_list_query, build_deal_list_response
+from app.services.deal_stats_rollup import refresh_deal_daily_stats
 from pydantic import BaseModel, field_validator
 
 router = APIRouter(prefix="/senior-manager", tags=["senior-manager"])
@@ -60,30 +62,11 @@ def get_pending_deals(
     current_user: User = Depends(require_permission("exchanges.deals.review"))
 ):
     """Список сделок на проверку главным менеджером"""
-    deals = db.query(Deal).filter(
+    rows = build_deal_list_query(db).filter(
         Deal.status == DealStatus.NEW.value
     ).order_by(Deal.created_at.desc()).all()
     
-    result = []
-    for deal in deals:
-        transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
-        paid_count = sum(1 for t in transactions if (t.status.value if hasattr(t.status, 'value') else str(t.status)) == "paid")
-        
-        result.append(DealListResponse(
-            id=deal.id,
-            client_id=deal.client_id,
-            client_name=deal.client.name if deal.client else None,
-            total_eur_request=deal.total_eur_request,
-            total_usdt_calculated=deal.total_usdt_calculated,
-            status=deal.status,
-            created_at=deal.created_at,
-            transactions_count=len(transactions),
-            paid_transactions_count=paid_count,
-            client_debt_amount=deal.client_debt_amount,
-            client_paid_amount=deal.client_paid_amount
-        ))
-    
-    return result
+    return build_deal_list_response(rows)
 
 
 @router.get("/{deal_id}", response_model=DealResponse)
@@ -161,6 +144,7 @@ def update_deal_before_approval(
             if route_update.bank_fee_percent is not None:
                 transaction.bank_fee_percent = route_update.bank_fee_percent
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -224,6 +208,7 @@ def approve_deal(
     deal.senior_manager_comment = approve_data.comment
     deal.approved_by_senior_manager_at = datetime.utcnow()
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
@@ -255,6 +240,7 @@ def reject_deal(
     deal.senior_manager_comment = reject_data.comment
     deal.approved_by_senior_manager_at = datetime.utcnow()
     
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(deal)
     return deal
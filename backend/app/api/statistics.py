@@ -1,29 +1,146 @@
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func, and_, case
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from typing import Optional
 from decimal import Decimal
 
-from app.core.database import get_db
-from app.core.dependencies import get_current_active_user
-from app.core.permissions import require_permission
+from app.core.database import get_async_db
+from app.core.permissions import require_permission_async
 from app.models.user import User
 from app.models.deal import Deal, DealStatus
 from app.models.transaction import Transaction, TransactionStatus
 from app.models.client import Client
+from app.models.deal_daily_stats import DealDailyStats, DealDailyRouteStats
+from app.services.deal_stats_rollup import get_rollup_rebuilt_at
 
 router = APIRouter(prefix="/statistics", tags=["statistics"])
 
 
+def _period_start(day: date, granularity: str) -> date:
+    """Начало периода, как его считает date_trunc в PostgreSQL"""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(period: date, granularity: str) -> date:
+    """Начало следующего периода"""
+    if granularity == "week":
+        return period + timedelta(days=7)
+    if granularity == "month":
+        if period.month == 12:
+            return period.replace(year=period.year + 1, month=1)
+        return period.replace(month=period.month + 1)
+    return period + timedelta(days=1)
+
+
+def get_dashboard_summary_totals(
+    db: Session,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> dict:
+    """
+    Сводные показатели дашборда одним запросом (условная агрегация FILTER).
+    
+    Возвращает количество всех и завершённых сделок, суммы по завершённым
+    сделкам и суммы задолженностей за период.
+    """
+    is_completed = Deal.status == DealStatus.COMPLETED.value
+    is_debt = and_(Deal.is_client_debt == True, Deal.client_debt_amount > 0)
+    
+    query = db.query(
+        func.count(Deal.id).label('total_deals'),
+        func.count(Deal.id).filter(is_completed).label('completed_deals'),
+        func.sum(Deal.total_eur_request).filter(is_completed).label('total_eur'),
+        func.sum(Deal.total_usdt_calculated).filter(is_completed).label('total_usdt'),
+        func.sum(Deal.total_cost_usdt).filter(is_completed).label('total_cost'),
+        func.sum(Deal.net_profit_usdt).filter(is_completed).label('total_profit'),
+        func.sum(Deal.client_debt_amount).filter(is_debt).label('total_debt'),
+        func.count(Deal.id).filter(is_debt).label('deals_with_debt')
+    )
+    if start:
+        query = query.filter(Deal.created_at >= start)
+    if end:
+        query = query.filter(Deal.created_at <= end)
+    
+    row = query.one()
+    return {
+        'total_deals': row.total_deals or 0,
+        'completed_deals': row.completed_deals or 0,
+        'total_eur': row.total_eur or Decimal('0'),
+        'total_usdt': row.total_usdt or Decimal('0'),
+        'total_cost': row.total_cost or Decimal('0'),
+        'total_profit': row.total_profit or Decimal('0'),
+        'total_debt': row.total_debt or Decimal('0'),
+        'deals_with_debt': row.deals_with_debt or 0,
+    }
+
+
+def get_dashboard_summary_totals_from_rollup(
+    db: Session,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> dict:
+    """То же, что get_dashboard_summary_totals, но по дневным агрегатам deal_daily_stats"""
+    is_completed = DealDailyStats.status == DealStatus.COMPLETED.value
+    
+    query = db.query(
+        func.sum(DealDailyStats.deals_count).label('total_deals'),
+        func.sum(DealDailyStats.deals_count).filter(is_completed).label('completed_deals'),
+        func.sum(DealDailyStats.total_eur).filter(is_completed).label('total_eur'),
+        func.sum(DealDailyStats.total_usdt).filter(is_completed).label('total_usdt'),
+        func.sum(DealDailyStats.total_cost_usdt).filter(is_completed).label('total_cost'),
+        func.sum(DealDailyStats.net_profit_usdt).filter(is_completed).label('total_profit'),
+        func.sum(DealDailyStats.debt_amount).label('total_debt'),
+        func.sum(DealDailyStats.debt_deals_count).label('deals_with_debt')
+    )
+    query = _filter_rollup_days(query, DealDailyStats, start, end)
+    
+    row = query.one()
+    return {
+        'total_deals': int(row.total_deals or 0),
+        'completed_deals': int(row.completed_deals or 0),
+        'total_eur': row.total_eur or Decimal('0'),
+        'total_usdt': row.total_usdt or Decimal('0'),
+        'total_cost': row.total_cost or Decimal('0'),
+        'total_profit': row.total_profit or Decimal('0'),
+        'total_debt': row.total_debt or Decimal('0'),
+        'deals_with_debt': int(row.deals_with_debt or 0),
+    }
+
+
+def _filter_rollup_days(query, model, start: Optional[datetime], end: Optional[datetime]):
+    """Фильтр по дням для таблиц агрегатов (границы периода - целые дни)"""
+    if start:
+        query = query.filter(model.day >= start.date())
+    if end:
+        query = query.filter(model.day <= end.date())
+    return query
+
+
 @router.get("/dashboard")
-def get_dashboard_statistics(
+async def get_dashboard_statistics(
     start_date: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
     end_date: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(require_permission("exchanges.statistics.read"))
+    granularity: str = Query("day", pattern="^(day|week|month)$", description="Daily stats granularity: day, week or month"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(require_permission_async("exchanges.statistics.read"))
 ):
     """Получить статистику для финансового дашборда."""
+    return await db.run_sync(build_dashboard_statistics, start_date, end_date, granularity)
+
+
+def build_dashboard_statistics(
+    db: Session,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    granularity: str
+) -> dict:
+    """Статистика дашборда (sync Session: вызывается через AsyncSession.run_sync)"""
     
     # Парсим даты
     start = None
@@ -35,39 +152,21 @@ def get_dashboard_statistics(
         # Добавляем конец дня
         end = end.replace(hour=23, minute=59, second=59)
     
-    # Базовый запрос
-    query = db.query(Deal)
-    if start:
-        query = query.filter(Deal.created_at >= start)
-    if end:
-        query = query.filter(Deal.created_at <= end)
+    # Дневные агрегаты используются, если они уже построены (scripts/rebuild_deal_daily_stats.py).
+    # Границы периода всегда целые дни, поэтому агрегатов хватает для любого диапазона.
+    use_rollup = get_rollup_rebuilt_at(db) is not None
     
-    # Общая статистика по сделкам
-    total_deals = query.count()
-    completed_deals = query.filter(Deal.status == DealStatus.COMPLETED.value).count()
-    
-    # Суммы по завершенным сделкам с учетом фильтров по датам
-    completed_filters = [Deal.status == DealStatus.COMPLETED.value]
-    if start:
-        completed_filters.append(Deal.created_at >= start)
-    if end:
-        completed_filters.append(Deal.created_at <= end)
-    
-    total_eur = db.query(func.sum(Deal.total_eur_request)).filter(
-        and_(*completed_filters)
-    ).scalar() or Decimal('0')
-    
-    total_usdt = db.query(func.sum(Deal.total_usdt_calculated)).filter(
-        and_(*completed_filters)
-    ).scalar() or Decimal('0')
-    
-    total_cost = db.query(func.sum(Deal.total_cost_usdt)).filter(
-        and_(*completed_filters)
-    ).scalar() or Decimal('0')
-    
-    total_profit = db.query(func.sum(Deal.net_profit_usdt)).filter(
-        and_(*completed_filters)
-    ).scalar() or Decimal('0')
+    # Сводные суммы по сделкам - одним запросом
+    if use_rollup:
+        totals = get_dashboard_summary_totals_from_rollup(db, start, end)
+    else:
+        totals = get_dashboard_summary_totals(db, start, end)
+    total_deals = totals['total_deals']
+    completed_deals = totals['completed_deals']
+    total_eur = totals['total_eur']
+    total_usdt = totals['total_usdt']
+    total_cost = totals['total_cost']
+    total_profit = totals['total_profit']
     
     # Вычисляем ROI
     roi = Decimal('0')
@@ -80,10 +179,17 @@ def get_dashboard_statistics(
         avg_margin = total_profit / completed_deals
     
     # Статистика по статусам
-    status_stats = db.query(
-        Deal.status,
-        func.count(Deal.id).label('count')
-    ).group_by(Deal.status).all()
+    if use_rollup:
+        status_stats = db.query(
+            DealDailyStats.status,
+            func.sum(DealDailyStats.deals_count).label('count')
+        ).group_by(DealDailyStats.status).all()
+        status_stats = [(status, int(count)) for status, count in status_stats]
+    else:
+        status_stats = db.query(
+            Deal.status,
+            func.count(Deal.id).label('count')
+        ).group_by(Deal.status).all()
     
     # status уже является строкой, так как колонка имеет тип String(50)
     status_breakdown = {str(status): count for status, count in status_stats}
@@ -95,13 +201,24 @@ def get_dashboard_statistics(
     if end:
         route_filters.append(Deal.created_at <= end)
     
-    route_stats = db.query(
-        Transaction.route_type,
-        func.count(Transaction.id).label('count'),
-        func.sum(Transaction.cost_usdt).label('total_cost')
-    ).join(Deal).filter(
-        and_(*route_filters)
-    ).group_by(Transaction.route_type).all()
+    if use_rollup:
+        route_query = db.query(
+            DealDailyRouteStats.route_type,
+            func.sum(DealDailyRouteStats.transactions_count).label('count'),
+            func.sum(DealDailyRouteStats.total_cost_usdt).label('total_cost')
+        ).filter(DealDailyRouteStats.status == DealStatus.COMPLETED.value)
+        route_stats = _filter_rollup_days(
+            route_query, DealDailyRouteStats, start, end
+        ).group_by(DealDailyRouteStats.route_type).all()
+        route_stats = [(route, int(count), cost) for route, count, cost in route_stats]
+    else:
+        route_stats = db.query(
+            Transaction.route_type,
+            func.count(Transaction.id).label('count'),
+            func.sum(Transaction.cost_usdt).label('total_cost')
+        ).join(Deal).filter(
+            and_(*route_filters)
+        ).group_by(Transaction.route_type).all()
     
     route_breakdown = []
     for route, count, cost in route_stats:
@@ -119,15 +236,30 @@ def get_dashboard_statistics(
     if end:
         client_filters.append(Deal.created_at <= end)
     
-    top_clients = db.query(
-        Client.name,
-        func.sum(Deal.total_eur_request).label('total_volume'),
-        func.count(Deal.id).label('deal_count')
-    ).join(Deal).filter(
-        and_(*client_filters)
-    ).group_by(Client.id, Client.name).order_by(
-        func.sum(Deal.total_eur_request).desc()
-    ).limit(5).all()
+    if use_rollup:
+        top_clients_query = db.query(
+            Client.name,
+            func.sum(DealDailyStats.total_eur).label('total_volume'),
+            func.sum(DealDailyStats.deals_count).label('deal_count')
+        ).join(DealDailyStats, DealDailyStats.client_id == Client.id).filter(
+            DealDailyStats.status == DealStatus.COMPLETED.value
+        )
+        top_clients = _filter_rollup_days(
+            top_clients_query, DealDailyStats, start, end
+        ).group_by(Client.id, Client.name).order_by(
+            func.sum(DealDailyStats.total_eur).desc()
+        ).limit(5).all()
+        top_clients = [(name, volume, int(count)) for name, volume, count in top_clients]
+    else:
+        top_clients = db.query(
+            Client.name,
+            func.sum(Deal.total_eur_request).label('total_volume'),
+            func.count(Deal.id).label('deal_count')
+        ).join(Deal).filter(
+            and_(*client_filters)
+        ).group_by(Client.id, Client.name).order_by(
+            func.sum(Deal.total_eur_request).desc()
+        ).limit(5).all()
     
     top_clients_list = [
         {
@@ -138,38 +270,50 @@ def get_dashboard_statistics(
         for name, total_volume, deal_count in top_clients
     ]
     
-    # Статистика по дням (для графика)
+    # Статистика по дням/неделям/месяцам (для графика) - один запрос с GROUP BY
     daily_stats = []
     if start and end:
-        current = start.date()
-        end_date_only = end.date()
-        while current <= end_date_only:
-            day_start = datetime.combine(current, datetime.min.time())
-            day_end = datetime.combine(current, datetime.max.time())
-            
-            day_profit = db.query(func.sum(Deal.net_profit_usdt)).filter(
-                and_(
-                    Deal.status == DealStatus.COMPLETED.value,
-                    Deal.created_at >= day_start,
-                    Deal.created_at <= day_end
-                )
-            ).scalar() or Decimal('0')
-            
-            day_deals = db.query(func.count(Deal.id)).filter(
+        if use_rollup:
+            bucket = func.date_trunc(granularity, DealDailyStats.day).label('bucket')
+            period_rows = db.query(
+                bucket,
+                func.sum(DealDailyStats.net_profit_usdt).label('profit'),
+                func.sum(DealDailyStats.deals_count).label('deals')
+            ).filter(
+                DealDailyStats.status == DealStatus.COMPLETED.value,
+                DealDailyStats.day >= start.date(),
+                DealDailyStats.day <= end.date()
+            ).group_by(bucket).all()
+        else:
+            bucket = func.date_trunc(granularity, Deal.created_at).label('bucket')
+            period_rows = db.query(
+                bucket,
+                func.sum(Deal.net_profit_usdt).label('profit'),
+                func.count(Deal.id).label('deals')
+            ).filter(
                 and_(
                     Deal.status == DealStatus.COMPLETED.value,
-                    Deal.created_at >= day_start,
-                    Deal.created_at <= day_end
+                    Deal.created_at >= start,
+                    Deal.created_at <= end
                 )
-            ).scalar() or 0
-            
+            ).group_by(bucket).all()
+        
+        period_totals = {
+            period.date(): (profit or Decimal('0'), int(deals or 0))
+            for period, profit, deals in period_rows
+        }
+        
+        # Заполняем пропуски: периоды без сделок идут с нулями
+        current = _period_start(start.date(), granularity)
+        end_date_only = end.date()
+        while current <= end_date_only:
+            period_profit, period_deals = period_totals.get(current, (Decimal('0'), 0))
             daily_stats.append({
                 'date': current.isoformat(),
-                'profit': float(day_profit),
-                'deals': day_deals
+                'profit': float(period_profit),
+                'deals': period_deals
             })
-            
-            current += timedelta(days=1)
+            current = _next_period(current, granularity)
     
     # Статистика по задолженностям клиентов
     debt_filters = [Deal.is_client_debt == True, Deal.client_debt_amount > 0]
@@ -178,17 +322,10 @@ def get_dashboard_statistics(
     if end:
         debt_filters.append(Deal.created_at <= end)
     
-    # Общая сумма задолженностей
-    total_debt = db.query(func.sum(Deal.client_debt_amount)).filter(
-        and_(*debt_filters)
-    ).scalar() or Decimal('0')
-    
-    # Количество сделок с задолженностями
-    deals_with_debt = db.query(func.count(Deal.id)).filter(
-        and_(*debt_filters)
-    ).scalar() or 0
+    total_debt = totals['total_debt']
+    deals_with_debt = totals['deals_with_debt']
     
-    # Детализация по клиентам с задолженностями
+    # Детализация по клиентам с задолженностями (всегда по сделкам: нужна точная дата старейшего долга)
     client_debts = db.query(
         Client.id,
         Client.name,
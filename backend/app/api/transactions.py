@@ -10,9 +10,10 @@ from app.models.user import User, UserRole
 from app.models.deal import Deal, DealStatus
 from app.models.transaction import Transaction, TransactionStatus
 from app.models.account_balance import AccountBalance
-from app.models.account_balance_history import AccountBalanceHistory, BalanceChangeType
 from app.schemas.transaction import TransactionUpdate, TransactionResponse
 from app.services.calculation import calculate_transaction_cost, calculate_deal_totals
+from app.services.deal_stats_rollup import refresh_deal_daily_stats, refresh_deals_daily_stats
+from app.services.balance_ledger import debit_company_account, debit_crypto_account, InsufficientBalanceError
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 
@@ -44,6 +45,8 @@ def update_transaction(
         calc_result = calculate_transaction_cost(transaction, market_rate)
         transaction.cost_usdt = Decimal(str(calc_result["cost_usdt"]))
     
+    # Маршрут и cost_usdt входят в дневные агрегаты дашборда
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     db.refresh(transaction)
     return transaction
@@ -67,6 +70,8 @@ def calculate_transaction(
     calc_result = calculate_transaction_cost(transaction, market_rate)
     transaction.cost_usdt = Decimal(str(calc_result["cost_usdt"]))
     
+    db.flush()
+    refresh_deals_daily_stats(db, [transaction.deal_id])
     db.commit()
     db.refresh(transaction)
     return transaction
@@ -112,6 +117,8 @@ def calculate_all_transactions(
             trans.partner_profit_usdt = delta / 2
             trans.profit_usdt = delta / 2
     
+    # cost_usdt маршрутов и итоги сделки входят в дневные агрегаты дашборда
+    refresh_deal_daily_stats(db, deal)
     db.commit()
     
     return {
@@ -129,14 +136,10 @@ def mark_transaction_paid(
     current_user: User = Depends(require_permission("exchanges.transactions.execute"))
 ):
     """Отметить транзакцию как оплаченную (Бухгалтер) и списать баланс с записью истории"""
-    from datetime import datetime
-    from decimal import Decimal
-    from app.models.internal_company_account import InternalCompanyAccount
-    from app.models.account_balance import AccountBalance
-    from app.models.internal_company_account_history import InternalCompanyAccountHistory, CompanyBalanceChangeType
-    from app.models.account_balance_history import AccountBalanceHistory, BalanceChangeType
-    
-    transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
+    # Блокируем транзакцию: параллельный запрос дождётся commit и увидит статус PAID
+    transaction = db.query(Transaction).filter(
+        Transaction.id == transaction_id
+    ).with_for_update().populate_existing().first()
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
@@ -144,109 +147,62 @@ def mark_transaction_paid(
     if transaction.status == TransactionStatus.PAID:
         raise HTTPException(status_code=400, detail="Transaction already paid")
     
-    # Получаем сделку для записи в историю
-    deal = db.query(Deal).filter(Deal.id == transaction.deal_id).first()
+    # Получаем сделку для записи в историю (блокировка нужна для проверки завершения сделки)
+    deal = db.query(Deal).filter(Deal.id == transaction.deal_id).with_for_update().first()
+    deal_id = deal.id if deal else None
     
     # Списываем баланс в зависимости от типа маршрута
     if transaction.route_type == "direct" and transaction.internal_company_account_id:
         # Прямой перевод - списываем с фиатного счёта компании
-        account = db.query(InternalCompanyAccount).filter(
-            InternalCompanyAccount.id == transaction.internal_company_account_id
-        ).first()
-        if account and transaction.amount_from_account:
-            previous_balance = account.balance
-            amount_to_deduct = Decimal(str(transaction.amount_from_account))
-            account.balance = previous_balance - amount_to_deduct
-            
-            # Записываем историю
-            history = InternalCompanyAccountHistory(
-                account_id=account.id,
-                previous_balance=previous_balance,
-                new_balance=account.balance,
-                change_amount=-amount_to_deduct,
-                change_type=CompanyBalanceChangeType.AUTO,
-                transaction_id=transaction.id,
-                deal_id=deal.id if deal else None,
+        if transaction.amount_from_account:
+            debit_company_account(
+                db,
+                account_id=transaction.internal_company_account_id,
+                amount=transaction.amount_from_account,
                 changed_by=current_user.id,
-                comment=f"Оплата маршрута (Direct) по сделке #{deal.id if deal else 'N/A'}"
+                transaction_id=transaction.id,
+                deal_id=deal_id,
+                comment=f"Оплата маршрута (Direct) по сделке #{deal_id or 'N/A'}"
             )
-            db.add(history)
     
     elif transaction.route_type == "exchange" and transaction.crypto_account_id:
         # Биржа - списываем с крипто-счёта
-        crypto_account = db.query(AccountBalance).filter(
-            AccountBalance.id == transaction.crypto_account_id
-        ).first()
-        if crypto_account:
-            # Используем exchange_amount если есть, иначе рассчитываем
-            amount_to_deduct = transaction.exchange_amount
-            if not amount_to_deduct and transaction.amount_from_account and transaction.crypto_exchange_rate:
-                amount_to_deduct = Decimal(str(transaction.amount_from_account)) * Decimal(str(transaction.crypto_exchange_rate))
-            if amount_to_deduct:
-                previous_balance = crypto_account.balance
-                crypto_account.balance = previous_balance - Decimal(str(amount_to_deduct))
-                
-                # Записываем историю
-                history = AccountBalanceHistory(
-                    account_balance_id=crypto_account.id,
-                    previous_balance=previous_balance,
-                    new_balance=crypto_account.balance,
-                    change_amount=-Decimal(str(amount_to_deduct)),
-                    change_type=BalanceChangeType.AUTO,
-                    transaction_id=transaction.id,
-                    deal_id=deal.id if deal else None,
-                    changed_by=current_user.id,
-                    comment=f"Оплата маршрута (Exchange) по сделке #{deal.id if deal else 'N/A'}"
-                )
-                db.add(history)
-    
-    elif transaction.route_type == "partner" and transaction.amount_to_partner_usdt:
-        # Партнёр - списываем USDT с крипто-счёта (ищем USDT счёт)
-        usdt_account = db.query(AccountBalance).filter(
-            AccountBalance.currency == "USDT"
-        ).first()
-        if usdt_account:
-            previous_balance = usdt_account.balance
-            amount_to_deduct = Decimal(str(transaction.amount_to_partner_usdt))
-            usdt_account.balance = previous_balance - amount_to_deduct
-            
-            # Записываем историю
-            history = AccountBalanceHistory(
-                account_balance_id=usdt_account.id,
-                previous_balance=previous_balance,
-                new_balance=usdt_account.balance,
-                change_amount=-amount_to_deduct,
-                change_type=BalanceChangeType.AUTO,
-                transaction_id=transaction.id,
-                deal_id=deal.id if deal else None,
+        # Используем exchange_amount если есть, иначе рассчитываем
+        amount_to_deduct = transaction.exchange_amount
+        if not amount_to_deduct and transaction.amount_from_account and transaction.crypto_exchange_rate:
+            amount_to_deduct = Decimal(str(transaction.amount_from_account)) * Decimal(str(transaction.crypto_exchange_rate))
+        if amount_to_deduct:
+            debit_crypto_account(
+                db,
+                account_id=transaction.crypto_account_id,
+                amount=amount_to_deduct,
                 changed_by=current_user.id,
-                comment=f"Оплата партнёру (Partner) по сделке #{deal.id if deal else 'N/A'}"
+                transaction_id=transaction.id,
+                deal_id=deal_id,
+                comment=f"Оплата маршрута (Exchange) по сделке #{deal_id or 'N/A'}"
             )
-            db.add(history)
     
-    elif transaction.route_type == "partner_50_50" and transaction.amount_to_partner_50_50_usdt:
-        # Партнёр 50-50 - списываем USDT с крипто-счёта
-        usdt_account = db.query(AccountBalance).filter(
+    elif transaction.route_type in ("partner", "partner_50_50"):
+        # Партнёр / партнёр 50-50 - списываем USDT с крипто-счёта (ищем USDT счёт)
+        if transaction.route_type == "partner":
+            amount_to_deduct = transaction.amount_to_partner_usdt
+            comment = f"Оплата партнёру (Partner) по сделке #{deal_id or 'N/A'}"
+        else:
+            amount_to_deduct = transaction.amount_to_partner_50_50_usdt
+            comment = f"Оплата партнёру 50-50 по сделке #{deal_id or 'N/A'}"
+        usdt_account_id = db.query(AccountBalance.id).filter(
             AccountBalance.currency == "USDT"
-        ).first()
-        if usdt_account:
-            previous_balance = usdt_account.balance
-            amount_to_deduct = Decimal(str(transaction.amount_to_partner_50_50_usdt))
-            usdt_account.balance = previous_balance - amount_to_deduct
-            
-            # Записываем историю
-            history = AccountBalanceHistory(
-                account_balance_id=usdt_account.id,
-                previous_balance=previous_balance,
-                new_balance=usdt_account.balance,
-                change_amount=-amount_to_deduct,
-                change_type=BalanceChangeType.AUTO,
-                transaction_id=transaction.id,
-                deal_id=deal.id if deal else None,
+        ).order_by(AccountBalance.id).limit(1).scalar()
+        if amount_to_deduct and usdt_account_id:
+            debit_crypto_account(
+                db,
+                account_id=usdt_account_id,
+                amount=amount_to_deduct,
                 changed_by=current_user.id,
-                comment=f"Оплата партнёру 50-50 по сделке #{deal.id if deal else 'N/A'}"
+                transaction_id=transaction.id,
+                deal_id=deal_id,
+                comment=comment
             )
-            db.add(history)
     
     # Обновляем статус транзакции
     transaction.status = TransactionStatus.PAID
@@ -258,6 +214,7 @@ def mark_transaction_paid(
     all_transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
     if all(t.status == TransactionStatus.PAID for t in all_transactions):
         deal.status = DealStatus.COMPLETED.value
+        refresh_deal_daily_stats(db, deal)
     
     db.commit()
     db.refresh(transaction)
@@ -273,7 +230,10 @@ def execute_transaction(
 ):
     """Выполнить транзакцию с автоматическим списанием остатка по счету"""
     
-    transaction = db.query(Transaction).filter(Transaction.id == transaction_id).first()
+    # Блокируем транзакцию: повторное выполнение дождётся commit и получит 400
+    transaction = db.query(Transaction).filter(
+        Transaction.id == transaction_id
+    ).with_for_update().populate_existing().first()
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
@@ -281,13 +241,13 @@ def execute_transaction(
     if transaction.status == TransactionStatus.PAID:
         raise HTTPException(status_code=400, detail="Transaction already executed")
     
-    # Получаем остаток по счету
-    account_balance = db.query(AccountBalance).filter(AccountBalance.id == account_balance_id).first()
-    if not account_balance:
+    # Проверяем наличие остатка по счету (списание ниже - атомарным UPDATE)
+    account_exists = db.query(AccountBalance.id).filter(AccountBalance.id == account_balance_id).first()
+    if not account_exists:
         raise HTTPException(status_code=404, detail="Account balance not found")
     
     # Получаем сделку для проверки статуса
-    deal = db.query(Deal).filter(Deal.id == transaction.deal_id).first()
+    deal = db.query(Deal).filter(Deal.id == transaction.deal_id).with_for_update().first()
     if not deal:
         raise HTTPException(status_code=404, detail="Deal not found")
     
@@ -310,33 +270,20 @@ def execute_transaction(
     # В реальности нужно учитывать валюту транзакции и остатка
     amount_to_debit = transaction.cost_usdt if transaction.cost_usdt else Decimal(str(transaction.amount_eur))
     
-    # Проверяем достаточность средств
-    if account_balance.balance < amount_to_debit:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Insufficient balance. Available: {account_balance.balance}, Required: {amount_to_debit}"
+    # Списываем средства с проверкой достаточности в том же UPDATE
+    try:
+        debit_crypto_account(
+            db,
+            account_id=account_balance_id,
+            amount=amount_to_debit,
+            changed_by=current_user.id,
+            transaction_id=transaction_id,
+            deal_id=deal.id,
+            comment=f"Transaction execution for deal #{deal.id}",
+            require_sufficient=True
         )
-    
-    # Сохраняем предыдущий остаток для истории
-    previous_balance = account_balance.balance
-    
-    # Списываем средства
-    account_balance.balance -= amount_to_debit
-    new_balance = account_balance.balance
-    
-    # Создаем запись в истории изменений остатка
-    balance_history = AccountBalanceHistory(
-        account_balance_id=account_balance_id,
-        previous_balance=previous_balance,
-        new_balance=new_balance,
-        change_amount=-amount_to_debit,  # Отрицательное значение для списания
-        change_type=BalanceChangeType.AUTO,  # Автоматическое списание при проведении транзакции
-        transaction_id=transaction_id,
-        deal_id=deal.id,
-        changed_by=current_user.id,
-        comment=f"Transaction execution for deal #{deal.id}"
-    )
-    db.add(balance_history)
+    except InsufficientBalanceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Отмечаем транзакцию как выполненную
     transaction.status = TransactionStatus.PAID
@@ -346,6 +293,7 @@ def execute_transaction(
     all_transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
     if all(t.status == TransactionStatus.PAID for t in all_transactions):
         deal.status = DealStatus.COMPLETED.value
+        refresh_deal_daily_stats(db, deal)
     
     db.commit()
     db.refresh(transaction)
@@ -0,0 +1,134 @@
+"""
+Кэш аутентифицированных пользователей.
+
+get_current_user на каждом запросе искал пользователя в БД по email из токена.
+Теперь в памяти процесса хранится лёгкий UserPrincipal (id, email, full_name,
+role, is_active) с ограниченным временем жизни (AUTH_CACHE_TTL_SECONDS) и
+размером (AUTH_CACHE_MAX_SIZE, вытесняются давно не использованные записи).
+
+Запись сбрасывается после commit транзакции, изменившей или удалившей
+пользователя через ORM (события after_flush/after_commit): сброс на flush
+позволил бы параллельному запросу закэшировать ещё не закоммиченную строку
+заново, а после rollback сбрасывать нечего. Изменения, сделанные в обход ORM
+или из другого процесса, подхватываются по истечении TTL.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from itertools import chain
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import record_cache_lookup
+from app.models.user import User, UserRole
+
+
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Данные текущего пользователя, достаточные для авторизации запроса"""
+    id: int
+    email: str
+    full_name: Optional[str]
+    role: str
+    is_active: str
+    user_role: Optional[UserRole]  # Роль, разобранная в enum (None - неизвестная роль)
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserPrincipal":
+        try:
+            user_role = UserRole(user.role)
+        except ValueError:
+            user_role = None
+        return cls(
+            id=user.id,
+            email=user.email,
+            full_name=user.full_name,
+            role=user.role,
+            is_active=user.is_active,
+            user_role=user_role
+        )
+
+
+class PrincipalCache:
+    """Потокобезопасный LRU-кэш с TTL: email -> UserPrincipal"""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._items: "OrderedDict[str, tuple[float, UserPrincipal]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[UserPrincipal]:
+        principal = self._get(email)
+        record_cache_lookup("auth_principals", principal is not None)
+        return principal
+
+    def _get(self, email: str) -> Optional[UserPrincipal]:
+        with self._lock:
+            item = self._items.get(email)
+            if item is None:
+                return None
+            expires_at, principal = item
+            if expires_at <= time.monotonic():
+                del self._items[email]
+                return None
+            self._items.move_to_end(email)
+            return principal
+
+    def set(self, principal: UserPrincipal):
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[principal.email] = (time.monotonic() + self.ttl_seconds, principal)
+            self._items.move_to_end(principal.email)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, email: Optional[str] = None, user_id: Optional[int] = None):
+        """Сбросить записи по email и/или id пользователя"""
+        with self._lock:
+            if email is not None:
+                self._items.pop(email, None)
+            if user_id is not None:
+                for key in [k for k, (_, p) in self._items.items() if p.id == user_id]:
+                    del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+principal_cache = PrincipalCache(
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS,
+    max_size=settings.AUTH_CACHE_MAX_SIZE
+)
+
+
+def invalidate_user(user: User):
+    """Сбросить кэш пользователя (в т.ч. по прежнему email, если он менялся)"""
+    principal_cache.invalidate(email=user.email, user_id=user.id)
+
+
+# Ключ session.info: (email, id) пользователей, изменённых в текущей транзакции
+_CHANGED_KEY = "auth_cache_changed_users"
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_on_flush(session: Session, flush_context):
+    # dirty/deleted здесь ещё в состоянии до flush; прежний email сбрасывается по id
+    changed = [obj for obj in chain(session.dirty, session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault(_CHANGED_KEY, set()).update((user.email, user.id) for user in changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    for email, user_id in session.info.pop(_CHANGED_KEY, ()):
+        principal_cache.invalidate(email=email, user_id=user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session: Session):
+    session.info.pop(_CHANGED_KEY, None)
@@ -1,9 +1,92 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from typing import AsyncIterator, Optional
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from app.core.config import settings
+from app.core.metrics import registry
 
-engine = create_engine(settings.DATABASE_URL)
+
+class PoolMetrics:
+    """Счётчики ожидания соединения из пула (время выдачи и тайм-ауты)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    def record(self, wait_seconds: float, timed_out: bool):
+        with self._lock:
+            if timed_out:
+                self._timeouts += 1
+            else:
+                self._checkouts += 1
+            self._wait_seconds_total += wait_seconds
+            self._wait_seconds_max = max(self._wait_seconds_max, wait_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = self._checkouts + self._timeouts
+            return {
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_seconds_total": round(self._wait_seconds_total, 6),
+                "avg_wait_ms": round(self._wait_seconds_total / waits * 1000, 3) if waits else 0.0,
+                "max_wait_ms": round(self._wait_seconds_max * 1000, 3)
+            }
+
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+class _InstrumentedPoolMixin:
+    """Замер времени получения соединения из пула (включая ожидание свободного)"""
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.record(time.perf_counter() - started, timed_out=False)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics = pool_metrics
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics = async_pool_metrics
+
+
+def engine_options(url: str, poolclass=InstrumentedQueuePool) -> dict:
+    """Параметры create_engine из настроек (SQLite для локальных проверок - без настроек пула)"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    options = {
+        "poolclass": poolclass,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -16,3 +99,134 @@ def get_db():
     finally:
         db.close()
 
+
+def async_database_url(url: str) -> URL:
+    """URL для async-движка: тот же сервер через asyncpg (SQLite - через aiosqlite)"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url.set(drivername="postgresql+asyncpg")
+
+
+def async_engine_options(url: str) -> dict:
+    """Параметры create_async_engine: пул из тех же настроек, statement_timeout через server_settings asyncpg"""
+    options = engine_options(url, poolclass=InstrumentedAsyncQueuePool)
+    if "connect_args" in options:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)}}
+    return options
+
+
+# Async-движок для read-heavy эндпоинтов создаётся при первом обращении:
+# импорт приложения и sync-скрипты не требуют asyncpg и не открывают второй пул
+_async_engine: Optional[AsyncEngine] = None
+_async_engine_lock = threading.Lock()
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    with _async_engine_lock:
+        if _async_engine is None:
+            _async_engine = create_async_engine(
+                async_database_url(settings.DATABASE_URL),
+                **async_engine_options(settings.DATABASE_URL)
+            )
+        return _async_engine
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """AsyncSession для async def эндпоинтов (аналог get_db).
+
+    Код на sync Session (сервисы, db.query) выполняется через
+    await db.run_sync(fn, ...) - запросы идут через asyncpg без потока из пула.
+    """
+    async with AsyncSessionLocal(bind=get_async_engine()) as db:
+        yield db
+
+
+def warm_up_pool(connections: int) -> int:
+    """Открыть до N соединений sync-пула заранее (первые запросы не ждут подключения к БД)"""
+    opened = []
+    try:
+        for _ in range(min(connections, settings.DB_POOL_SIZE)):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+    return len(opened)
+
+
+async def warm_up_async_pool(connections: int) -> int:
+    """То же для async-движка (создаёт его, если он ещё не создан)"""
+    async_engine = get_async_engine()
+    opened = []
+    try:
+        for _ in range(min(connections, settings.DB_POOL_SIZE)):
+            opened.append(await async_engine.connect())
+    finally:
+        for connection in opened:
+            await connection.close()
+    return len(opened)
+
+
+async def dispose_engines():
+    """Закрыть соединения обоих пулов (при остановке приложения)"""
+    engine.dispose()
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+
+def pool_stats(pool=None) -> dict:
+    """Состояние пула соединений: занято, свободно, overflow и время ожидания"""
+    pool = pool if pool is not None else engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "timeout_seconds": pool.timeout(),
+        })
+    if isinstance(pool, _InstrumentedPoolMixin):
+        stats.update(pool.metrics.stats())
+    return stats
+
+
+def async_pool_stats() -> Optional[dict]:
+    """Состояние пула async-движка (None, пока движок не создан)"""
+    if _async_engine is None:
+        return None
+    return pool_stats(_async_engine.pool)
+
+
+def _pool_samples(*keys: str):
+    """Колбэк метрики /metrics: значения из pool_stats() обоих пулов с меткой pool (и state, если ключей несколько)"""
+    def collect():
+        for pool_name, stats in (("sync", pool_stats()), ("async", async_pool_stats())):
+            if stats is None:
+                continue
+            for key in keys:
+                if key in stats:
+                    yield ((pool_name, key) if len(keys) > 1 else (pool_name,)), stats[key]
+    return collect
+
+
+registry.gauge_callback(
+    "db_pool_connections", "Connections in the DB pool by state", ("pool", "state"),
+    _pool_samples("checked_out", "checked_in", "overflow")
+)
+registry.gauge_callback("db_pool_size", "Configured DB pool size", ("pool",), _pool_samples("size"))
+registry.gauge_callback(
+    "db_pool_checkouts_total", "Connections handed out by the DB pool", ("pool",),
+    _pool_samples("checkouts"), type_name="counter"
+)
+registry.gauge_callback(
+    "db_pool_timeouts_total", "DB pool checkouts that timed out", ("pool",),
+    _pool_samples("timeouts"), type_name="counter"
+)
+registry.gauge_callback(
+    "db_pool_wait_seconds_total", "Time spent waiting for a DB pool connection", ("pool",),
+    _pool_samples("wait_seconds_total"), type_name="counter"
+)
@@ -1,52 +1,98 @@
-from fastapi import Depends, HTTPException, status
+import hmac
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, get_async_db
 from app.core.security import decode_access_token
+from app.core.auth_cache import UserPrincipal, principal_cache
 from app.models.user import User, UserRole
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 # Импортируем require_permission из permissions.py для обратной совместимости
-from app.core.permissions import require_permission
+from app.core.permissions import require_permission, require_permission_async
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+
+def _token_email(token: str) -> str:
+    """Email из access-токена (401, если токен недействителен)"""
     payload = decode_access_token(token)
     if payload is None:
-        raise credentials_exception
+        raise _credentials_exception()
     
     email: str = payload.get("sub")
     if email is None:
-        raise credentials_exception
-    
-    user = db.query(User).filter(User.email == email).first()
+        raise _credentials_exception()
+    return email
+
+
+def _cache_principal(user: User | None) -> UserPrincipal:
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     
-    return user
+    principal = UserPrincipal.from_user(user)
+    principal_cache.set(principal)
+    return principal
 
 
-def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-) -> User:
+def _ensure_active(current_user: UserPrincipal) -> UserPrincipal:
     if current_user.is_active != "true":
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> UserPrincipal:
+    email = _token_email(token)
+    principal = principal_cache.get(email)
+    if principal is not None:
+        return principal
+    
+    return _cache_principal(db.query(User).filter(User.email == email).first())
+
+
+def get_current_active_user(
+    current_user: UserPrincipal = Depends(get_current_user)
+) -> UserPrincipal:
+    return _ensure_active(current_user)
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> UserPrincipal:
+    """get_current_user для async def эндпоинтов: промах кэша читается через AsyncSession
+    (та же сессия, что у эндпоинта), без потока из threadpool"""
+    email = _token_email(token)
+    principal = principal_cache.get(email)
+    if principal is not None:
+        return principal
+    
+    result = await db.execute(select(User).where(User.email == email))
+    return _cache_principal(result.scalars().first())
+
+
+async def get_current_active_user_async(
+    current_user: UserPrincipal = Depends(get_current_user_async)
+) -> UserPrincipal:
+    return _ensure_active(current_user)
+
+
 def require_role(allowed_roles: list[UserRole]):
-    def role_checker(current_user: User = Depends(get_current_active_user)) -> User:
-        if current_user.role not in allowed_roles:
+    def role_checker(current_user: UserPrincipal = Depends(get_current_active_user)) -> UserPrincipal:
+        if current_user.user_role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not enough permissions"
@@ -54,3 +100,10 @@ def require_role(allowed_roles: list[UserRole]):
         return current_user
     return role_checker
 
+
+def has_metrics_access(authorization: str | None = Header(None)) -> bool:
+    """Запрос предъявил токен служебных эндпоинтов (settings.METRICS_TOKEN)"""
+    if not settings.METRICS_TOKEN or not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode())
@@ -113,6 +113,26 @@ def get_user_permissions(user_role: UserRole) -> Set[str]:
     return permissions
 
 
+def _check_permission(current_user, permission: str):
+    """403, если у роли пользователя нет разрешения"""
+    from fastapi import HTTPException, status
+    
+    # Роль разобрана в enum один раз при загрузке пользователя в кэш
+    user_role = current_user.user_role
+    if user_role is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid user role"
+        )
+    
+    if not has_permission(user_role, permission):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not enough permissions. Required: {permission}"
+        )
+    return current_user
+
+
 def require_permission(permission: str):
     """
     Декоратор для проверки разрешения у текущего пользователя.
@@ -124,28 +144,23 @@ def require_permission(permission: str):
         def get_deals(...):
             ...
     """
-    from fastapi import Depends, HTTPException, status
+    from fastapi import Depends
     from app.core.dependencies import get_current_active_user
-    from app.models.user import User
-    
-    def permission_checker(current_user: User = Depends(get_current_active_user)) -> User:
-        # Преобразуем строковую роль в enum, если нужно
-        user_role = current_user.role
-        if isinstance(user_role, str):
-            try:
-                user_role = UserRole(user_role)
-            except ValueError:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Invalid user role"
-                )
-        
-        if not has_permission(user_role, permission):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Not enough permissions. Required: {permission}"
-            )
-        return current_user
+    from app.core.auth_cache import UserPrincipal
+    
+    def permission_checker(current_user: UserPrincipal = Depends(get_current_active_user)) -> UserPrincipal:
+        return _check_permission(current_user, permission)
     
     return permission_checker
 
+
+def require_permission_async(permission: str):
+    """require_permission для async def эндпоинтов на AsyncSession (пользователь - через get_current_active_user_async)"""
+    from fastapi import Depends
+    from app.core.dependencies import get_current_active_user_async
+    from app.core.auth_cache import UserPrincipal
+    
+    async def permission_checker(current_user: UserPrincipal = Depends(get_current_active_user_async)) -> UserPrincipal:
+        return _check_permission(current_user, permission)
+    
+    return permission_checker
@@ -0,0 +1,166 @@
+"""
+Профилирование запросов: время ответа, время в БД и число SQL-запросов.
+
+RequestProfilingMiddleware (чистый ASGI) заводит на каждый HTTP-запрос
+RequestProfile в contextvar. События SQLAlchemy before/after_cursor_execute
+(на классе Engine - и sync-, и async-движок) записывают в него длительность
+и текст каждого выражения. Потоки пула (sync-эндпоинты, run_in_threadpool)
+и run_sync получают копию контекста, поэтому видят тот же профиль.
+
+В ответ добавляется заголовок Server-Timing (app, db, число выражений),
+а запросы дольше SLOW_REQUEST_MS или с числом выражений больше
+SLOW_REQUEST_STATEMENTS пишутся в лог (WARNING) вместе с самыми
+затратными выражениями - так видны медленные эндпоинты и N+1.
+Те же замеры идут в гистограммы /metrics по шаблону маршрута.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.core.config import settings
+from app.core.metrics import http_request_duration, http_request_db_duration, http_request_db_statements
+
+logger = logging.getLogger(__name__)
+
+# Ключ в Connection.info: стек времени начала выполняющихся выражений
+_STARTED_KEY = "request_profile_started"
+
+# Длина текста выражения в логе медленных запросов
+STATEMENT_LOG_LENGTH = 300
+
+
+class RequestProfile:
+    """Замеры одного HTTP-запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_seconds = 0.0
+        self.statements_count = 0
+        # Текст выражения -> [число выполнений, суммарное время]
+        self._statements: Dict[str, list] = {}
+
+    def record_statement(self, statement: str, seconds: float):
+        self.db_seconds += seconds
+        self.statements_count += 1
+        totals = self._statements.setdefault(statement, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def top_statements(self, limit: int) -> List[Tuple[str, int, float]]:
+        """Самые затратные выражения: (текст, число выполнений, суммарное время)"""
+        ranked = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [(statement, count, seconds) for statement, (count, seconds) in ranked[:limit]]
+
+    def server_timing(self, elapsed: float) -> str:
+        return (
+            f"app;dur={elapsed * 1000:.1f}, db;dur={self.db_seconds * 1000:.1f}, "
+            f"db-statements;desc=\"{self.statements_count}\""
+        )
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Профиль текущего HTTP-запроса (None вне запроса: скрипты, миграции)"""
+    return _current_profile.get()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault(_STARTED_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = conn.info.get(_STARTED_KEY)
+    if profile is not None and started:
+        profile.record_statement(statement, time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # after_cursor_execute не вызывается для упавшего выражения - снимаем его со стека
+    # и учитываем его время. Ошибки вне выполнения выражения (pre-ping, подключение)
+    # приходят без execution_context: стек не трогаем, исключение пробрасывается как есть
+    connection = exception_context.connection
+    if exception_context.execution_context is None or connection is None:
+        return
+    started = connection.info.get(_STARTED_KEY)
+    profile = _current_profile.get()
+    if started:
+        seconds = time.perf_counter() - started.pop()
+        if profile is not None and exception_context.statement:
+            profile.record_statement(exception_context.statement, seconds)
+
+
+def log_slow_request(method: str, path: str, status: Optional[int], profile: RequestProfile, elapsed: float):
+    """Записать в лог запрос, превысивший пороги SLOW_REQUEST_MS / SLOW_REQUEST_STATEMENTS"""
+    too_slow = settings.SLOW_REQUEST_MS > 0 and elapsed * 1000 >= settings.SLOW_REQUEST_MS
+    too_many = 0 < settings.SLOW_REQUEST_STATEMENTS <= profile.statements_count
+    if not (too_slow or too_many):
+        return
+    lines = [
+        f"Slow request {method} {path} -> {status}: {elapsed * 1000:.1f} ms, "
+        f"db {profile.db_seconds * 1000:.1f} ms in {profile.statements_count} statements"
+    ]
+    for statement, count, seconds in profile.top_statements(settings.SLOW_REQUEST_TOP_STATEMENTS):
+        text = " ".join(statement.split())
+        if len(text) > STATEMENT_LOG_LENGTH:
+            text = text[:STATEMENT_LOG_LENGTH] + "..."
+        lines.append(f"  {seconds * 1000:8.1f} ms  x{count:<4} {text}")
+    logger.warning("\n".join(lines))
+
+
+def route_template(scope) -> str:
+    """Шаблон пути сопоставленного маршрута (/api/deals/{deal_id}), чтобы не плодить метки по id"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def record_request_metrics(scope, status: Optional[int], profile: RequestProfile, elapsed: float):
+    method, route = scope["method"], route_template(scope)
+    http_request_duration.observe(elapsed, method=method, route=route, status=status or 500)
+    http_request_db_duration.observe(profile.db_seconds, method=method, route=route)
+    http_request_db_statements.inc(profile.statements_count, method=method, route=route)
+
+
+class RequestProfilingMiddleware:
+    """ASGI-middleware: профиль запроса, заголовок Server-Timing, метрики и лог медленных запросов"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.SERVER_TIMING_HEADER:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", profile.server_timing(profile.elapsed()).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_profile.reset(token)
+            elapsed = profile.elapsed()
+            record_request_metrics(scope, status, profile, elapsed)
+            log_slow_request(scope["method"], scope["path"], status, profile, elapsed)
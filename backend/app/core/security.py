@@ -1,3 +1,7 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -30,6 +34,85 @@ def get_password_hash(password: str) -> str:
     return hashed.decode('utf-8')
 
 
+class PasswordPoolSaturated(Exception):
+    """Очередь пула bcrypt переполнена"""
+
+
+class PasswordHashPool:
+    """
+    Ограниченный пул потоков для bcrypt.
+
+    bcrypt (12 раундов, ~250 мс CPU) отпускает GIL, поэтому выполняется в
+    отдельных потоках, не занимая event loop и общий threadpool FastAPI.
+    Задачи сверх max_queue ожидающих отклоняются сразу, а не копятся.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._pending = 0  # Отправлено и ещё не завершено
+        self._active = 0  # Выполняется сейчас
+        self._completed = 0
+        self._rejected = 0
+        self._max_queued = 0
+        self._wait_seconds_total = 0.0
+
+    def _call(self, submitted_at: float, fn, args):
+        with self._lock:
+            self._active += 1
+            self._wait_seconds_total += time.monotonic() - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._pending -= 1
+                self._completed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            queued = self._pending - self._active
+            if queued >= self.max_queue:
+                self._rejected += 1
+                raise PasswordPoolSaturated()
+            self._pending += 1
+            self._max_queued = max(self._max_queued, queued + 1)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, time.monotonic(), fn, args)
+
+    def stats(self) -> dict:
+        """Метрики насыщения пула"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": self._pending - self._active,
+                "max_queue": self.max_queue,
+                "max_queued_seen": self._max_queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._wait_seconds_total / self._completed * 1000, 1) if self._completed else 0.0
+            }
+
+
+password_pool = PasswordHashPool(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE
+)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password в пуле bcrypt"""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash в пуле bcrypt"""
+    return await password_pool.run(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
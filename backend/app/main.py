@@ -1,16 +1,55 @@
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import (
+    SessionLocal, pool_stats, async_pool_stats, warm_up_pool, warm_up_async_pool, dispose_engines
+)
+from app.core.dependencies import has_metrics_access
+from app.core.metrics import CONTENT_TYPE, registry
+from app.core.request_profiling import RequestProfilingMiddleware
+from app.core.security import password_pool
+from app.services.commission_cache import get_commissions
+from app.services import business_metrics  # Регистрирует бизнес-счётчики /metrics
 from app.api import api_router
 
-# Создаем таблицы
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+
+def warm_up_caches():
+    """Загрузить кэш комиссий маршрутов до первого расчёта сделки"""
+    db = SessionLocal()
+    try:
+        get_commissions(db)
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема БД создаётся только миграциями (alembic upgrade head): импорт приложения
+    # не обращается к БД. При старте лишь прогреваются пулы соединений и кэши;
+    # недоступная БД не мешает запуску - запросы подключатся сами.
+    connections = settings.DB_POOL_WARMUP_CONNECTIONS
+    if connections > 0:
+        try:
+            await run_in_threadpool(warm_up_pool, connections)
+            await warm_up_async_pool(connections)
+            await run_in_threadpool(warm_up_caches)
+        except Exception:
+            logger.warning("Database warm-up failed, continuing without it", exc_info=True)
+    yield
+    await dispose_engines()
+
 
 app = FastAPI(
     title="Deal Processing API",
     description="API для системы обработки финансовых сделок",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS - разрешаем все origins для разработки
@@ -21,8 +60,12 @@ app.add_middleware(
     allow_credentials=False,  # Нельзя использовать True с allow_origins=["*"]
     allow_methods=["*"],  # Разрешаем все методы
     allow_headers=["*"],  # Разрешаем все заголовки
+    expose_headers=["X-Next-Cursor"],  # Курсор следующей страницы списка сделок
 )
 
+# Время ответа, время в БД и число SQL-выражений: заголовок Server-Timing, метрики и лог медленных запросов
+app.add_middleware(RequestProfilingMiddleware)
+
 app.include_router(api_router)
 
 
@@ -32,6 +75,31 @@ def root():
 
 
 @app.get("/health")
-def health():
-    return {"status": "ok"}
+def health(metrics_access: bool = Depends(has_metrics_access)):
+    # Без токена METRICS_TOKEN - только статус (проверка живости, CORS открыт для всех)
+    if not metrics_access:
+        return {"status": "ok"}
+    # password_hashing - насыщение пула bcrypt (active/queued/rejected)
+    # database_pool - занятые соединения, overflow и время ожидания соединения
+    # (async_database_pool - то же для async-движка read-heavy эндпоинтов)
+    return {
+        "status": "ok",
+        "password_hashing": password_pool.stats(),
+        "database_pool": pool_stats(),
+        "async_database_pool": async_pool_stats()
+    }
+
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(metrics_access: bool = Depends(has_metrics_access)):
+    # Формат Prometheus: задержки по шаблонам маршрутов, пулы БД, попадания в кэши, бизнес-счётчики.
+    # Только для сборщика метрик с токеном METRICS_TOKEN; без настроенного токена эндпоинт отключён
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not metrics_access:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
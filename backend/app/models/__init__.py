@@ -18,6 +18,9 @@ from app.models.manager_commission import ManagerCommission
 from app.models.system_settings import SystemSetting
 from app.models.exchange_rate_transaction import ExchangeRateTransaction, TransactionType
 from app.models.exchange_rate_average import ExchangeRateAverage
+from app.models.deal_daily_stats import (
+    DealDailyStats, DealDailyRouteStats, DealStatsContribution, DealRouteStatsContribution
+)
 
 __all__ = [
     "User",
@@ -49,5 +52,9 @@ __all__ = [
     "ExchangeRateTransaction",
     "TransactionType",
     "ExchangeRateAverage",
+    "DealDailyStats",
+    "DealDailyRouteStats",
+    "DealStatsContribution",
+    "DealRouteStatsContribution",
 ]
 
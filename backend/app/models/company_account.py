@@ -8,7 +8,7 @@ class CompanyAccount(Base):
     __tablename__ = "company_accounts"
 
     id = Column(Integer, primary_key=True, index=True)
-    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False, index=True)
     account_name = Column(String, nullable=False)  # "IBAN EUR", "BTC Wallet" и т.д.
     account_number = Column(String, nullable=False)  # IBAN, адрес кошелька и т.д.
     currency = Column(String, nullable=True)  # "EUR", "USD", "BTC", "USDT" и т.д.
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Boolean, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -61,7 +61,7 @@ class Deal(Base):
     client_payment_confirmed_at = Column(DateTime, nullable=True)
     
     # Даты
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     # Кто создал сделку (для аудита)
@@ -74,3 +74,8 @@ class Deal(Base):
     history = relationship("DealHistory", back_populates="deal", cascade="all, delete-orphan", order_by="DealHistory.created_at.desc()")
     created_by_user = relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        # Keyset-пагинация списка сделок: ORDER BY created_at DESC, id DESC
+        Index("ix_deals_created_at_id", created_at.desc(), id.desc()),
+    )
+
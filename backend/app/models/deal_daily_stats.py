@@ -0,0 +1,81 @@
+from sqlalchemy import Column, Integer, String, Numeric, Date, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class DealDailyStats(Base):
+    """Дневной агрегат по сделкам (день × статус × клиент) для дашборда"""
+    __tablename__ = "deal_daily_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)  # Дата создания сделки
+    status = Column(String(50), nullable=False)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    
+    # Показатели
+    deals_count = Column(Integer, nullable=False, default=0)
+    total_eur = Column(Numeric(20, 2), nullable=False, default=0)
+    total_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    total_cost_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    net_profit_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    
+    # Задолженности клиентов
+    debt_amount = Column(Numeric(20, 2), nullable=False, default=0)
+    debt_deals_count = Column(Integer, nullable=False, default=0)
+    
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('day', 'status', 'client_id', name='uq_deal_daily_stats'),
+    )
+
+
+class DealDailyRouteStats(Base):
+    """Дневной агрегат по маршрутам транзакций (день × статус сделки × тип маршрута)"""
+    __tablename__ = "deal_daily_route_stats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)  # Дата создания сделки
+    status = Column(String(50), nullable=False)  # Статус сделки
+    route_type = Column(String, nullable=False)
+    
+    # Показатели
+    transactions_count = Column(Integer, nullable=False, default=0)
+    total_cost_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('day', 'status', 'route_type', name='uq_deal_daily_route_stats'),
+    )
+
+
+class DealStatsContribution(Base):
+    """Вклад сделки в deal_daily_stats на момент последнего обновления агрегатов.
+
+    Обновление агрегатов вычитает сохранённый вклад и прибавляет новый,
+    поэтому хранится ровно то, что было прибавлено (day = NULL - вклада нет).
+    """
+    __tablename__ = "deal_stats_contributions"
+
+    deal_id = Column(Integer, ForeignKey("deals.id"), primary_key=True)
+    day = Column(Date, nullable=True)
+    status = Column(String(50), nullable=True)
+    client_id = Column(Integer, nullable=True)
+
+    total_eur = Column(Numeric(20, 2), nullable=False, default=0)
+    total_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    total_cost_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    net_profit_usdt = Column(Numeric(20, 2), nullable=False, default=0)
+    debt_amount = Column(Numeric(20, 2), nullable=False, default=0)
+    debt_deals_count = Column(Integer, nullable=False, default=0)
+
+
+class DealRouteStatsContribution(Base):
+    """Вклад маршрутов сделки в deal_daily_route_stats (день и статус - из DealStatsContribution)"""
+    __tablename__ = "deal_route_stats_contributions"
+
+    deal_id = Column(Integer, ForeignKey("deals.id"), primary_key=True)
+    route_type = Column(String, primary_key=True)
+    transactions_count = Column(Integer, nullable=False, default=0)
+    total_cost_usdt = Column(Numeric(20, 2), nullable=False, default=0)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -39,9 +39,13 @@ class DealHistory(Base):
     comment = Column(Text, nullable=True)
     
     # Дата изменения
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
 
     # Relationships
     deal = relationship("Deal", back_populates="history")
     user = relationship("User")
 
+    __table_args__ = (
+        # История сделки постранично: WHERE deal_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_deal_history_deal_id_created_at", deal_id, created_at.desc(), id.desc()),
+    )
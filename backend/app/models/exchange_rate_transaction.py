@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Text, Index, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -28,6 +28,11 @@ class ExchangeRateTransaction(Base):
     exchange_rate = Column(Numeric(12, 6), nullable=False)  # Exchange rate at time of transaction
     value_in_target_currency = Column(Numeric(15, 4), nullable=False)  # Calculated: amount × rate
     
+    # Snapshot of the currency pair state right after this transaction (written at posting time)
+    balance_after = Column(Numeric(15, 4), nullable=True)
+    total_value_after = Column(Numeric(15, 4), nullable=True)
+    average_rate_after = Column(Numeric(12, 6), nullable=True)
+    
     # Metadata
     comment = Column(Text, nullable=True)
     created_by = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -35,4 +40,9 @@ class ExchangeRateTransaction(Base):
     
     # Relationships
     creator = relationship("User", foreign_keys=[created_by])
+    
+    __table_args__ = (
+        # History of a currency pair is read as a range scan in posting order
+        Index('ix_exchange_rate_transactions_pair_id', 'currency_from', 'currency_to', 'id'),
+    )
 
@@ -23,13 +23,13 @@ class Transaction(Base):
     __tablename__ = "transactions"
 
     id = Column(Integer, primary_key=True, index=True)
-    deal_id = Column(Integer, ForeignKey("deals.id"), nullable=False)
+    deal_id = Column(Integer, ForeignKey("deals.id"), nullable=False, index=True)
     
     # Основные данные транзакции
     from_currency = Column(String, nullable=True)
     to_currency = Column(String, nullable=True)
     exchange_rate = Column(Numeric(10, 6), nullable=True)
-    client_company_id = Column(Integer, ForeignKey("companies.id"), nullable=True)
+    client_company_id = Column(Integer, ForeignKey("companies.id"), nullable=True, index=True)
     amount_for_client = Column(Numeric(15, 2), nullable=True)
     route_type = Column(String, nullable=True)  # direct, exchange, partner, partner_50_50
     
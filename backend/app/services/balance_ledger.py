@@ -0,0 +1,114 @@
+"""
+Сервис атомарного списания с балансов счетов.
+
+Списание выполняется одним UPDATE ... SET balance = balance - :amount RETURNING balance,
+поэтому параллельные оплаты с одного счёта не теряют списаний. Строка счёта
+остаётся заблокированной до commit вызывающего кода.
+
+Порядок блокировок при оплате маршрута: транзакция → сделка → счёт.
+Если в одном запросе списываются несколько счетов, их нужно списывать
+в порядке возрастания id счёта, чтобы не получить взаимную блокировку.
+"""
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from app.models.internal_company_account import InternalCompanyAccount
+from app.models.internal_company_account_history import InternalCompanyAccountHistory, CompanyBalanceChangeType
+from app.models.account_balance import AccountBalance
+from app.models.account_balance_history import AccountBalanceHistory, BalanceChangeType
+from app.services.balance_summary_cache import mark_balances_changed
+from app.services.business_metrics import balance_debits, count_on_commit
+
+
+class InsufficientBalanceError(Exception):
+    """Недостаточно средств на счёте для списания"""
+
+    def __init__(self, available: Decimal, required: Decimal):
+        self.available = available
+        self.required = required
+        super().__init__(f"Insufficient balance. Available: {available}, Required: {required}")
+
+
+def _debit(db: Session, model, account_id: int, amount: Decimal, require_sufficient: bool) -> Optional[Decimal]:
+    """Атомарно списать сумму. Возвращает новый баланс или None, если счёт не найден"""
+    stmt = update(model).where(model.id == account_id)
+    if require_sufficient:
+        stmt = stmt.where(model.balance >= amount)
+    stmt = stmt.values(balance=model.balance - amount).returning(model.balance)
+
+    row = db.execute(stmt, execution_options={"synchronize_session": "fetch"}).first()
+    if row is not None:
+        # UPDATE в обход unit of work: события flush его не видят
+        mark_balances_changed(db)
+        return row[0]
+
+    if require_sufficient:
+        available = db.query(model.balance).filter(model.id == account_id).scalar()
+        if available is not None:
+            raise InsufficientBalanceError(available, amount)
+    return None
+
+
+def debit_company_account(
+    db: Session,
+    account_id: int,
+    amount: Decimal,
+    changed_by: int,
+    transaction_id: Optional[int] = None,
+    deal_id: Optional[int] = None,
+    comment: Optional[str] = None,
+    require_sufficient: bool = False
+) -> Optional[InternalCompanyAccountHistory]:
+    """Списать с фиатного счёта компании и записать историю"""
+    amount = Decimal(str(amount))
+    new_balance = _debit(db, InternalCompanyAccount, account_id, amount, require_sufficient)
+    if new_balance is None:
+        return None
+
+    history = InternalCompanyAccountHistory(
+        account_id=account_id,
+        previous_balance=new_balance + amount,
+        new_balance=new_balance,
+        change_amount=-amount,
+        change_type=CompanyBalanceChangeType.AUTO,
+        transaction_id=transaction_id,
+        deal_id=deal_id,
+        changed_by=changed_by,
+        comment=comment
+    )
+    db.add(history)
+    count_on_commit(db, balance_debits, account="company")
+    return history
+
+
+def debit_crypto_account(
+    db: Session,
+    account_id: int,
+    amount: Decimal,
+    changed_by: int,
+    transaction_id: Optional[int] = None,
+    deal_id: Optional[int] = None,
+    comment: Optional[str] = None,
+    require_sufficient: bool = False
+) -> Optional[AccountBalanceHistory]:
+    """Списать с крипто-счёта (остатка) и записать историю"""
+    amount = Decimal(str(amount))
+    new_balance = _debit(db, AccountBalance, account_id, amount, require_sufficient)
+    if new_balance is None:
+        return None
+
+    history = AccountBalanceHistory(
+        account_balance_id=account_id,
+        previous_balance=new_balance + amount,
+        new_balance=new_balance,
+        change_amount=-amount,
+        change_type=BalanceChangeType.AUTO,
+        transaction_id=transaction_id,
+        deal_id=deal_id,
+        changed_by=changed_by,
+        comment=comment
+    )
+    db.add(history)
+    count_on_commit(db, balance_debits, account="crypto")
+    return history
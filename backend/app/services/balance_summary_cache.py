@@ -0,0 +1,91 @@
+"""
+Кэш сводки остатков компаний (GET /api/company-balances/summary).
+
+Дашборд бухгалтера постоянно опрашивает сводку, а балансы меняются редко,
+поэтому готовый ответ хранится в памяти процесса BALANCE_SUMMARY_CACHE_TTL_SECONDS.
+
+Кэш сбрасывается после commit любой сессии, изменившей внутренние компании,
+их счета или крипто-счета через ORM (события after_flush/after_commit).
+Списания через UPDATE в обход ORM (balance_ledger) помечают сессию явно
+через mark_balances_changed(). Изменения из других процессов подхватываются
+по истечении TTL.
+
+Как и в кэше комиссий, каждая инвалидация увеличивает версию: сводка,
+собранная до инвалидации, в кэш не попадёт.
+"""
+import threading
+import time
+from itertools import chain
+from typing import Callable, Optional, TypeVar
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import record_cache_lookup
+from app.models.internal_company import InternalCompany
+from app.models.internal_company_account import InternalCompanyAccount
+from app.models.account_balance import AccountBalance
+
+T = TypeVar("T")
+
+# Модели, изменение которых меняет сводку
+BALANCE_MODELS = (InternalCompany, InternalCompanyAccount, AccountBalance)
+
+# Ключ в Session.info: сессия изменила балансы, сбросить кэш после commit
+_CHANGED_KEY = "balance_summary_changed"
+
+_lock = threading.Lock()
+_version = 0
+_loaded_at = 0.0
+_summary: Optional[object] = None
+
+
+def get_balance_summary(build: Callable[[], T]) -> T:
+    """Сводка из кэша или собранная build() (результат не должен изменяться вызывающим кодом)"""
+    global _summary, _loaded_at
+    with _lock:
+        version = _version
+        summary = _summary
+        fresh = time.monotonic() - _loaded_at < settings.BALANCE_SUMMARY_CACHE_TTL_SECONDS
+    hit = summary is not None and fresh
+    record_cache_lookup("balance_summary", hit)
+    if hit:
+        return summary
+
+    summary = build()
+
+    with _lock:
+        if version == _version:
+            _summary = summary
+            _loaded_at = time.monotonic()
+    return summary
+
+
+def invalidate_balance_summary():
+    """Сбросить кэш сводки"""
+    global _version, _summary
+    with _lock:
+        _version += 1
+        _summary = None
+
+
+def mark_balances_changed(session: Session):
+    """Пометить сессию: после commit сбросить кэш (для изменений в обход ORM)"""
+    session.info[_CHANGED_KEY] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_on_flush(session: Session, flush_context):
+    # new/dirty/deleted здесь ещё в состоянии до flush
+    if any(isinstance(obj, BALANCE_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        mark_balances_changed(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session: Session):
+    if session.info.pop(_CHANGED_KEY, False):
+        invalidate_balance_summary()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session: Session):
+    session.info.pop(_CHANGED_KEY, None)
@@ -0,0 +1,63 @@
+"""
+Бизнес-счётчики для /metrics: созданные сделки, оплаченные транзакции,
+списания с балансов и проводки по курсам валют.
+
+Как и сброс кэша сводки остатков, счётчики увеличиваются только после
+commit: события after_flush откладывают приращения в Session.info,
+after_commit применяет их, after_rollback отбрасывает. Изменения в обход
+ORM (списания balance_ledger) откладываются явно через count_on_commit().
+"""
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from app.core.metrics import Counter, registry
+from app.models.deal import Deal
+from app.models.transaction import Transaction, TransactionStatus
+from app.models.exchange_rate_transaction import ExchangeRateTransaction, TransactionType
+
+deals_created = registry.counter("deals_created_total", "Deals created")
+transactions_paid = registry.counter(
+    "transactions_paid_total", "Deal transactions marked as paid", labels=("route_type",)
+)
+balance_debits = registry.counter(
+    "balance_debits_total", "Automatic debits from company and crypto accounts", labels=("account",)
+)
+exchange_rate_postings = registry.counter(
+    "exchange_rate_postings_total", "Exchange rate income/expense postings", labels=("type",)
+)
+
+# Ключ в Session.info: приращения, ожидающие commit
+_PENDING_KEY = "business_metrics_pending"
+
+
+def count_on_commit(session: Session, counter: Counter, **labels):
+    """Увеличить счётчик после commit сессии"""
+    session.info.setdefault(_PENDING_KEY, []).append((counter, labels))
+
+
+def _became_paid(transaction: Transaction) -> bool:
+    history = inspect(transaction).attrs.status.history
+    return TransactionStatus.PAID in history.added and TransactionStatus.PAID not in history.deleted
+
+
+@event.listens_for(Session, "after_flush")
+def _count_on_flush(session: Session, flush_context):
+    # new/dirty здесь ещё в состоянии до flush, история атрибутов не сброшена
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Deal) and obj in session.new:
+            count_on_commit(session, deals_created)
+        elif isinstance(obj, Transaction) and _became_paid(obj):
+            count_on_commit(session, transactions_paid, route_type=obj.route_type or "unknown")
+        elif isinstance(obj, ExchangeRateTransaction) and obj in session.new:
+            count_on_commit(session, exchange_rate_postings, type=TransactionType(obj.transaction_type).value)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_on_commit(session: Session):
+    for counter, labels in session.info.pop(_PENDING_KEY, []):
+        counter.inc(**labels)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
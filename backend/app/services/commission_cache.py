@@ -0,0 +1,115 @@
+"""
+Кэш комиссий маршрутов (route_commissions) на уровне процесса.
+
+Таблица небольшая, поэтому загружается целиком одним запросом и хранится
+как словарь id -> CommissionSnapshot, общий для всех экземпляров DealCalculator.
+Эндпоинты references (создание/изменение/удаление комиссии) вызывают
+invalidate_commission_cache() после commit. Изменения из других процессов
+подхватываются по истечении COMMISSION_CACHE_TTL_SECONDS.
+
+Каждая инвалидация увеличивает версию кэша: загрузка, начатая до
+инвалидации, не перезапишет кэш устаревшими данными.
+
+Неизвестный ID перечитывает таблицу не больше одного раза на загруженный
+снимок: ID, которого нет и после перечитывания, запоминается как
+отсутствующий до следующей загрузки (TTL или инвалидация).
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional, Set
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.metrics import record_cache_lookup
+from app.models.route_commission import RouteCommission
+
+
+@dataclass(frozen=True)
+class CommissionSnapshot:
+    """Неизменяемая копия строки route_commissions, не привязанная к сессии"""
+    id: int
+    route_type: str
+    commission_percent: Optional[Decimal]
+    commission_fixed: Optional[Decimal]
+    is_fixed_currency: bool
+    currency: Optional[str]
+    is_active: bool
+
+
+_lock = threading.Lock()
+_version = 0
+_loaded_at = 0.0
+_commissions: Optional[Dict[int, CommissionSnapshot]] = None
+# ID, которых нет в текущем снимке и после перечитывания таблицы
+_missing: Set[int] = set()
+
+
+def _load(db: Session) -> Dict[int, CommissionSnapshot]:
+    """Загрузить все комиссии одним запросом (включая неактивные: на них ссылаются старые транзакции)"""
+    global _commissions, _loaded_at, _missing
+    with _lock:
+        version = _version
+
+    rows = db.query(
+        RouteCommission.id,
+        RouteCommission.route_type,
+        RouteCommission.commission_percent,
+        RouteCommission.commission_fixed,
+        RouteCommission.is_fixed_currency,
+        RouteCommission.currency,
+        RouteCommission.is_active
+    ).all()
+    commissions = {row.id: CommissionSnapshot(*row) for row in rows}
+
+    with _lock:
+        if version == _version:
+            _commissions = commissions
+            _loaded_at = time.monotonic()
+            _missing = set()
+    return commissions
+
+
+def get_commissions(db: Session) -> Dict[int, CommissionSnapshot]:
+    """Все комиссии из кэша (загружаются при первом обращении и после инвалидации)"""
+    with _lock:
+        commissions = _commissions
+        fresh = time.monotonic() - _loaded_at < settings.COMMISSION_CACHE_TTL_SECONDS
+    hit = commissions is not None and fresh
+    record_cache_lookup("route_commissions", hit)
+    if hit:
+        return commissions
+    return _load(db)
+
+
+def get_commission(db: Session, commission_id: Optional[int]) -> Optional[CommissionSnapshot]:
+    """Комиссия по ID. Неизвестный ID перечитывает таблицу (комиссия могла появиться в другом процессе)"""
+    if not commission_id:
+        return None
+    commission = get_commissions(db).get(commission_id)
+    if commission is not None:
+        return commission
+    with _lock:
+        if commission_id in _missing:
+            return None
+        version = _version
+    commission = _load(db).get(commission_id)
+    if commission is None:
+        with _lock:
+            if version == _version:
+                _missing.add(commission_id)
+    return commission
+
+
+def get_commission_cache_version() -> int:
+    with _lock:
+        return _version
+
+
+def invalidate_commission_cache():
+    """Сбросить кэш после изменения route_commissions"""
+    global _version, _commissions, _missing
+    with _lock:
+        _version += 1
+        _commissions = None
+        _missing = set()
@@ -5,31 +5,24 @@
 from decimal import Decimal
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session
-from app.models.route_commission import RouteCommission
+from app.services.commission_cache import CommissionSnapshot, get_commission
 
 
 class DealCalculator:
     """Сервис расчёта финансовых показателей сделки"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, commission_overrides: Optional[Dict[int, CommissionSnapshot]] = None):
         self.db = db
-        self._commissions_cache: Dict[int, RouteCommission] = {}
+        # Подменённые комиссии для what-if расчётов (services.deal_recalculation)
+        self.commission_overrides = commission_overrides or {}
     
-    def _get_commission(self, commission_id: Optional[int]) -> Optional[RouteCommission]:
-        """Получить комиссию по ID с кэшированием"""
-        if not commission_id:
-            return None
-        
-        if commission_id not in self._commissions_cache:
-            commission = self.db.query(RouteCommission).filter(
-                RouteCommission.id == commission_id
-            ).first()
-            if commission:
-                self._commissions_cache[commission_id] = commission
-        
-        return self._commissions_cache.get(commission_id)
+    def get_commission(self, commission_id: Optional[int]) -> Optional[CommissionSnapshot]:
+        """Получить комиссию по ID из кэша процесса (services.commission_cache) с учётом подмен"""
+        if commission_id in self.commission_overrides:
+            return self.commission_overrides[commission_id]
+        return get_commission(self.db, commission_id)
     
-    def _apply_commission(self, amount: Decimal, commission: Optional[RouteCommission]) -> Decimal:
+    def _apply_commission(self, amount: Decimal, commission: Optional[CommissionSnapshot]) -> Decimal:
         """Применить комиссию к сумме"""
         if not commission:
             return amount
@@ -56,7 +49,7 @@ class DealCalculator:
             return Decimal("0")
         
         amount = amount_from_account
-        commission = self._get_commission(bank_commission_id)
+        commission = self.get_commission(bank_commission_id)
         amount = self._apply_commission(amount, commission)
         
         return amount * exchange_rate
@@ -82,13 +75,13 @@ class DealCalculator:
         amount = amount_from_account
         
         # Применяем комиссии последовательно
-        agent_comm = self._get_commission(agent_commission_id)
+        agent_comm = self.get_commission(agent_commission_id)
         amount = self._apply_commission(amount, agent_comm)
         
-        exchange_comm = self._get_commission(exchange_commission_id)
+        exchange_comm = self.get_commission(exchange_commission_id)
         amount = self._apply_commission(amount, exchange_comm)
         
-        bank_comm = self._get_commission(bank_commission_id)
+        bank_comm = self.get_commission(bank_commission_id)
         amount = self._apply_commission(amount, bank_comm)
         
         # Exchange Amount = (Amount from Account - все комиссии) * Crypto Exchange Rate
@@ -126,7 +119,7 @@ class DealCalculator:
         
         # Amount to Partner (USDT) = Amount Partner Sends * (1 - Partner Commission/100)
         amount_to_partner_usdt = amount_partner_sends
-        commission = self._get_commission(partner_commission_id)
+        commission = self.get_commission(partner_commission_id)
         if commission and commission.commission_percent:
             amount_to_partner_usdt = amount_partner_sends * (
                 Decimal("1") - Decimal(str(commission.commission_percent)) / Decimal("100")
@@ -200,22 +193,29 @@ class DealCalculator:
         
         return result
     
-    def calculate_transaction_totals(self, routes: List[dict]) -> dict:
+    def calculate_transaction_totals(
+        self,
+        routes: List[dict],
+        route_results: Optional[List[dict]] = None
+    ) -> dict:
         """
         Расчёт итогов транзакции (суммирование маршрутов).
         
         Args:
             routes: список маршрутов транзакции
+            route_results: уже рассчитанные calculate_route_income по тем же маршрутам
+                (если не переданы - маршруты рассчитываются заново)
         
         Returns:
             dict с amount_for_client и final_income
         """
+        if route_results is None:
+            route_results = [self.calculate_route_income(route) for route in routes]
+        
         amount_for_client = Decimal("0")
         final_income = Decimal("0")
         
-        for route in routes:
-            route_result = self.calculate_route_income(route)
-            
+        for route, route_result in zip(routes, route_results):
             # Сумма для клиента = сумма amount_from_account из всех маршрутов
             amount_for_client += Decimal(str(route.get("amount_from_account", 0) or 0))
             
@@ -256,6 +256,9 @@ class DealCalculator:
         """
         Предварительный расчёт сделки (для превью перед сохранением).
         
+        Каждый маршрут рассчитывается один раз: итоги транзакций и сделки
+        суммируются из уже полученных результатов маршрутов.
+        
         Args:
             deal_data: данные сделки с транзакциями
         
@@ -264,29 +267,30 @@ class DealCalculator:
         """
         transactions = deal_data.get("transactions", [])
         calculated_transactions = []
+        total_amount_for_client = Decimal("0")
+        total_client_should_send = Decimal("0")
         
         for trans in transactions:
             routes = trans.get("routes", [])
-            calculated_routes = []
-            
-            for route in routes:
-                route_calc = self.calculate_route_income(route)
-                calculated_routes.append({
-                    **route,
-                    **route_calc
-                })
+            route_results = [self.calculate_route_income(route) for route in routes]
+            calculated_routes = [
+                {**route, **route_calc}
+                for route, route_calc in zip(routes, route_results)
+            ]
             
-            trans_totals = self.calculate_transaction_totals(routes)
+            trans_totals = self.calculate_transaction_totals(routes, route_results)
             calculated_transactions.append({
                 **trans,
                 "routes": calculated_routes,
                 "amount_for_client": trans_totals["amount_for_client"],
                 "final_income": trans_totals["final_income"]
             })
-        
-        deal_totals = self.calculate_deal_totals(transactions)
+            
+            total_amount_for_client += trans_totals["amount_for_client"]
+            total_client_should_send += trans_totals["final_income"]
         
         return {
             "transactions": calculated_transactions,
-            **deal_totals
+            "total_amount_for_client": total_amount_for_client,
+            "total_client_should_send": total_client_should_send
         }
@@ -0,0 +1,308 @@
+"""
+Сервис построения списков сделок.
+Сделка, имя клиента и прогресс по транзакциям (оплачено/всего) загружаются
+одним SQL-запросом с группировкой, без отдельного запроса на каждую сделку.
+"""
+import base64
+import csv
+import io
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Iterator, List, Optional, Tuple
+from sqlalchemy import func, case, exists, tuple_
+from sqlalchemy.orm import Session, Query, aliased
+from app.core.database import SessionLocal
+from app.models.user import UserRole
+from app.models.deal import Deal, DealStatus
+from app.models.client import Client
+from app.models.company import Company
+from app.models.company_account import CompanyAccount
+from app.models.transaction import Transaction, TransactionStatus
+from app.models.manager_commission import ManagerCommission
+from app.schemas.deal import DealListResponse
+from app.services.deal_recalculation import summarize_deal_income
+
+
+def transaction_progress_subquery(db: Session):
+    """Подзапрос: количество всех и оплаченных транзакций по каждой сделке"""
+    return db.query(
+        Transaction.deal_id.label("deal_id"),
+        func.count(Transaction.id).label("total_count"),
+        func.sum(
+            case((Transaction.status == TransactionStatus.PAID, 1), else_=0)
+        ).label("paid_count")
+    ).group_by(Transaction.deal_id).subquery()
+
+
+def build_deal_list_query(db: Session) -> Query:
+    """
+    Базовый запрос для списков сделок.
+
+    Возвращает строки (Deal, client_name, total_count, paid_count).
+    Фильтры, сортировку и пагинацию добавляет вызывающий эндпоинт.
+    """
+    progress = transaction_progress_subquery(db)
+    return db.query(
+        Deal,
+        Client.name.label("client_name"),
+        func.coalesce(progress.c.total_count, 0).label("total_count"),
+        func.coalesce(progress.c.paid_count, 0).label("paid_count")
+    ).outerjoin(
+        Client, Client.id == Deal.client_id
+    ).outerjoin(
+        progress, progress.c.deal_id == Deal.id
+    )
+
+
+def build_deal_list_response(rows) -> List[DealListResponse]:
+    """Преобразовать строки build_deal_list_query в DealListResponse"""
+    result = []
+    for deal, client_name, total_count, paid_count in rows:
+        total_count = int(total_count or 0)
+        paid_count = int(paid_count or 0)
+        result.append(DealListResponse(
+            id=deal.id,
+            client_id=deal.client_id,
+            client_name=client_name,
+            total_eur_request=deal.total_eur_request,
+            total_usdt_calculated=deal.total_usdt_calculated,
+            status=deal.status,
+            created_at=deal.created_at,
+            progress={"paid": paid_count, "total": total_count} if total_count else None,
+            transactions_count=total_count,
+            paid_transactions_count=paid_count,
+            client_debt_amount=deal.client_debt_amount,
+            client_paid_amount=deal.client_paid_amount
+        ))
+    return result
+
+
+def encode_deal_cursor(deal: Deal) -> str:
+    """Непрозрачный курсор для keyset-пагинации: (created_at, id) последней сделки"""
+    raw = f"{deal.created_at.isoformat()}|{deal.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_deal_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """Разобрать курсор. Возвращает None, если курсор некорректный"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, deal_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), int(deal_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def apply_deal_cursor(query: Query, created_at: datetime, deal_id: int) -> Query:
+    """Сделки строго после курсора в порядке (created_at DESC, id DESC)"""
+    return query.filter(tuple_(Deal.created_at, Deal.id) < tuple_(created_at, deal_id))
+
+
+def like_pattern(value: str) -> str:
+    """Шаблон ILIKE '%value%' с экранированием спецсимволов LIKE (экранирующий символ - обратный слэш)"""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _deal_has_transaction(criteria: Callable[[Transaction], list]):
+    """
+    EXISTS: у сделки есть транзакция, удовлетворяющая условиям (полу-соединение по transactions.deal_id).
+
+    Подзапрос строится на псевдониме transactions и коррелирует только с deals:
+    иначе в запросе, который сам соединяет transactions (CSV-экспорт), EXISTS
+    ссылался бы на внешнюю строку транзакции и отбрасывал остальные транзакции сделки.
+    """
+    transaction = aliased(Transaction)
+    return exists().where(transaction.deal_id == Deal.id, *criteria(transaction)).correlate(Deal)
+
+
+def apply_deal_filters(
+    query: Query,
+    current_user,
+    status_filter: Optional[str] = None,
+    client_id: Optional[int] = None,
+    company_name: Optional[str] = None,
+    account_number: Optional[str] = None
+) -> Query:
+    """Фильтры списка сделок (общие для GET /deals и экспорта)"""
+    # Row Level Security: Менеджер видит только свои сделки
+    if current_user.role == UserRole.MANAGER:
+        query = query.filter(Deal.manager_id == current_user.id)
+    
+    # Применяем фильтр по статусу (если передан)
+    if status_filter:
+        # Проверяем, что статус валидный
+        try:
+            # Пытаемся найти статус в enum
+            status_enum = DealStatus(status_filter)
+            status_value = status_enum.value
+        except ValueError:
+            # Если не найден в enum, используем строку как есть (для обратной совместимости)
+            status_value = status_filter
+        
+        query = query.filter(Deal.status == status_value)
+    
+    # Фильтр по клиенту
+    if client_id:
+        query = query.filter(Deal.client_id == client_id)
+    
+    # Фильтр по компании клиента (через транзакции): EXISTS вместо списка id сделок
+    if company_name:
+        query = query.filter(
+            _deal_has_transaction(lambda transaction: [
+                transaction.client_company_id == Company.id,
+                Company.name.ilike(like_pattern(company_name), escape="\\")
+            ])
+        )
+    
+    # Фильтр по счету/IBAN компании клиента (через транзакции)
+    if account_number:
+        query = query.filter(
+            _deal_has_transaction(lambda transaction: [
+                CompanyAccount.company_id == transaction.client_company_id,
+                CompanyAccount.account_number.ilike(like_pattern(account_number), escape="\\")
+            ])
+        )
+
+    return query
+
+
+# Колонки CSV-экспорта: сделка, расчёт дохода (как calculate_deal_income), транзакция
+EXPORT_COLUMNS = [
+    "deal_id", "created_at", "status", "client_name",
+    "total_eur_request", "total_usdt_calculated", "client_rate_percent",
+    "client_debt_amount", "client_paid_amount",
+    "client_should_send", "deal_costs", "income_amount", "income_percent",
+    "manager_commission_amount", "net_profit", "currency",
+    "transaction_id", "route_type", "from_currency", "to_currency", "exchange_rate",
+    "amount_from_account", "calculated_route_income", "transaction_status", "paid_at",
+]
+
+# Размер порции строк из серверного курсора и CSV-блока в ответе
+EXPORT_BATCH_SIZE = 1000
+
+# Начало ячейки, которое Excel/LibreOffice разбирают как формулу (CSV injection)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _export_cell(value):
+    """Текст, начинающийся как формула, экранируется апострофом; числа и даты - как есть"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _export_deal_rows(deal_rows: list, manager_percents: dict) -> List[list]:
+    """CSV-строки одной сделки: по строке на транзакцию (или одна строка без транзакций)"""
+    first = deal_rows[0]
+    transactions = [row for row in deal_rows if row.transaction_id is not None]
+    income = summarize_deal_income(
+        [
+            (
+                row.calculated_route_income,
+                Decimal(str(row.amount_from_account or 0)),
+                Decimal(str(row.exchange_rate or 1))
+            )
+            for row in transactions
+        ],
+        client_rate_percent=first.client_rate_percent,
+        manager_commission_percent=Decimal(str(manager_percents.get(first.manager_id, 0))),
+        currency=first.client_sends_currency
+    )
+    deal_part = [
+        first.deal_id, first.created_at.isoformat() if first.created_at else "", first.status, first.client_name,
+        first.total_eur_request, first.total_usdt_calculated, first.client_rate_percent,
+        first.client_debt_amount, first.client_paid_amount,
+        income["client_should_send"], income["deal_costs"], income["income_amount"], income["income_percent"],
+        income["manager_commission_amount"], income["net_profit"], income["currency"],
+    ]
+    deal_part = [_export_cell(value) for value in deal_part]
+    if not transactions:
+        return [deal_part + [""] * 9]
+    return [
+        deal_part + [_export_cell(value) for value in (
+            row.transaction_id, row.route_type, row.from_currency, row.to_currency, row.exchange_rate,
+            row.amount_from_account, row.calculated_route_income,
+            row.transaction_status.value if row.transaction_status else "",
+            row.paid_at.isoformat() if row.paid_at else "",
+        )]
+        for row in transactions
+    ]
+
+
+def stream_deals_csv(current_user, **filters) -> Iterator[str]:
+    """
+    Потоковый CSV-экспорт сделок с транзакциями и расчётом дохода.
+
+    Строки читаются серверным курсором (yield_per) в порядке сделок, транзакции
+    одной сделки идут подряд, поэтому в памяти держится только текущая сделка.
+    Генератор открывает собственную сессию: он выполняется уже после выхода
+    из эндпоинта.
+
+    Текстовые ячейки (имя клиента и т.п.), начинающиеся с = + - @, выводятся
+    с апострофом, чтобы табличный редактор не выполнил их как формулу.
+
+    Только CSV: XLSX - zip-архив, который нельзя отдавать по частям с
+    постоянной памятью без отдельной библиотеки; CSV открывается в Excel
+    (BOM для кириллицы).
+    """
+    db = SessionLocal()
+    try:
+        manager_percents = dict(db.query(
+            ManagerCommission.user_id, ManagerCommission.commission_percent
+        ).filter(ManagerCommission.is_active == True).all())
+
+        query = db.query(
+            Deal.id.label("deal_id"),
+            Deal.created_at,
+            Deal.status,
+            Deal.manager_id,
+            Deal.total_eur_request,
+            Deal.total_usdt_calculated,
+            Deal.client_rate_percent,
+            Deal.client_debt_amount,
+            Deal.client_paid_amount,
+            Deal.client_sends_currency,
+            Client.name.label("client_name"),
+            Transaction.id.label("transaction_id"),
+            Transaction.route_type,
+            Transaction.from_currency,
+            Transaction.to_currency,
+            Transaction.exchange_rate,
+            Transaction.amount_from_account,
+            Transaction.calculated_route_income,
+            Transaction.status.label("transaction_status"),
+            Transaction.paid_at
+        ).select_from(Deal).outerjoin(
+            Client, Client.id == Deal.client_id
+        ).outerjoin(
+            Transaction, Transaction.deal_id == Deal.id
+        )
+        query = apply_deal_filters(query, current_user, **filters)
+        query = query.order_by(Deal.created_at.desc(), Deal.id.desc(), Transaction.id).yield_per(EXPORT_BATCH_SIZE)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM - чтобы Excel открыл UTF-8 с кириллицей
+        buffer.write("\ufeff")
+        writer.writerow(EXPORT_COLUMNS)
+
+        deal_rows = []
+        rows_in_buffer = 0
+        for row in query:
+            if deal_rows and row.deal_id != deal_rows[0].deal_id:
+                writer.writerows(_export_deal_rows(deal_rows, manager_percents))
+                rows_in_buffer += len(deal_rows)
+                deal_rows = []
+                if rows_in_buffer >= EXPORT_BATCH_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate(0)
+                    rows_in_buffer = 0
+            deal_rows.append(row)
+
+        if deal_rows:
+            writer.writerows(_export_deal_rows(deal_rows, manager_percents))
+        yield buffer.getvalue()
+    finally:
+        db.close()
@@ -0,0 +1,317 @@
+"""
+Пакетный пересчёт всех незавершённых сделок.
+
+После изменения комиссии маршрута или рыночного курса нужно пересчитать
+все открытые сделки. Все маршруты открытых сделок загружаются одним
+запросом по колонкам и считаются векторно (services.route_income_engine:
+NumPy, целые числа с фиксированной точкой). Результат в центах совпадает
+с DealCalculator (Decimal): маршруты, где округление до цента неоднозначно,
+досчитываются через DealCalculator. Итоги по сделкам (calculate_deal_income)
+складываются из доходов маршрутов в центах - так же, как их потом считает
+calculate_deal_income по сохранённым значениям.
+
+Режим what-if (dry_run) ничего не записывает и позволяет подставить
+другие проценты комиссий и курсы валютных пар. При записи строки
+транзакций и сделок блокируются (FOR UPDATE) в порядке транзакция → сделка,
+как при оплате маршрута (services.balance_ledger), поэтому параллельная
+оплата или редактирование сделки не перезаписываются устаревшими значениями.
+"""
+from dataclasses import replace
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from app.models.deal import Deal, DealStatus
+from app.models.transaction import Transaction, TransactionStatus
+from app.models.manager_commission import ManagerCommission
+from app.services.commission_cache import get_commissions
+from app.services.deal_calculator import DealCalculator
+from app.services.deal_stats_rollup import refresh_deals_daily_stats
+from app.services.route_income_engine import (
+    COMMISSION_SLOTS, MONEY_SCALE, PERCENT_SCALE, RATE_SCALE, SCALED_COLUMNS,
+    calculate_route_incomes, quantize_cents, scaled_column, to_scaled
+)
+
+# Колонки транзакции, нужные для расчёта маршрута (имена совпадают с ключами route_data).
+# Числовые колонки выбираются целыми в масштабе своих колонок, id комиссий - 0 вместо NULL
+ROUTE_COLUMNS = (
+    Transaction.id,
+    Transaction.deal_id,
+    (Transaction.status == TransactionStatus.PAID).label("is_paid"),
+    Transaction.route_type,
+    Transaction.from_currency,
+    Transaction.to_currency,
+    *(scaled_column(getattr(Transaction, name), scale).label(name) for name, scale in SCALED_COLUMNS.items()),
+    *(func.coalesce(getattr(Transaction, slot), 0).label(slot) for slot in COMMISSION_SLOTS),
+    scaled_column(Transaction.calculated_route_income, MONEY_SCALE).label("calculated_route_income"),
+)
+# Типы колонок маршрута в NumPy (остальные - int64)
+ROUTE_COLUMN_DTYPES = {"is_paid": bool, "route_type": object, "from_currency": object, "to_currency": object}
+
+# Расчётные поля маршрута, которые пересчёт записывает помимо calculated_route_income/final_income
+# (те же, что update_deal при сохранении сделки)
+RECALCULATED_FIELDS = (
+    "amount_partner_sends",
+    "amount_to_partner_usdt",
+    "amount_partner_50_50_sends",
+    "amount_to_partner_50_50_usdt",
+)
+
+
+def summarize_deal_income(
+    routes: Iterable[Tuple[Optional[Decimal], Decimal, Decimal]],
+    client_rate_percent: Decimal,
+    manager_commission_percent: Decimal,
+    currency: Optional[str]
+) -> dict:
+    """
+    Доход и прибыль по сделке из маршрутов (route_income, сумма_для_клиента, курс).
+
+    Формулы:
+    - Клиент отправляет = Σ(сумма_для_клиента × курс) × (1 + Ставка_клиента%)
+    - Затраты на сделку = Σ Route Income
+    - Доход = Клиент отправляет − Затраты на сделку
+    - Комиссия менеджера = Доход × %комиссии
+    - Чистая прибыль = Доход − Комиссия менеджера
+    """
+    # Считаем суммы по транзакциям
+    total_route_income = Decimal("0")  # Затраты на сделку (сумма Route Income)
+    total_amount_times_rate = Decimal("0")  # Σ(сумма_для_клиента × курс)
+
+    for route_income, amount_for_client, exchange_rate in routes:
+        if route_income:
+            total_route_income += Decimal(str(route_income))
+        total_amount_times_rate += amount_for_client * exchange_rate
+
+    return summarize_deal_totals(
+        total_route_income, total_amount_times_rate, client_rate_percent, manager_commission_percent, currency
+    )
+
+
+def summarize_deal_totals(
+    total_route_income: Decimal,
+    total_amount_times_rate: Decimal,
+    client_rate_percent: Decimal,
+    manager_commission_percent: Decimal,
+    currency: Optional[str]
+) -> dict:
+    """summarize_deal_income по уже посчитанным суммам Σ Route Income и Σ(сумма_для_клиента × курс)"""
+    client_rate = Decimal(str(client_rate_percent or 0))
+
+    # Клиент отправляет = Σ(сумма × курс) × (1 + ставка%)
+    client_should_send = total_amount_times_rate * (1 + client_rate / 100)
+
+    # Затраты на сделку = Σ Route Income
+    deal_costs = total_route_income
+
+    # Доход = Клиент отправляет − Затраты на сделку
+    income_amount = client_should_send - deal_costs
+
+    # Доход в процентах от затрат
+    income_percent = Decimal("0")
+    if deal_costs > 0:
+        income_percent = (income_amount / deal_costs) * 100
+
+    is_profitable = income_amount >= 0
+
+    # Комиссия менеджера = Доход × %комиссии (только если прибыльно)
+    manager_commission_amount = income_amount * (manager_commission_percent / 100) if is_profitable else Decimal("0")
+
+    # Чистая прибыль = Доход − Комиссия менеджера
+    net_profit = income_amount - manager_commission_amount
+
+    return {
+        "client_should_send": float(round(client_should_send, 2)),  # Клиент отправляет
+        "deal_costs": float(round(deal_costs, 2)),  # Затраты на сделку (Route Income)
+        "income_amount": float(round(income_amount, 2)),  # Доход
+        "income_percent": float(round(income_percent, 2)),  # Доход в %
+        "is_profitable": is_profitable,
+        "manager_commission_percent": float(round(manager_commission_percent, 2)),
+        "manager_commission_amount": float(round(manager_commission_amount, 2)),
+        "net_profit": float(round(net_profit, 2)),
+        "currency": currency or "USDT"
+    }
+
+
+def _build_calculator(
+    db: Session,
+    commission_percent_overrides: Optional[Dict[int, Decimal]]
+) -> DealCalculator:
+    """Калькулятор с подменой процентов комиссий (для what-if)"""
+    overrides = {}
+    if commission_percent_overrides:
+        commissions = get_commissions(db)
+        for commission_id, percent in commission_percent_overrides.items():
+            commission = commissions.get(commission_id)
+            if commission is None:
+                raise ValueError(f"Route commission {commission_id} not found")
+            to_scaled(percent, PERCENT_SCALE)  # Как в колонке Numeric(5, 2)
+            overrides[commission_id] = replace(commission, commission_percent=Decimal(str(percent)))
+    return DealCalculator(db, commission_overrides=overrides)
+
+
+def _cents(value) -> int:
+    return int(quantize_cents(value) * 100)
+
+
+def _route_data(routes: Dict[str, np.ndarray], i: int) -> dict:
+    """route_data для DealCalculator из колонок маршрутов"""
+    route = {"route_type": routes["route_type"][i]}
+    for name, scale in SCALED_COLUMNS.items():
+        route[name] = Decimal(int(routes[name][i])) / scale
+    for slot in COMMISSION_SLOTS:
+        route[slot] = int(routes[slot][i]) or None
+    return route
+
+
+def _route_incomes(routes: Dict[str, np.ndarray], calculator: DealCalculator) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    Доход маршрутов в центах: векторно, неоднозначные маршруты - через DealCalculator.
+
+    Returns:
+        (колонки calculated_route_income и RECALCULATED_FIELDS, число маршрутов,
+        досчитанных через DealCalculator)
+    """
+    calculated = calculate_route_incomes(routes, calculator.get_commission)
+    fallback = np.flatnonzero(calculated.pop("fallback"))
+    for i in fallback:
+        route_calc = calculator.calculate_route_income(_route_data(routes, i))
+        for name in calculated:
+            calculated[name][i] = _cents(route_calc.get(name))
+    return calculated, len(fallback)
+
+
+def recalculate_open_deals(
+    db: Session,
+    dry_run: bool = True,
+    commission_percent_overrides: Optional[Dict[int, Decimal]] = None,
+    exchange_rate_overrides: Optional[Dict[Tuple[str, str], Decimal]] = None
+) -> dict:
+    """
+    Пересчитать все незавершённые сделки.
+
+    Оплаченные маршруты не пересчитываются: в итоги идёт сохранённый
+    calculated_route_income (деньги по ним уже списаны). Подмена комиссий
+    и курсов допускается только при dry_run=True.
+
+    Returns:
+        dict со сводкой и списком сделок (поля calculate_deal_income +
+        старый и новый total_usdt_calculated)
+    """
+    if not dry_run and (commission_percent_overrides or exchange_rate_overrides):
+        raise ValueError("Commission and rate overrides are only allowed in what-if mode")
+
+    calculator = _build_calculator(db, commission_percent_overrides)
+    rate_overrides = {
+        pair: to_scaled(rate, RATE_SCALE) for pair, rate in (exchange_rate_overrides or {}).items()
+    }
+
+    open_filter = Deal.status != DealStatus.COMPLETED.value
+    routes_query = db.query(*ROUTE_COLUMNS).join(Deal, Deal.id == Transaction.deal_id).filter(
+        open_filter
+    ).order_by(Transaction.id)
+    deals_query = db.query(
+        Deal.id, Deal.manager_id, Deal.client_rate_percent, Deal.client_sends_currency,
+        Deal.total_usdt_calculated, Deal.created_at
+    ).filter(open_filter).order_by(Deal.id)
+    if not dry_run:
+        # Блокировки в порядке транзакция → сделка (как при оплате маршрута) до commit:
+        # оплата и редактирование сделки ждут пересчёт, пересчёт читает их результат
+        routes_query = routes_query.with_for_update(of=Transaction)
+        deals_query = deals_query.with_for_update(of=Deal)
+    route_rows = routes_query.all()
+    deals = deals_query.all()
+    manager_percents = dict(db.query(
+        ManagerCommission.user_id, ManagerCommission.commission_percent
+    ).filter(ManagerCommission.is_active == True).all())
+
+    fields = [description["name"] for description in routes_query.column_descriptions]
+    values = list(zip(*route_rows)) or [()] * len(fields)
+    routes = {
+        name: np.array(column, dtype=ROUTE_COLUMN_DTYPES.get(name, np.int64))
+        for name, column in zip(fields, values)
+    }
+    # Маршруты сделок, которые завершили между двумя запросами, не пересчитываются
+    deal_ids = np.array([deal.id for deal in deals], dtype=np.int64)
+    route_deals = np.minimum(np.searchsorted(deal_ids, routes["deal_id"]), max(len(deals) - 1, 0))
+    in_deals = deal_ids[route_deals] == routes["deal_id"] if len(deals) else np.zeros(len(route_rows), dtype=bool)
+    routes = {name: column[in_deals] for name, column in routes.items()}
+    route_deals = route_deals[in_deals]
+
+    unpaid = ~routes["is_paid"]
+    for (currency_from, currency_to), rate in rate_overrides.items():
+        pair = unpaid & (routes["from_currency"] == currency_from) & (routes["to_currency"] == currency_to)
+        routes["exchange_rate"][pair] = rate
+    unpaid_routes = {name: column[unpaid] for name, column in routes.items()}
+    incomes, fallback_count = _route_incomes(unpaid_routes, calculator)
+    route_incomes = routes["calculated_route_income"].copy()
+    route_incomes[unpaid] = incomes["calculated_route_income"]
+
+    # Итоги по сделкам: Σ дохода маршрутов (центы) и Σ(сумма_для_клиента × курс) в единицах 1e-8.
+    # Как в calculate_deal_income: сумма_для_клиента и курс по умолчанию 0 и 1
+    amounts = routes["amount_from_account"]
+    rates = np.where(routes["exchange_rate"] != 0, routes["exchange_rate"], RATE_SCALE)
+    if len(amounts) and float(np.abs(amounts).max()) * float(rates.max()) * len(amounts) >= 2.0 ** 62:
+        # Суммы не помещаются в int64 - складываем целыми Python
+        amounts, rates = amounts.astype(object), rates.astype(object)
+    amount_times_rate = amounts * rates
+
+    deal_incomes = np.zeros(len(deals), dtype=np.int64)
+    deal_amount_times_rate = np.zeros(len(deals), dtype=amount_times_rate.dtype)
+    deal_routes_count = np.bincount(route_deals, minlength=len(deals))
+    np.add.at(deal_incomes, route_deals, route_incomes)
+    np.add.at(deal_amount_times_rate, route_deals, amount_times_rate)
+
+    results = []
+    deal_updates = []
+    for i, deal in enumerate(deals):
+        total_usdt_calculated = Decimal(int(deal_incomes[i])).scaleb(-2)
+        income = summarize_deal_totals(
+            total_usdt_calculated,
+            Decimal(int(deal_amount_times_rate[i])).scaleb(-8),
+            client_rate_percent=deal.client_rate_percent,
+            manager_commission_percent=Decimal(str(manager_percents.get(deal.manager_id, 0))),
+            currency=deal.client_sends_currency
+        )
+        results.append({
+            "deal_id": deal.id,
+            "old_total_usdt_calculated": deal.total_usdt_calculated,
+            "total_usdt_calculated": total_usdt_calculated,
+            **income
+        })
+        if deal_routes_count[i]:
+            deal_updates.append({"id": deal.id, "total_usdt_calculated": total_usdt_calculated})
+
+    if not dry_run:
+        partner_fields = {"partner": RECALCULATED_FIELDS[:2], "partner_50_50": RECALCULATED_FIELDS[2:]}
+        columns = {name: column.tolist() for name, column in incomes.items()}
+        transaction_updates = []
+        for i, (transaction_id, route_type) in enumerate(zip(unpaid_routes["id"].tolist(), unpaid_routes["route_type"])):
+            route_income = Decimal(columns["calculated_route_income"][i]).scaleb(-2)
+            route_fields = partner_fields.get(route_type, ())
+            transaction_updates.append({
+                "id": transaction_id,
+                "calculated_route_income": route_income,
+                "final_income": route_income,
+                **{
+                    field: Decimal(columns[field][i]).scaleb(-2) if field in route_fields else None
+                    for field in RECALCULATED_FIELDS
+                }
+            })
+        if transaction_updates:
+            db.execute(update(Transaction), transaction_updates)
+        if deal_updates:
+            db.execute(update(Deal), deal_updates)
+            # total_usdt_calculated входит в дневные агрегаты дашборда
+            refresh_deals_daily_stats(db, [update["id"] for update in deal_updates])
+        db.commit()
+
+    return {
+        "dry_run": dry_run,
+        "deals_count": len(deals),
+        "routes_count": len(route_deals),
+        "transactions_recalculated": int(unpaid.sum()),
+        "routes_recalculated_with_decimal": fallback_count,
+        "deals": results
+    }
@@ -0,0 +1,282 @@
+"""
+Сервис дневных агрегатов по сделкам (deal_daily_stats / deal_daily_route_stats).
+
+Агрегаты обновляются приращениями: для каждой изменённой сделки хранится
+её вклад (deal_stats_contributions / deal_route_stats_contributions) -
+ровно то, что было прибавлено к агрегатам. При изменении сделки старый вклад
+вычитается, новый прибавляется через INSERT ... ON CONFLICT DO UPDATE
+SET x = x + EXCLUDED.x. Перечитываются только строки самой сделки, а
+параллельные изменения разных сделок за один день не конфликтуют:
+приращения коммутативны, а строка вклада сделки блокируется (FOR UPDATE)
+до commit, поэтому параллельные изменения одной сделки идут по очереди.
+
+Полная перестройка - scripts/rebuild_deal_daily_stats.py.
+"""
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import and_, case, func, insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.deal import Deal
+from app.models.transaction import Transaction
+from app.models.deal_daily_stats import (
+    DealDailyStats, DealDailyRouteStats, DealStatsContribution, DealRouteStatsContribution
+)
+from app.models.system_settings import SystemSetting
+
+# Ключ в system_settings: дата последней полной перестройки агрегатов.
+# Пока перестройка не выполнялась, дашборд считает статистику по исходным таблицам.
+ROLLUP_REBUILT_AT_KEY = "deal_daily_stats_rebuilt_at"
+
+# Показатели deal_daily_stats, которые складываются из вкладов сделок (кроме deals_count)
+DEAL_VALUES = ("total_eur", "total_usdt", "total_cost_usdt", "net_profit_usdt", "debt_amount", "debt_deals_count")
+# Показатели deal_daily_route_stats
+ROUTE_VALUES = ("transactions_count", "total_cost_usdt")
+
+DealKey = Tuple  # (day, status, client_id)
+RouteKey = Tuple  # (day, status, route_type)
+
+
+def _deal_contributions(db: Session, deal_ids: list) -> Dict[int, dict]:
+    """Текущий вклад сделок по исходной таблице deals"""
+    rows = db.query(
+        Deal.id, Deal.created_at, Deal.status, Deal.client_id,
+        Deal.total_eur_request, Deal.total_usdt_calculated, Deal.total_cost_usdt, Deal.net_profit_usdt,
+        Deal.is_client_debt, Deal.client_debt_amount
+    ).filter(Deal.id.in_(deal_ids)).all()
+
+    contributions = {}
+    for row in rows:
+        is_debt = bool(row.is_client_debt) and (row.client_debt_amount or 0) > 0
+        contributions[row.id] = {
+            "day": row.created_at.date() if row.created_at else None,
+            "status": row.status,
+            "client_id": row.client_id,
+            "total_eur": row.total_eur_request or Decimal(0),
+            "total_usdt": row.total_usdt_calculated or Decimal(0),
+            "total_cost_usdt": row.total_cost_usdt or Decimal(0),
+            "net_profit_usdt": row.net_profit_usdt or Decimal(0),
+            "debt_amount": row.client_debt_amount if is_debt else Decimal(0),
+            "debt_deals_count": 1 if is_debt else 0,
+        }
+    return contributions
+
+
+def _route_contributions(db: Session, deal_ids: list) -> Dict[int, Dict[str, tuple]]:
+    """Текущий вклад маршрутов сделок: deal_id -> route_type -> (число транзакций, сумма cost_usdt)"""
+    rows = db.query(
+        Transaction.deal_id,
+        Transaction.route_type,
+        func.count(Transaction.id),
+        func.coalesce(func.sum(Transaction.cost_usdt), 0)
+    ).filter(
+        Transaction.deal_id.in_(deal_ids),
+        Transaction.route_type.isnot(None)
+    ).group_by(Transaction.deal_id, Transaction.route_type).all()
+
+    contributions: Dict[int, Dict[str, tuple]] = {}
+    for deal_id, route_type, count, cost in rows:
+        contributions.setdefault(deal_id, {})[route_type] = (count, Decimal(str(cost)))
+    return contributions
+
+
+def _add(deltas: dict, key: tuple, values: Iterable, sign: int):
+    values = [sign * v for v in values]
+    current = deltas.get(key)
+    deltas[key] = values if current is None else [a + b for a, b in zip(current, values)]
+
+
+def _apply_deltas(db: Session, table, key_columns: tuple, value_columns: tuple, count_column: str, deltas: dict):
+    """Прибавить приращения к строкам агрегата и удалить опустевшие строки"""
+    rows = [
+        dict(zip(key_columns + value_columns, key + tuple(values)))
+        for key, values in sorted(deltas.items(), key=lambda item: tuple(str(k) for k in item[0]))
+        if any(values)
+    ]
+    if not rows:
+        return
+
+    # Строки в порядке ключа: параллельные транзакции блокируют их в одном порядке
+    stmt = pg_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={
+            **{column: table.c[column] + stmt.excluded[column] for column in value_columns},
+            "updated_at": func.now(),
+        }
+    )
+    db.execute(stmt, rows)
+
+    emptied = [tuple(row[c] for c in key_columns) for row in rows if row[count_column] < 0]
+    if emptied:
+        db.execute(table.delete().where(
+            tuple_(*(table.c[c] for c in key_columns)).in_(emptied),
+            table.c[count_column] <= 0
+        ))
+
+
+def _replace_contributions(
+    db: Session,
+    deal_ids: list,
+    new_deals: Dict[int, dict],
+    new_routes: Dict[int, Dict[str, tuple]]
+):
+    """Заменить сохранённый вклад сделок новым и применить разницу к агрегатам"""
+    deal_ids = sorted(set(deal_ids))
+    if not deal_ids:
+        return
+
+    # Строка вклада есть у каждой сделки; FOR UPDATE сериализует параллельные изменения одной сделки
+    db.execute(
+        pg_insert(DealStatsContribution.__table__).on_conflict_do_nothing(index_elements=["deal_id"]),
+        [{"deal_id": deal_id} for deal_id in deal_ids]
+    )
+    old_deals = {
+        c.deal_id: c for c in db.query(DealStatsContribution).filter(
+            DealStatsContribution.deal_id.in_(deal_ids)
+        ).order_by(DealStatsContribution.deal_id).with_for_update().populate_existing()
+    }
+    old_routes: Dict[int, Dict[str, tuple]] = {}
+    for route in db.query(DealRouteStatsContribution).filter(DealRouteStatsContribution.deal_id.in_(deal_ids)):
+        old_routes.setdefault(route.deal_id, {})[route.route_type] = (route.transactions_count, route.total_cost_usdt)
+
+    deal_deltas: Dict[DealKey, list] = {}
+    route_deltas: Dict[RouteKey, list] = {}
+    route_rows = []
+    for deal_id in deal_ids:
+        old = old_deals[deal_id]
+        if old.day is not None:
+            _add(deal_deltas, (old.day, old.status, old.client_id), [1] + [getattr(old, v) for v in DEAL_VALUES], -1)
+            for route_type, values in old_routes.get(deal_id, {}).items():
+                _add(route_deltas, (old.day, old.status, route_type), values, -1)
+
+        new = new_deals.get(deal_id)
+        if new is not None and new["day"] is not None:
+            _add(deal_deltas, (new["day"], new["status"], new["client_id"]), [1] + [new[v] for v in DEAL_VALUES], 1)
+            for route_type, values in new_routes.get(deal_id, {}).items():
+                _add(route_deltas, (new["day"], new["status"], route_type), values, 1)
+                route_rows.append({
+                    "deal_id": deal_id, "route_type": route_type,
+                    "transactions_count": values[0], "total_cost_usdt": values[1]
+                })
+            for field in ("day", "status", "client_id") + DEAL_VALUES:
+                setattr(old, field, new[field])
+        else:
+            old.day = old.status = old.client_id = None
+            for field in DEAL_VALUES:
+                setattr(old, field, 0)
+
+    _apply_deltas(
+        db, DealDailyStats.__table__, ("day", "status", "client_id"), ("deals_count",) + DEAL_VALUES,
+        "deals_count", deal_deltas
+    )
+    _apply_deltas(
+        db, DealDailyRouteStats.__table__, ("day", "status", "route_type"), ROUTE_VALUES,
+        "transactions_count", route_deltas
+    )
+
+    db.query(DealRouteStatsContribution).filter(
+        DealRouteStatsContribution.deal_id.in_(deal_ids)
+    ).delete(synchronize_session=False)
+    if route_rows:
+        db.execute(insert(DealRouteStatsContribution), route_rows)
+    db.flush()
+
+
+def refresh_deals_daily_stats(db: Session, deal_ids: Iterable[int]):
+    """Обновить агрегаты после изменения сделок (в т.ч. массовых UPDATE в обход ORM)"""
+    deal_ids = sorted(set(deal_ids))
+    if not deal_ids:
+        return
+    _replace_contributions(db, deal_ids, _deal_contributions(db, deal_ids), _route_contributions(db, deal_ids))
+
+
+def refresh_deal_daily_stats(db: Session, deal: Deal):
+    """
+    Обновить агрегаты после изменения сделки (статус, суммы, задолженность, маршруты).
+    Вызывается перед db.commit() в том же запросе, что и изменение сделки.
+    """
+    db.flush()
+    refresh_deals_daily_stats(db, [deal.id])
+
+
+def discard_deal_daily_stats(db: Session, deal_ids: Iterable[int]):
+    """Вычесть вклад сделок из агрегатов и удалить его (перед удалением сделок)"""
+    deal_ids = sorted(set(deal_ids))
+    if not deal_ids:
+        return
+    _replace_contributions(db, deal_ids, {}, {})
+    db.query(DealStatsContribution).filter(DealStatsContribution.deal_id.in_(deal_ids)).delete()
+
+
+def rebuild_deal_daily_stats(db: Session) -> int:
+    """Полностью перестроить вклады сделок и агрегаты. Возвращает количество строк по сделкам"""
+    for model in (DealDailyStats, DealDailyRouteStats, DealRouteStatsContribution, DealStatsContribution):
+        db.query(model).delete(synchronize_session=False)
+
+    is_debt = and_(Deal.is_client_debt == True, Deal.client_debt_amount > 0)
+    db.execute(insert(DealStatsContribution).from_select(
+        ["deal_id", "day", "status", "client_id"] + list(DEAL_VALUES),
+        select(
+            Deal.id,
+            func.date(Deal.created_at),
+            Deal.status,
+            Deal.client_id,
+            Deal.total_eur_request,
+            func.coalesce(Deal.total_usdt_calculated, 0),
+            func.coalesce(Deal.total_cost_usdt, 0),
+            func.coalesce(Deal.net_profit_usdt, 0),
+            case((is_debt, Deal.client_debt_amount), else_=0),
+            case((is_debt, 1), else_=0)
+        )
+    ))
+    db.execute(insert(DealRouteStatsContribution).from_select(
+        ["deal_id", "route_type", "transactions_count", "total_cost_usdt"],
+        select(
+            Transaction.deal_id,
+            Transaction.route_type,
+            func.count(Transaction.id),
+            func.coalesce(func.sum(Transaction.cost_usdt), 0)
+        ).where(Transaction.route_type.isnot(None)).group_by(Transaction.deal_id, Transaction.route_type)
+    ))
+
+    # Агрегаты - суммы вкладов, как и при обновлении приращениями
+    contribution = DealStatsContribution
+    db.execute(insert(DealDailyStats).from_select(
+        ["day", "status", "client_id", "deals_count"] + list(DEAL_VALUES),
+        select(
+            contribution.day, contribution.status, contribution.client_id, func.count(contribution.deal_id),
+            *(func.sum(getattr(contribution, v)) for v in DEAL_VALUES)
+        ).where(contribution.day.isnot(None)).group_by(contribution.day, contribution.status, contribution.client_id)
+    ))
+    route = DealRouteStatsContribution
+    db.execute(insert(DealDailyRouteStats).from_select(
+        ["day", "status", "route_type"] + list(ROUTE_VALUES),
+        select(
+            contribution.day, contribution.status, route.route_type,
+            func.sum(route.transactions_count), func.sum(route.total_cost_usdt)
+        ).join(contribution, contribution.deal_id == route.deal_id).where(
+            contribution.day.isnot(None)
+        ).group_by(contribution.day, contribution.status, route.route_type)
+    ))
+
+    rebuilt_at = datetime.utcnow().isoformat()
+    setting = db.query(SystemSetting).filter(SystemSetting.key == ROLLUP_REBUILT_AT_KEY).first()
+    if setting:
+        setting.value = rebuilt_at
+    else:
+        db.add(SystemSetting(
+            key=ROLLUP_REBUILT_AT_KEY,
+            value=rebuilt_at,
+            description="Последняя полная перестройка deal_daily_stats"
+        ))
+
+    db.commit()
+    return db.query(func.count(DealDailyStats.id)).scalar()
+
+
+def get_rollup_rebuilt_at(db: Session) -> Optional[str]:
+    """Дата последней полной перестройки или None, если агрегаты ещё не построены"""
+    setting = db.query(SystemSetting).filter(SystemSetting.key == ROLLUP_REBUILT_AT_KEY).first()
+    return setting.value if setting else None
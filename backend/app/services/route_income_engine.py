@@ -0,0 +1,241 @@
+"""
+Векторный расчёт дохода маршрутов для пакетного пересчёта сделок.
+
+Формулы те же, что в DealCalculator.calculate_route_income (direct, exchange,
+partner, partner_50_50), но считаются сразу по колонкам всех маршрутов в
+NumPy на целых числах с фиксированной точкой. Колонки приходят уже в
+масштабе своих колонок БД (суммы - в центах, Numeric(15, 2); курсы - в
+миллионных, Numeric(10, 6)), так что PostgreSQL отдаёт их готовыми
+целыми (см. scaled_column) и Decimal не создаётся на каждый маршрут.
+Внутри:
+- суммы пересчитываются в единицы 1e-8 (AMOUNT_SCALE), фиксированные
+  комиссии переводятся туда точно, проценты комиссий - в сотых (Numeric(5, 2));
+- умножение на курс или множитель комиссии округляется до 1e-8, и для
+  каждой строки ведётся граница накопленной погрешности.
+
+Результат округляется до центов (ROUND_HALF_UP, как numeric в PostgreSQL
+при записи в Numeric(15, 2)). Строки, у которых точное значение может
+лежать по другую сторону половины цента (граница погрешности задевает
+половину цента), и строки, которым не хватает разрядов int64, помечаются
+в fallback: их вызывающий код считает через DealCalculator (Decimal).
+Поэтому результат в центах совпадает с Decimal-расчётом всегда.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from sqlalchemy import BigInteger, cast, func
+from app.services.commission_cache import CommissionSnapshot
+
+AMOUNT_SCALE = 10 ** 8  # Рабочий масштаб сумм
+MONEY_SCALE = 10 ** 2  # Суммы в колонках: Numeric(15, 2)
+RATE_SCALE = 10 ** 6  # Курсы: Numeric(10, 6)
+PERCENT_SCALE = 10 ** 2  # Проценты комиссий: Numeric(5, 2)
+CENT = AMOUNT_SCALE // 100  # Один цент в рабочем масштабе
+# Модуль промежуточного значения, начиная с которого строка считается через Decimal
+SAFE_MAGNITUDE = 2.0 ** 61
+
+COMMISSION_NONE, COMMISSION_FIXED, COMMISSION_PERCENT = 0, 1, 2
+
+# Колонки комиссий маршрута: (ключ route_data, используется ли фиксированная комиссия)
+COMMISSION_SLOTS = {
+    "bank_commission_id": True,
+    "agent_commission_id": True,
+    "exchange_commission_id": True,
+    "exchange_bank_commission_id": True,
+    # Partner-маршруты применяют только процент комиссии
+    "partner_commission_id": False,
+    "partner_50_50_commission_id": False,
+}
+
+# Масштаб числовых колонок маршрута
+SCALED_COLUMNS = {
+    "amount_from_account": MONEY_SCALE,
+    "exchange_rate": RATE_SCALE,
+    "crypto_exchange_rate": RATE_SCALE,
+}
+
+
+def quantize_cents(value) -> Decimal:
+    """Округлить до центов так же, как PostgreSQL при записи в Numeric(15, 2)"""
+    return Decimal(str(value or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def scaled_column(column, scale: int):
+    """Колонка Numeric как целое в масштабе scale (NULL -> 0) - для выборки прямо в int64"""
+    return cast(func.round(func.coalesce(column, 0) * scale), BigInteger)
+
+
+def to_scaled(value, scale: int) -> int:
+    """Decimal/None -> целое в масштабе scale. ValueError, если значение не помещается в масштаб"""
+    scaled = Decimal(str(value or 0)) * scale
+    if scaled != scaled.to_integral_value():
+        raise ValueError(f"{value} has more decimal places than the column stores")
+    return int(scaled)
+
+
+def route_columns(routes: List[dict]) -> Dict[str, np.ndarray]:
+    """Колонки calculate_route_incomes из маршрутов route_data (значения в масштабе колонок БД)"""
+    columns = {"route_type": np.array([route.get("route_type") for route in routes], dtype=object)}
+    for name, scale in SCALED_COLUMNS.items():
+        columns[name] = np.array([to_scaled(route.get(name), scale) for route in routes], dtype=object)
+    for slot in COMMISSION_SLOTS:
+        columns[slot] = np.array([route.get(slot) or 0 for route in routes], dtype=np.int64)
+    return columns
+
+
+def _encode_commission(commission: Optional[CommissionSnapshot], allow_fixed: bool) -> tuple:
+    """(вид COMMISSION_*, величина, не помещается в масштаб)"""
+    if commission is None:
+        return COMMISSION_NONE, 0, False
+    if allow_fixed and commission.is_fixed_currency and commission.commission_fixed:
+        kind, value, scale = COMMISSION_FIXED, commission.commission_fixed, AMOUNT_SCALE
+    elif commission.commission_percent:
+        kind, value, scale = COMMISSION_PERCENT, commission.commission_percent, PERCENT_SCALE
+    else:
+        return COMMISSION_NONE, 0, False
+    scaled = Decimal(str(value)) * scale
+    if scaled != scaled.to_integral_value() or abs(scaled) >= SAFE_MAGNITUDE:
+        return kind, 0, True
+    return kind, int(scaled), False
+
+
+def _commission_columns(
+    ids: np.ndarray,
+    get_commission: Callable[[Optional[int]], Optional[CommissionSnapshot]],
+    allow_fixed: bool
+) -> tuple:
+    """Вид комиссии, её величина (рабочий масштаб или сотые процента) и маска unfit по маршрутам"""
+    unique_ids, positions = np.unique(ids, return_inverse=True)
+    encoded = [
+        _encode_commission(get_commission(int(commission_id)) if commission_id else None, allow_fixed)
+        for commission_id in unique_ids
+    ]
+    kinds = np.array([kind for kind, _, _ in encoded], dtype=np.int8)
+    values = np.array([value for _, value, _ in encoded], dtype=np.int64)
+    unfit = np.array([unfit for _, _, unfit in encoded], dtype=bool)
+    return kinds[positions], values[positions], unfit[positions]
+
+
+def _fit(values: np.ndarray, limit: float) -> tuple:
+    """int64-колонка и маска значений, которые по модулю не меньше limit (для них 0)"""
+    unfit = np.array([abs(value) >= limit for value in values], dtype=bool) if values.dtype == object \
+        else np.abs(values) >= limit
+    return np.where(unfit, 0, values).astype(np.int64), unfit
+
+
+class _Amounts:
+    """Колонка сумм в рабочем масштабе с границей погрешности и флагом переполнения"""
+
+    def __init__(self, value: np.ndarray, error: np.ndarray, overflow: np.ndarray):
+        self.value = value
+        self.error = error  # В единицах рабочего масштаба
+        self.overflow = overflow
+
+    def mul_div(self, numerator: np.ndarray, denominator: int) -> "_Amounts":
+        """value * numerator / denominator с округлением до рабочего масштаба"""
+        estimate = np.abs(self.value.astype(np.float64)) * np.abs(numerator.astype(np.float64)) / denominator
+        overflow = self.overflow | (estimate >= SAFE_MAGNITUDE) | (np.abs(numerator) >= SAFE_MAGNITUDE / (2 * denominator))
+        value = np.where(overflow, 0, self.value)
+        factor = np.where(overflow, 0, numerator)
+        # a * b / d = (a // d) * b + (a % d) * b / d: без переполнения int64
+        quotient, remainder = np.divmod(value, denominator)
+        partial = remainder * factor
+        rounded = (2 * partial + denominator) // (2 * denominator)
+        inexact = partial % denominator != 0
+        error = self.error * np.abs(numerator) / denominator + np.where(inexact, 0.5, 0.0)
+        return _Amounts(quotient * factor + rounded, error, overflow)
+
+    def apply_commission(self, kinds: np.ndarray, values: np.ndarray) -> "_Amounts":
+        """DealCalculator._apply_commission: + фиксированная комиссия или × (1 - процент / 100)"""
+        hundred = 100 * PERCENT_SCALE
+        percent = self.mul_div(np.where(kinds == COMMISSION_PERCENT, hundred - values, hundred), hundred)
+        fixed = kinds == COMMISSION_FIXED
+        return _Amounts(
+            np.where(fixed, self.value + values, percent.value),
+            np.where(fixed, self.error, percent.error),
+            np.where(fixed, self.overflow, percent.overflow)
+        )
+
+    def cents(self) -> tuple:
+        """Центы (ROUND_HALF_UP) и маска строк, где округление неоднозначно или не хватило разрядов"""
+        magnitude = np.abs(self.value)
+        quotient, remainder = np.divmod(magnitude, CENT)
+        cents = np.sign(self.value) * (quotient + (2 * remainder >= CENT))
+        near_half = (self.error > 0) & (np.abs(remainder - CENT // 2) <= self.error + 1)
+        return cents, near_half | self.overflow
+
+
+def calculate_route_incomes(
+    routes: Dict[str, np.ndarray],
+    get_commission: Callable[[Optional[int]], Optional[CommissionSnapshot]]
+) -> Dict[str, np.ndarray]:
+    """
+    Доход маршрутов по колонкам.
+
+    Args:
+        routes: колонки маршрутов - route_type, amount_from_account (центы),
+            exchange_rate и crypto_exchange_rate (миллионные), id комиссий
+            (ключи COMMISSION_SLOTS, 0 - без комиссии)
+        get_commission: комиссия по id (с учётом подмен what-if)
+
+    Returns:
+        dict колонок в центах (int64): calculated_route_income, amount_partner_sends,
+        amount_to_partner_usdt, amount_partner_50_50_sends, amount_to_partner_50_50_usdt
+        (0 для маршрутов другого типа) и маска fallback - маршруты, которые нужно
+        посчитать через DealCalculator
+    """
+    size = len(routes["route_type"])
+    route_type = np.asarray(routes["route_type"], dtype=object)
+    amount, amount_unfit = _fit(routes["amount_from_account"], SAFE_MAGNITUDE / (AMOUNT_SCALE // MONEY_SCALE))
+    rate, rate_unfit = _fit(routes["exchange_rate"], SAFE_MAGNITUDE)
+    crypto_rate, crypto_rate_unfit = _fit(routes["crypto_exchange_rate"], SAFE_MAGNITUDE)
+    commissions = {}
+    unfit = amount_unfit | rate_unfit | crypto_rate_unfit
+    for slot, allow_fixed in COMMISSION_SLOTS.items():
+        kinds, values, commission_unfit = _commission_columns(routes[slot], get_commission, allow_fixed)
+        commissions[slot] = (kinds, values)
+        unfit |= commission_unfit
+    # Непредставимые значения не участвуют в расчёте: строка уходит в fallback
+    base = _Amounts(amount * (AMOUNT_SCALE // MONEY_SCALE), np.zeros(size), unfit)
+
+    # Direct: (сумма - комиссия банка) × курс
+    direct = base.apply_commission(*commissions["bank_commission_id"]).mul_div(rate, RATE_SCALE)
+
+    # Exchange: (сумма - комиссии агента, обменника, банка) × курс крипты × курс
+    exchange = base
+    for slot in ("agent_commission_id", "exchange_commission_id", "exchange_bank_commission_id"):
+        exchange = exchange.apply_commission(*commissions[slot])
+    exchange = exchange.mul_div(crypto_rate, RATE_SCALE).mul_div(rate, RATE_SCALE)
+
+    # Partner: отправляет = сумма × курс, партнёру = отправляет × (1 - процент / 100), доход = max
+    sends_amounts = base.mul_div(rate, RATE_SCALE)
+    sends, sends_fallback = sends_amounts.cents()
+    result = {"calculated_route_income": np.zeros(size, dtype=np.int64)}
+    fallback = np.zeros(size, dtype=bool)
+    # Как в DealCalculator: без суммы или курса доход маршрута 0 (unfit-строки считаются отдельно)
+    has_amount = ((amount != 0) & (rate != 0)) | unfit
+
+    for mask, amounts in (
+        ((route_type == "direct") & has_amount, direct),
+        ((route_type == "exchange") & has_amount & ((crypto_rate != 0) | unfit), exchange),
+    ):
+        cents, ambiguous = amounts.cents()
+        result["calculated_route_income"] = np.where(mask, cents, result["calculated_route_income"])
+        fallback |= mask & ambiguous
+
+    for kind, slot, prefix in (
+        ("partner", "partner_commission_id", ""),
+        ("partner_50_50", "partner_50_50_commission_id", "_50_50"),
+    ):
+        mask = (route_type == kind) & has_amount
+        to_partner, to_partner_fallback = sends_amounts.apply_commission(*commissions[slot]).cents()
+        result[f"amount_partner{prefix}_sends"] = np.where(mask, sends, 0)
+        result[f"amount_to_partner{prefix}_usdt"] = np.where(mask, to_partner, 0)
+        # Округление монотонно: max округлённых = округлённый max
+        result["calculated_route_income"] = np.where(
+            mask, np.maximum(sends, to_partner), result["calculated_route_income"]
+        )
+        fallback |= mask & (sends_fallback | to_partner_fallback)
+
+    result["fallback"] = fallback
+    return result
@@ -0,0 +1,98 @@
+"""
+Бенчмарк холодного старта приложения: от импорта app.main до готовности.
+
+Каждый прогон - отдельный процесс Python (холодный импорт), в котором
+замеряются:
+- import: время импорта app.main;
+- startup: lifespan при старте (прогрев пулов соединений и кэшей);
+- first request: первый GET /health;
+- ready: сумма, время от запуска импорта до первого ответа.
+
+С --with-create-all в процессе перед импортом выполняется
+Base.metadata.create_all, как это делал app.main раньше, для сравнения.
+Также проверяется, что импорт app.main не открывает соединений с БД.
+
+Запускать на БД с применёнными миграциями:
+    python scripts/benchmark_app_startup.py --runs 5
+    python scripts/benchmark_app_startup.py --runs 5 --with-create-all
+"""
+import sys
+import os
+import argparse
+import json
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Код, выполняемый в отдельном процессе; печатает JSON с замерами
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+connects = []
+event.listen(Engine, "connect", lambda *args: connects.append(1))
+if WITH_CREATE_ALL:
+    from app.core.database import Base, engine
+    import app.models
+    Base.metadata.create_all(bind=engine)
+import app.main
+imported = time.perf_counter()
+import_connects = len(connects)
+
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    response = client.get("/health")
+    first_response = time.perf_counter()
+print(json.dumps({
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_request": first_response - ready,
+    "ready": first_response - started,
+    "import_connects": import_connects,
+    "status": response.status_code,
+}))
+"""
+
+
+def run_once(with_create_all: bool) -> dict:
+    code = CHILD.replace("WITH_CREATE_ALL", repr(with_create_all))
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": BACKEND_DIR}
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        print("❌ Application failed to start")
+        sys.exit(1)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Число холодных запусков")
+    parser.add_argument("--with-create-all", action="store_true", help="Выполнять create_all перед импортом (как раньше)")
+    args = parser.parse_args()
+
+    runs = [run_once(args.with_create_all) for _ in range(args.runs)]
+
+    print(f"{args.runs} cold starts{' with create_all' if args.with_create_all else ''}")
+    print(f"{'phase':<15} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for phase in ("import", "startup", "first_request", "ready"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<15} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}")
+
+    if any(run["status"] != 200 for run in runs):
+        print("❌ /health did not respond with 200")
+        sys.exit(1)
+    if not args.with_create_all and any(run["import_connects"] for run in runs):
+        print("❌ Importing app.main opened a database connection")
+        sys.exit(1)
+    print("✅ Application started and answered /health")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Бенчмарк сводных показателей дашборда: старый вариант (8 отдельных запросов)
+против условной агрегации одним запросом (get_dashboard_summary_totals).
+
+Запускать только на отдельной тестовой БД:
+    python scripts/benchmark_dashboard_summary.py --seed 500000 --runs 20
+
+--seed N добавляет N синтетических сделок (пакетный INSERT, работает и на
+SQLite) и одного клиента/менеджера для внешних ключей. Время зависит от
+БД и машины: сравнивайте оба варианта в одном прогоне.
+"""
+import sys
+import os
+import argparse
+import statistics
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, and_, insert
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.user import User
+from app.api.statistics import get_dashboard_summary_totals
+
+
+def seed_deals(db: Session, count: int, batch_size: int = 10000):
+    """Синтетические сделки: ~40% завершённых, ~10% с задолженностью, даты за 2 года"""
+    manager = db.query(User).filter(User.email == "bench@test.com").first()
+    if manager is None:
+        manager = User(email="bench@test.com", hashed_password="x", full_name="Benchmark", role="manager")
+        db.add(manager)
+    client = Client(name="Benchmark client")
+    db.add(client)
+    db.flush()
+
+    now = datetime.utcnow()
+    for batch_start in range(1, count + 1, batch_size):
+        db.execute(insert(Deal), [
+            {
+                "client_id": client.id,
+                "manager_id": manager.id,
+                "total_eur_request": 1000 + g % 5000,
+                "client_rate_percent": Decimal("1.0"),
+                "total_usdt_calculated": 1100 + g % 5000,
+                "total_cost_usdt": 1050 + g % 5000,
+                "net_profit_usdt": 50 + g % 50,
+                "status": DealStatus.COMPLETED.value if g % 5 < 2 else DealStatus.EXECUTION.value,
+                "client_debt_amount": 100 if g % 10 == 0 else 0,
+                "client_paid_amount": 0,
+                "is_client_debt": g % 10 == 0,
+                "created_at": now - timedelta(days=g % 730),
+            }
+            for g in range(batch_start, min(batch_start + batch_size, count + 1))
+        ])
+    db.commit()
+
+
+def legacy_summary_totals(db: Session, start=None, end=None) -> dict:
+    """Прежняя реализация: отдельный запрос на каждый показатель"""
+    query = db.query(Deal)
+    if start:
+        query = query.filter(Deal.created_at >= start)
+    if end:
+        query = query.filter(Deal.created_at <= end)
+
+    total_deals = query.count()
+    completed_deals = query.filter(Deal.status == DealStatus.COMPLETED.value).count()
+
+    completed_filters = [Deal.status == DealStatus.COMPLETED.value]
+    debt_filters = [Deal.is_client_debt == True, Deal.client_debt_amount > 0]
+    if start:
+        completed_filters.append(Deal.created_at >= start)
+        debt_filters.append(Deal.created_at >= start)
+    if end:
+        completed_filters.append(Deal.created_at <= end)
+        debt_filters.append(Deal.created_at <= end)
+
+    def completed_sum(column):
+        return db.query(func.sum(column)).filter(and_(*completed_filters)).scalar() or Decimal('0')
+
+    return {
+        'total_deals': total_deals,
+        'completed_deals': completed_deals,
+        'total_eur': completed_sum(Deal.total_eur_request),
+        'total_usdt': completed_sum(Deal.total_usdt_calculated),
+        'total_cost': completed_sum(Deal.total_cost_usdt),
+        'total_profit': completed_sum(Deal.net_profit_usdt),
+        'total_debt': db.query(func.sum(Deal.client_debt_amount)).filter(and_(*debt_filters)).scalar() or Decimal('0'),
+        'deals_with_debt': db.query(func.count(Deal.id)).filter(and_(*debt_filters)).scalar() or 0,
+    }
+
+
+def measure(db: Session, fn, runs: int):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn(db)
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="Сколько синтетических сделок добавить перед замером")
+    parser.add_argument("--runs", type=int, default=20, help="Количество повторов каждого варианта")
+    args = parser.parse_args()
+
+    db: Session = SessionLocal()
+    try:
+        if args.seed:
+            print(f"Seeding {args.seed} deals...")
+            seed_deals(db, args.seed)
+
+        deals_count = db.query(func.count(Deal.id)).scalar()
+        print(f"Deals in table: {deals_count}")
+
+        legacy, legacy_ms = measure(db, legacy_summary_totals, args.runs)
+        single, single_ms = measure(db, get_dashboard_summary_totals, args.runs)
+
+        if legacy != single:
+            print(f"❌ Results differ:\n  legacy: {legacy}\n  single: {single}")
+            sys.exit(1)
+
+        for name, timings in (("legacy (8 queries)", legacy_ms), ("single query", single_ms)):
+            print(f"{name:20} median {statistics.median(timings):8.1f} ms   max {max(timings):8.1f} ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
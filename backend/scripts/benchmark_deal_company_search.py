@@ -0,0 +1,150 @@
+"""
+Бенчмарк фильтров списка сделок по названию компании и номеру счёта:
+прежний вариант (список id сделок в Python + IN (...)) против EXISTS
+с trigram-индексами (миграция j_company_search_trgm).
+
+Запускать только на отдельной тестовой БД после alembic upgrade head:
+    python scripts/benchmark_deal_company_search.py --seed 1000000 --runs 10
+
+--seed N добавляет N синтетических транзакций (через generate_series),
+по одной сделке на 5 транзакций и 10 000 компаний клиента со счетами.
+"""
+import sys
+import os
+import argparse
+import statistics
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.models.deal import Deal
+from app.models.company import Company
+from app.models.company_account import CompanyAccount
+from app.models.transaction import Transaction
+from app.services.deal_list import apply_deal_filters
+
+COMPANIES = 10000
+
+
+class BenchmarkUser:
+    """Бухгалтер: фильтр по менеджеру не применяется"""
+    id = 0
+    role = "accountant"
+
+
+def seed(db: Session, transactions: int):
+    db.execute(text("""
+        INSERT INTO users (email, hashed_password, full_name, role, is_active)
+        VALUES ('bench@test.com', 'x', 'Benchmark', 'manager', 'true')
+        ON CONFLICT (email) DO NOTHING
+    """))
+    manager_id = db.execute(text("SELECT id FROM users WHERE email = 'bench@test.com'")).scalar()
+    client_id = db.execute(text(
+        "INSERT INTO clients (name, is_active) VALUES ('Benchmark client', true) RETURNING id"
+    )).scalar()
+    first_company = min(db.execute(text("""
+        INSERT INTO companies (client_id, name)
+        SELECT :client_id, 'Company ' || md5(g::text) FROM generate_series(1, :count) AS g
+        RETURNING id
+    """), {"client_id": client_id, "count": COMPANIES}).scalars().all())
+    db.execute(text("""
+        INSERT INTO company_accounts (company_id, account_name, account_number, is_active)
+        SELECT id, 'IBAN EUR', 'DE' || lpad((id * 7919)::text, 20, '0'), true
+        FROM companies WHERE client_id = :client_id
+    """), {"client_id": client_id})
+    first_deal = min(db.execute(text("""
+        INSERT INTO deals (client_id, manager_id, total_eur_request, status,
+                           client_debt_amount, client_paid_amount, is_client_debt)
+        SELECT :client_id, :manager_id, 1000, 'execution', 0, 0, false
+        FROM generate_series(1, :count)
+        RETURNING id
+    """), {"client_id": client_id, "manager_id": manager_id, "count": transactions // 5}).scalars().all())
+    db.execute(text("""
+        INSERT INTO transactions (deal_id, client_company_id, route_type, status)
+        SELECT :first_deal + (g % :deals), :first_company + (g % :companies), 'direct', 'PENDING'
+        FROM generate_series(0, :count - 1) AS g
+    """), {
+        "first_deal": first_deal, "deals": transactions // 5,
+        "first_company": first_company, "companies": COMPANIES, "count": transactions
+    })
+    db.commit()
+    db.execute(text("ANALYZE transactions; ANALYZE companies; ANALYZE company_accounts; ANALYZE deals"))
+
+
+def legacy_filter(db: Session, company_name=None, account_number=None) -> list:
+    """Прежняя схема: id сделок выбираются отдельным запросом и подставляются в IN (...)"""
+    query = db.query(Deal.id)
+    if company_name:
+        deal_ids = [row[0] for row in db.query(Transaction.deal_id).join(
+            Company, Company.id == Transaction.client_company_id
+        ).filter(Company.name.ilike(f"%{company_name}%")).distinct().all()]
+        query = query.filter(Deal.id.in_(deal_ids or [-1]))
+    if account_number:
+        deal_ids = [row[0] for row in db.query(Transaction.deal_id).join(
+            CompanyAccount, CompanyAccount.company_id == Transaction.client_company_id
+        ).filter(CompanyAccount.account_number.ilike(f"%{account_number}%")).distinct().all()]
+        query = query.filter(Deal.id.in_(deal_ids or [-1]))
+    return sorted(row[0] for row in query.order_by(Deal.id.desc()).limit(100).all())
+
+
+def exists_filter(db: Session, company_name=None, account_number=None) -> list:
+    query = apply_deal_filters(
+        db.query(Deal.id), BenchmarkUser(),
+        company_name=company_name, account_number=account_number
+    )
+    return sorted(row[0] for row in query.order_by(Deal.id.desc()).limit(100).all())
+
+
+def measure(fn, runs: int):
+    timings = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="Сколько синтетических транзакций добавить перед замером")
+    parser.add_argument("--runs", type=int, default=10, help="Количество повторов каждого варианта")
+    parser.add_argument("--company", default="abc", help="Подстрока названия компании")
+    parser.add_argument("--account", default="7919", help="Подстрока номера счёта")
+    args = parser.parse_args()
+
+    db: Session = SessionLocal()
+    try:
+        if args.seed:
+            print(f"Seeding {args.seed} transactions...")
+            seed(db, args.seed)
+
+        print(f"Transactions in table: {db.query(Transaction).count()}")
+        cases = {
+            "company": {"company_name": args.company},
+            "account": {"account_number": args.account},
+        }
+        for name, filters in cases.items():
+            legacy, legacy_ms = measure(lambda: legacy_filter(db, **filters), args.runs)
+            current, exists_ms = measure(lambda: exists_filter(db, **filters), args.runs)
+            if legacy != current:
+                print(f"❌ {name}: results differ")
+                sys.exit(1)
+            for label, timings in ((f"{name} IN (...)", legacy_ms), (f"{name} EXISTS", exists_ms)):
+                print(f"{label:20} median {statistics.median(timings):8.1f} ms   max {max(timings):8.1f} ms")
+
+        explain_query = apply_deal_filters(db.query(Deal.id), BenchmarkUser(), company_name=args.company)
+        compiled = explain_query.order_by(Deal.id.desc()).limit(100).statement.compile(
+            dialect=db.bind.dialect, compile_kwargs={"literal_binds": True}
+        )
+        print("\nEXPLAIN (company):")
+        for row in db.execute(text(f"EXPLAIN ANALYZE {compiled}")):
+            print(f"  {row[0]}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Проверка и бенчмарк DealCalculator.preview_calculation.
+
+Сравнивает однопроходный preview_calculation с прежней реализацией
+(каждый маршрут рассчитывался трижды: сам маршрут, итоги транзакции,
+итоги сделки) на синтетической сделке из N транзакций со всеми типами
+маршрутов. Результаты должны совпадать полностью (golden-проверка),
+затем выводится время обоих вариантов.
+
+Использует комиссии из route_commissions текущей БД (только чтение):
+    python scripts/benchmark_deal_preview.py --transactions 50 --runs 200
+
+Сделка строится с фиксированным seed, так что замеры повторяемы на одной
+машине. Без PostgreSQL подойдёт SQLite-файл с таблицами из
+Base.metadata.create_all и несколькими строками route_commissions:
+    DATABASE_URL=sqlite:////tmp/preview.db python scripts/benchmark_deal_preview.py
+"""
+import sys
+import os
+import argparse
+import random
+import statistics
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decimal import Decimal
+from app.core.database import SessionLocal
+from app.services.deal_calculator import DealCalculator
+from app.services.commission_cache import get_commissions
+
+
+def legacy_preview_calculation(calculator: DealCalculator, deal_data: dict) -> dict:
+    """Прежняя реализация preview_calculation (три прохода по маршрутам)"""
+    transactions = deal_data.get("transactions", [])
+    calculated_transactions = []
+
+    for trans in transactions:
+        routes = trans.get("routes", [])
+        calculated_routes = []
+
+        for route in routes:
+            route_calc = calculator.calculate_route_income(route)
+            calculated_routes.append({
+                **route,
+                **route_calc
+            })
+
+        trans_totals = calculator.calculate_transaction_totals(routes)
+        calculated_transactions.append({
+            **trans,
+            "routes": calculated_routes,
+            "amount_for_client": trans_totals["amount_for_client"],
+            "final_income": trans_totals["final_income"]
+        })
+
+    deal_totals = calculator.calculate_deal_totals(transactions)
+
+    return {
+        "transactions": calculated_transactions,
+        **deal_totals
+    }
+
+
+def build_deal(transactions_count: int, commission_ids: list) -> dict:
+    """Синтетическая сделка: 1-3 маршрута всех типов в каждой транзакции"""
+    rnd = random.Random(42)
+
+    def commission():
+        return rnd.choice(commission_ids) if commission_ids else None
+
+    transactions = []
+    for i in range(transactions_count):
+        routes = []
+        for _ in range(rnd.randint(1, 3)):
+            route_type = rnd.choice(["direct", "exchange", "partner", "partner_50_50"])
+            route = {
+                "route_type": route_type,
+                "amount_from_account": str(Decimal(rnd.randint(10000, 5000000)) / 100),
+                "exchange_rate": str(Decimal(rnd.randint(90000, 130000)) / 100000),
+            }
+            if route_type == "direct":
+                route["bank_commission_id"] = commission()
+            elif route_type == "exchange":
+                route["crypto_exchange_rate"] = str(Decimal(rnd.randint(95000, 105000)) / 100000)
+                route["agent_commission_id"] = commission()
+                route["exchange_commission_id"] = commission()
+                route["exchange_bank_commission_id"] = commission()
+            elif route_type == "partner":
+                route["partner_commission_id"] = commission()
+            else:
+                route["partner_50_50_commission_id"] = commission()
+            routes.append(route)
+        transactions.append({"client_company_id": i + 1, "routes": routes})
+    return {"transactions": transactions}
+
+
+def measure(fn, runs: int):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=50, help="Количество транзакций в сделке")
+    parser.add_argument("--runs", type=int, default=200, help="Количество повторов каждого варианта")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        commission_ids = sorted(get_commissions(db).keys())
+        deal_data = build_deal(args.transactions, commission_ids)
+        routes_count = sum(len(t["routes"]) for t in deal_data["transactions"])
+        print(f"Deal: {args.transactions} transactions, {routes_count} routes, {len(commission_ids)} commissions")
+
+        calculator = DealCalculator(db)
+        legacy = legacy_preview_calculation(calculator, deal_data)
+        single = calculator.preview_calculation(deal_data)
+        if legacy != single:
+            print("❌ preview_calculation differs from the legacy three-pass result")
+            sys.exit(1)
+        print("✅ Golden check passed: results are identical")
+
+        legacy_ms = measure(lambda: legacy_preview_calculation(calculator, deal_data), args.runs)
+        single_ms = measure(lambda: calculator.preview_calculation(deal_data), args.runs)
+        for name, timings in (("legacy (3 passes)", legacy_ms), ("single pass", single_ms)):
+            print(f"{name:20} median {statistics.median(timings):8.3f} ms   max {max(timings):8.3f} ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Проверка сводки остатков GET /api/company-balances/summary и её кэша.
+
+- сводка собирается двумя запросами независимо от числа компаний и счетов;
+- итоги по (компания, валюта) совпадают с суммой балансов счетов;
+- повторный запрос обслуживается из кэша без обращения к БД;
+- кэш сбрасывается после commit изменения счёта через ORM и после
+  списания через balance_ledger, но не после rollback.
+
+Запускать на тестовой БД:
+    python scripts/check_balance_summary_cache.py --companies 20
+"""
+import sys
+import os
+import argparse
+import uuid
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app.core.database import SessionLocal, engine
+from app.models.user import User, UserRole
+from app.models.internal_company import InternalCompany
+from app.models.internal_company_account import InternalCompanyAccount
+from app.models.internal_company_account_history import InternalCompanyAccountHistory
+from app.api.company_balances import company_balances_summary
+from app.services.balance_ledger import debit_company_account
+from app.services.balance_summary_cache import invalidate_balance_summary
+
+# Счета компаний с итогами по валютам, крипто-счета
+MAX_QUERIES = 2
+
+
+def seed(db, companies: int, suffix: str):
+    user = User(email=f"summary-{suffix}@test.com", hashed_password="x", role=UserRole.ACCOUNTANT.value)
+    company_rows = [InternalCompany(name=f"Summary company {suffix} {i}") for i in range(companies)]
+    db.add_all(company_rows + [user])
+    db.flush()
+    db.add_all([
+        InternalCompanyAccount(
+            company_id=company.id, account_name=f"{currency} {i}", account_number=f"{suffix}-{company.id}-{currency}-{i}",
+            currency=currency, balance=Decimal("1000.25") * (i + 1)
+        )
+        for company in company_rows for currency in ("EUR", "USD") for i in range(3)
+    ])
+    db.commit()
+    return user.id, [company.id for company in company_rows]
+
+
+def summary_with_count():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        return company_balances_summary(db), len(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+        db.close()
+
+
+def company_total(summary, company_id: int, currency: str) -> Decimal:
+    return next(c.total_balance for c in summary.companies if (c.company_id, c.currency) == (company_id, currency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=20, help="Внутренних компаний (по 3 EUR и 3 USD счёта)")
+    args = parser.parse_args()
+
+    errors = []
+    db = SessionLocal()
+    user_id, company_ids = seed(db, args.companies, uuid.uuid4().hex[:8])
+    try:
+        invalidate_balance_summary()
+        summary, queries = summary_with_count()
+        print(f"summary with {len(summary.companies)} company/currency rows: {queries} queries (max {MAX_QUERIES})")
+        if queries > MAX_QUERIES:
+            errors.append(f"summary took {queries} queries")
+        for entry in summary.companies:
+            if entry.total_balance != Decimal(str(sum(a["balance"] for a in entry.accounts))).quantize(Decimal("0.01")):
+                errors.append(f"company {entry.company_id} {entry.currency}: total {entry.total_balance} != sum of accounts")
+
+        _, queries = summary_with_count()
+        print(f"repeated summary: {queries} queries")
+        if queries:
+            errors.append("repeated summary was not served from cache")
+
+        company_id = company_ids[0]
+        account = db.query(InternalCompanyAccount).filter(
+            InternalCompanyAccount.company_id == company_id, InternalCompanyAccount.currency == "EUR"
+        ).order_by(InternalCompanyAccount.id).first()
+        before = company_total(summary, company_id, "EUR")
+
+        account.balance += Decimal("100")
+        db.flush()
+        db.rollback()
+        if company_total(summary_with_count()[0], company_id, "EUR") != before:
+            errors.append("rollback changed the cached summary")
+
+        account.balance += Decimal("100")
+        db.commit()
+        after_update = company_total(summary_with_count()[0], company_id, "EUR")
+        print(f"after ORM update: {before} -> {after_update}")
+        if after_update != before + 100:
+            errors.append("ORM update did not invalidate the summary")
+
+        debit_company_account(db, account.id, Decimal("40"), changed_by=user_id, comment="summary cache check")
+        db.commit()
+        after_debit = company_total(summary_with_count()[0], company_id, "EUR")
+        print(f"after ledger debit: {after_update} -> {after_debit}")
+        if after_debit != after_update - 40:
+            errors.append("ledger debit did not invalidate the summary")
+    finally:
+        account_ids = [a for (a,) in db.query(InternalCompanyAccount.id).filter(
+            InternalCompanyAccount.company_id.in_(company_ids)
+        ).all()]
+        db.query(InternalCompanyAccountHistory).filter(
+            InternalCompanyAccountHistory.account_id.in_(account_ids)
+        ).delete(synchronize_session=False)
+        db.query(InternalCompanyAccount).filter(InternalCompanyAccount.id.in_(account_ids)).delete(synchronize_session=False)
+        db.query(InternalCompany).filter(InternalCompany.id.in_(company_ids)).delete(synchronize_session=False)
+        db.query(User).filter(User.id == user_id).delete()
+        db.commit()
+        db.close()
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ Summary is built in constant queries and cached until balances change")
+
+
+if __name__ == "__main__":
+    main()
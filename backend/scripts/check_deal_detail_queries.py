@@ -0,0 +1,188 @@
+"""
+Регрессионная проверка количества SQL-запросов GET /api/deals/{deal_id}.
+
+Создаёт сделку с N транзакциями и N записями истории от разных пользователей,
+вызывает детали сделки (GET /deals/{deal_id}) с include_history=true
+и считает выполненные запросы. Ожидается не больше MAX_QUERIES независимо от N,
+а без include_history - history = null (история не читается).
+Затем проходит всю историю через /history с курсором и проверяет, что
+страницы покрывают все записи без повторов, а фильтр action по значению,
+которое пишет редактирование сделки, возвращает эту запись.
+
+Запускать на тестовой БД:
+    python scripts/check_deal_detail_queries.py --rows 20
+"""
+import sys
+import os
+import argparse
+import uuid
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import Response
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from app.core.database import SessionLocal, engine
+from app.core.auth_cache import UserPrincipal
+from app.core.security import create_access_token
+from app.core.deal_history_localization import DealHistoryActionRU
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.deal_history import DealHistory
+from app.models.transaction import Transaction
+from app.api.deals import build_deal_detail, build_deal_history_page, add_deal_history, DEAL_DETAIL_HISTORY_LIMIT
+from app.main import app
+
+# Сделка с создателем и менеджером, транзакции, история
+MAX_QUERIES = 3
+# Размер страницы при проходе истории курсором
+PAGE_SIZE = 7
+
+
+def seed(db, rows: int):
+    suffix = uuid.uuid4().hex[:8]
+    users = [
+        User(email=f"detail-{suffix}-{i}@test.com", hashed_password="x", full_name=f"User {i}",
+             role=UserRole.ACCOUNTANT.value)
+        for i in range(rows)
+    ]
+    client = Client(name=f"Detail client {suffix}")
+    db.add_all(users + [client])
+    db.flush()
+
+    deal = Deal(
+        client_id=client.id,
+        manager_id=users[0].id,
+        created_by_id=users[-1].id,
+        total_eur_request=1000,
+        status=DealStatus.EXECUTION.value
+    )
+    db.add(deal)
+    db.flush()
+    db.add_all([Transaction(deal_id=deal.id, route_type="direct") for _ in range(rows)])
+    created_at = datetime.utcnow().replace(microsecond=0)
+    db.add_all([
+        # Одинаковое время у всех записей: страницы должны разделяться по id
+        DealHistory(
+            deal_id=deal.id, user_id=user.id, action=DealHistoryActionRU.CREATED.value, created_at=created_at,
+            user_email=user.email, user_name=user.full_name, user_role=user.role
+        )
+        for user in users
+    ])
+    db.commit()
+    return deal.id, [user.id for user in users], client.id
+
+
+def filter_history(deal_id: int, user_id: int) -> tuple:
+    """Запись редактирования через add_deal_history и /history?action= с её значением"""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).one()
+        edited = add_deal_history(db, deal_id, user.id, DealHistoryActionRU.DEAL_EDITED.value, user=user)
+        db.commit()
+        edited_id = edited.id
+        client = TestClient(app)
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': user.email})}"
+        response = client.get(
+            f"/api/deals/{deal_id}/history", params={"action": DealHistoryActionRU.DEAL_EDITED.value}
+        )
+        db.query(DealHistory).filter(DealHistory.id == edited_id).delete()
+        db.commit()
+    finally:
+        db.close()
+    found = [h["id"] for h in response.json()] if response.status_code == 200 else response.text
+    return edited_id, found
+
+
+def cleanup(db, deal_id: int, user_ids: list, client_id: int):
+    db.query(DealHistory).filter(DealHistory.deal_id == deal_id).delete()
+    db.query(Transaction).filter(Transaction.deal_id == deal_id).delete()
+    db.query(Deal).filter(Deal.id == deal_id).delete()
+    db.query(Client).filter(Client.id == client_id).delete()
+    db.query(User).filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.commit()
+
+
+def walk_history(deal_id: int, current_user) -> list:
+    """Пройти всю историю сделки страницами по X-Next-Cursor, вернуть id записей"""
+    ids, cursor = [], None
+    db = SessionLocal()
+    try:
+        while True:
+            response = Response()
+            page = build_deal_history_page(db, response, deal_id, current_user, limit=PAGE_SIZE, cursor=cursor)
+            ids.extend(h.id for h in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor or len(ids) > len(set(ids)):
+                return ids
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20, help="Транзакций, записей истории и пользователей")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        deal_id, user_ids, client_id = seed(db, args.rows)
+        director = UserPrincipal(
+            id=0, email="director@test.com", full_name=None,
+            role=UserRole.DIRECTOR.value, is_active="true", user_role=UserRole.DIRECTOR
+        )
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        request_db = SessionLocal()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = build_deal_detail(
+                request_db, Response(), deal_id, director,
+                include_history=True, history_limit=DEAL_DETAIL_HISTORY_LIMIT
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+            request_db.close()
+
+        request_db = SessionLocal()
+        try:
+            without_history = build_deal_detail(request_db, Response(), deal_id, director)
+        finally:
+            request_db.close()
+
+        page_ids = walk_history(deal_id, director)
+        edited_id, filtered = filter_history(deal_id, user_ids[1])
+
+        ok = (
+            len(statements) <= MAX_QUERIES
+            and len(response.transactions) == args.rows
+            and len(response.history) == min(args.rows, DEAL_DETAIL_HISTORY_LIMIT)
+            and all(h.user_email for h in response.history)
+            and without_history.history is None
+            and response.manager_email and response.created_by_email
+            and len(page_ids) == len(set(page_ids)) == args.rows
+            and filtered == [edited_id]
+        )
+        print(f"get_deal with {args.rows} transactions/history rows: {len(statements)} queries (max {MAX_QUERIES})")
+        print(f"get_deal without include_history: history = {without_history.history}")
+        print(f"/history by {PAGE_SIZE}: {len(page_ids)} records, {len(set(page_ids))} unique")
+        print(f"/history?action={DealHistoryActionRU.DEAL_EDITED.value}: {filtered} (expected [{edited_id}])")
+        cleanup(db, deal_id, user_ids, client_id)
+    finally:
+        db.close()
+
+    if not ok:
+        for statement in statements:
+            print(f"  {statement.splitlines()[0]} ...")
+        print("❌ Deal detail or history regression")
+        sys.exit(1)
+    print("✅ Deal detail loads in a bounded number of queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Проверка фильтров по компании и счёту клиента в CSV-экспорте сделок.
+
+Создаёт сделки с транзакциями на две компании клиента (нужная и
+посторонняя) и проверяет, что экспорт с фильтром company_name или
+account_number:
+- содержит ровно сделки, у которых есть транзакция на нужную компанию;
+- по каждой такой сделке содержит все её транзакции (и транзакции на
+  постороннюю компанию), а не только совпавшие с фильтром;
+- считает доход сделки так же, как экспорт без фильтра.
+
+Имя клиента начинается с «=»: в CSV оно должно выйти с апострофом, а не
+как формула.
+
+Запускать на тестовой БД:
+    python scripts/check_deal_export_filters.py
+"""
+import sys
+import os
+import argparse
+import csv
+import io
+import uuid
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import SessionLocal
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.company import Company
+from app.models.company_account import CompanyAccount
+from app.models.deal import Deal
+from app.models.transaction import Transaction
+from app.services.deal_list import stream_deals_csv
+
+
+class ExportUser:
+    """Бухгалтер: фильтр по менеджеру не применяется"""
+    id = 0
+    role = UserRole.ACCOUNTANT.value
+
+
+def seed(db, suffix: str) -> dict:
+    """Сделки: на обе компании, только на нужную, только на постороннюю, без транзакций"""
+    user = User(email=f"export-{suffix}@test.com", hashed_password="x", role=UserRole.MANAGER.value)
+    client = Client(name=f"=HYPERLINK(\"http://example.com\";\"Export client {suffix}\")")
+    db.add_all([user, client])
+    db.flush()
+    target = Company(client_id=client.id, name=f"Target {suffix}")
+    other = Company(client_id=client.id, name=f"Other {suffix}")
+    db.add_all([target, other])
+    db.flush()
+    db.add_all([
+        CompanyAccount(company_id=target.id, account_name="EUR", account_number=f"DE-{suffix}-TARGET"),
+        CompanyAccount(company_id=other.id, account_name="EUR", account_number=f"DE-{suffix}-OTHER"),
+    ])
+
+    layouts = {"mixed": [target, other, other], "target": [target], "other": [other], "empty": []}
+    deal_ids = {}
+    for name, companies in layouts.items():
+        deal = Deal(client_id=client.id, manager_id=user.id, total_eur_request=1000, client_rate_percent=Decimal(2))
+        db.add(deal)
+        db.flush()
+        db.add_all([
+            Transaction(
+                deal_id=deal.id, client_company_id=company.id, route_type="direct",
+                amount_from_account=Decimal(100 * (i + 1)), exchange_rate=Decimal("1.1"),
+                calculated_route_income=Decimal(50 * (i + 1))
+            )
+            for i, company in enumerate(companies)
+        ])
+        deal_ids[name] = deal.id
+    db.commit()
+    return {"user_id": user.id, "client_id": client.id, "company_ids": [target.id, other.id], "deal_ids": deal_ids}
+
+
+def export(**filters) -> dict:
+    """Строки экспорта по сделкам: deal_id -> [строка CSV]"""
+    text = "".join(stream_deals_csv(ExportUser(), **filters)).lstrip("﻿")
+    deals = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        deals.setdefault(int(row["deal_id"]), []).append(row)
+    return deals
+
+
+def cleanup(db, seeded: dict):
+    deal_ids = list(seeded["deal_ids"].values())
+    db.query(Transaction).filter(Transaction.deal_id.in_(deal_ids)).delete(synchronize_session=False)
+    db.query(Deal).filter(Deal.id.in_(deal_ids)).delete(synchronize_session=False)
+    db.query(CompanyAccount).filter(CompanyAccount.company_id.in_(seeded["company_ids"])).delete(synchronize_session=False)
+    db.query(Company).filter(Company.id.in_(seeded["company_ids"])).delete(synchronize_session=False)
+    db.query(Client).filter(Client.id == seeded["client_id"]).delete()
+    db.query(User).filter(User.id == seeded["user_id"]).delete()
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    errors = []
+    try:
+        seeded = seed(db, suffix)
+        deal_ids = seeded["deal_ids"]
+        unfiltered = export(client_id=seeded["client_id"])
+        expected = {deal_ids["mixed"], deal_ids["target"]}
+
+        client_names = {row["client_name"] for rows in unfiltered.values() for row in rows}
+        print(f"client_name: {sorted(client_names)}")
+        if any(not name.startswith("'=") for name in client_names):
+            errors.append(f"formula-like client name exported without escaping: {sorted(client_names)}")
+
+        for filters in ({"company_name": f"Target {suffix}"}, {"account_number": f"{suffix}-TARGET"}):
+            filtered = export(**filters)
+            print(f"{filters}: deals {sorted(filtered)}, rows {sum(len(rows) for rows in filtered.values())}")
+            if set(filtered) != expected:
+                errors.append(f"{filters}: expected deals {sorted(expected)}, got {sorted(filtered)}")
+            for deal_id in expected & set(filtered):
+                if filtered[deal_id] != unfiltered[deal_id]:
+                    errors.append(
+                        f"{filters}: deal {deal_id} exported {len(filtered[deal_id])} of "
+                        f"{len(unfiltered[deal_id])} transaction rows or different income figures"
+                    )
+        cleanup(db, seeded)
+    finally:
+        db.close()
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ Filtered export keeps every transaction and the income of each matching deal, formulas are escaped")
+
+
+if __name__ == "__main__":
+    main()
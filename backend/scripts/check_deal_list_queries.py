@@ -0,0 +1,134 @@
+"""
+Регрессионная проверка количества SQL-запросов списков сделок.
+
+Вызывает через HTTP GET /api/deals и списки по ролям
+(/api/senior-manager/pending, /api/accountant/client-debts) сначала
+с одной подходящей сделкой (и limit=1), затем с N сделками (и limit=N), у каждой из которых есть
+оплаченные и неоплаченные транзакции. Запросы считаются слушателем
+before_cursor_execute. Ожидается, что число запросов не зависит от
+размера страницы (нет N+1 по клиентам и транзакциям).
+
+/api/director/pending не проверяется: он фильтрует по
+DealStatus.DIRECTOR_APPROVAL_PENDING, которого нет в DealStatus.
+
+Запускать на тестовой БД:
+    python scripts/check_deal_list_queries.py --deals 20
+"""
+import sys
+import os
+import argparse
+import uuid
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.core.database import SessionLocal
+from app.core.security import create_access_token
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.transaction import Transaction, TransactionStatus
+from app.main import app
+
+# Статус (и задолженность) сделок для каждого списка
+DEAL_KINDS = {
+    "list": {"status": DealStatus.EXECUTION.value},
+    "senior_manager": {"status": DealStatus.NEW.value},
+    "debts": {"status": DealStatus.CLIENT_AGREED_TO_PAY.value, "is_client_debt": True, "client_debt_amount": Decimal(100)},
+}
+
+
+def add_deals(db, count: int, manager_id: int, client_id: int) -> list:
+    """count сделок каждого вида с оплаченной и неоплаченной транзакцией"""
+    deal_ids = []
+    for kind in DEAL_KINDS.values():
+        for _ in range(count):
+            deal = Deal(client_id=client_id, manager_id=manager_id, total_eur_request=1000, **kind)
+            db.add(deal)
+            db.flush()
+            db.add_all([
+                Transaction(deal_id=deal.id, route_type="direct", status=TransactionStatus.PAID),
+                Transaction(deal_id=deal.id, route_type="exchange", status=TransactionStatus.PENDING),
+            ])
+            deal_ids.append(deal.id)
+    db.commit()
+    return deal_ids
+
+
+def count_statements(client: TestClient, users: dict, page_size: int) -> dict:
+    """Число SQL-запросов на каждый список (авторизация уже в кэше после прогрева)"""
+    requests = {
+        "/api/deals": ("director", {"limit": page_size}),
+        "/api/senior-manager/pending": ("senior_manager", {}),
+        "/api/accountant/client-debts": ("director", {}),
+    }
+    counts = {}
+    for path, (user, params) in requests.items():
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': users[user]})}"}
+        client.get(path, params=params, headers=headers)  # прогрев кэша пользователей
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", count)
+        try:
+            response = client.get(path, params=params, headers=headers)
+        finally:
+            event.remove(Engine, "before_cursor_execute", count)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path}: {response.status_code} {response.text}")
+        counts[path] = (len(statements), len(response.json()))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deals", type=int, default=20, help="Сделок каждого вида во втором замере (N)")
+    args = parser.parse_args()
+
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        director = User(email=f"list-director-{suffix}@test.com", hashed_password="x", role=UserRole.DIRECTOR.value)
+        senior = User(email=f"list-senior-{suffix}@test.com", hashed_password="x", role=UserRole.SENIOR_MANAGER.value)
+        client = Client(name=f"List client {suffix}")
+        db.add_all([director, senior, client])
+        db.commit()
+        users = {"director": director.email, "senior_manager": senior.email}
+
+        http = TestClient(app)
+        deal_ids = add_deals(db, 1, director.id, client.id)
+        small = count_statements(http, users, 1)
+        deal_ids += add_deals(db, args.deals - 1, director.id, client.id)
+        large = count_statements(http, users, args.deals)
+
+        db.query(Transaction).filter(Transaction.deal_id.in_(deal_ids)).delete(synchronize_session=False)
+        db.query(Deal).filter(Deal.id.in_(deal_ids)).delete(synchronize_session=False)
+        db.query(Client).filter(Client.id == client.id).delete()
+        db.query(User).filter(User.id.in_([director.id, senior.id])).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    errors = []
+    for path in small:
+        (statements_small, rows_small), (statements_large, rows_large) = small[path], large[path]
+        print(f"GET {path}: {statements_small} statements ({rows_small} rows), "
+              f"{statements_large} statements ({rows_large} rows)")
+        if statements_small != statements_large:
+            errors.append(f"GET {path} issues more statements for a larger page")
+        if rows_large < args.deals:
+            errors.append(f"GET {path} returned {rows_large} rows, expected at least {args.deals}")
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ Deal lists load in a constant number of statements")
+
+
+if __name__ == "__main__":
+    main()
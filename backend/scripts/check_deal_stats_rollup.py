@@ -0,0 +1,208 @@
+"""
+Проверка приращений дневных агрегатов (deal_daily_stats / deal_daily_route_stats).
+
+Перестраивает агрегаты, затем создаёт N сделок с маршрутами и случайно
+меняет их (статус, суммы, задолженность, тип и стоимость маршрутов,
+удаление маршрутов), обновляя агрегаты приращениями после каждого
+изменения, как это делают эндпоинты. Проверяется, что:
+- агрегаты совпадают с агрегацией по исходным таблицам;
+- обновление одной сделки выполняет одинаковое число запросов
+  независимо от числа сделок за день;
+- после вычитания вклада и удаления сделок агрегаты снова совпадают.
+
+Запускать на тестовой БД (агрегаты перестраиваются целиком):
+    python scripts/check_deal_stats_rollup.py --deals 40 --changes 200
+"""
+import sys
+import os
+import argparse
+import random
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app.core.database import SessionLocal, engine
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.transaction import Transaction
+from app.models.deal_daily_stats import DealDailyStats, DealDailyRouteStats
+from app.services.deal_stats_rollup import (
+    rebuild_deal_daily_stats, refresh_deal_daily_stats, discard_deal_daily_stats
+)
+
+ROUTE_TYPES = ["direct", "exchange", "partner", "partner_50_50"]
+
+
+def amount() -> Decimal:
+    return Decimal(random.randint(0, 1000000)) / 100
+
+
+def reference(db) -> tuple:
+    """Агрегаты, посчитанные по исходным таблицам"""
+    deals = defaultdict(lambda: [0, 0, 0, 0, 0, 0, 0])
+    routes = defaultdict(lambda: [0, 0])
+    deal_keys = {}
+    for deal in db.query(Deal).filter(Deal.created_at.isnot(None)):
+        key = (deal.created_at.date(), deal.status, deal.client_id)
+        deal_keys[deal.id] = key
+        is_debt = deal.is_client_debt and (deal.client_debt_amount or 0) > 0
+        values = [
+            1, deal.total_eur_request or 0, deal.total_usdt_calculated or 0, deal.total_cost_usdt or 0,
+            deal.net_profit_usdt or 0, deal.client_debt_amount if is_debt else 0, 1 if is_debt else 0
+        ]
+        deals[key] = [a + b for a, b in zip(deals[key], values)]
+    for t in db.query(Transaction).filter(Transaction.route_type.isnot(None)):
+        if t.deal_id in deal_keys:
+            day, status, _ = deal_keys[t.deal_id]
+            key = (day, status, t.route_type)
+            routes[key] = [routes[key][0] + 1, routes[key][1] + (t.cost_usdt or 0)]
+    return dict(deals), dict(routes)
+
+
+def rollup(db) -> tuple:
+    deals = {
+        (r.day, r.status, r.client_id): [
+            r.deals_count, r.total_eur, r.total_usdt, r.total_cost_usdt,
+            r.net_profit_usdt, r.debt_amount, r.debt_deals_count
+        ]
+        for r in db.query(DealDailyStats)
+    }
+    routes = {(r.day, r.status, r.route_type): [r.transactions_count, r.total_cost_usdt] for r in db.query(DealDailyRouteStats)}
+    return deals, routes
+
+
+def mismatches(db) -> list:
+    errors = []
+    for name, expected, actual in zip(("deal_daily_stats", "deal_daily_route_stats"), reference(db), rollup(db)):
+        for key in sorted(set(expected) | set(actual), key=str):
+            e = [Decimal(str(v)) for v in expected.get(key, [])]
+            a = [Decimal(str(v)) for v in actual.get(key, [])]
+            if e != a:
+                errors.append(f"{name} {key}: expected {e}, got {a}")
+    return errors
+
+
+def change(db, deal: Deal):
+    """Случайное изменение сделки и её маршрутов"""
+    kind = random.choice(["status", "totals", "debt", "route", "add_route", "delete_route"])
+    if kind == "status":
+        deal.status = random.choice(list(DealStatus)).value
+    elif kind == "totals":
+        deal.total_eur_request = amount()
+        deal.total_usdt_calculated = random.choice([None, amount()])
+        deal.total_cost_usdt = amount()
+        deal.net_profit_usdt = amount() - amount()
+    elif kind == "debt":
+        deal.is_client_debt = random.choice([True, False])
+        deal.client_debt_amount = random.choice([Decimal(0), amount()])
+    else:
+        transactions = db.query(Transaction).filter(Transaction.deal_id == deal.id).all()
+        if kind == "add_route" or not transactions:
+            db.add(Transaction(deal_id=deal.id, route_type=random.choice(ROUTE_TYPES + [None]), cost_usdt=amount()))
+        elif kind == "route":
+            t = random.choice(transactions)
+            t.route_type = random.choice(ROUTE_TYPES + [None])
+            t.cost_usdt = random.choice([None, amount()])
+        else:
+            db.delete(random.choice(transactions))
+
+
+def refresh_statements(db, deal: Deal) -> int:
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    deal.total_cost_usdt = amount()
+    db.flush()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        refresh_deal_daily_stats(db, deal)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    db.commit()
+    return len(statements)
+
+
+def add_deals(db, count: int, user_id: int, client_id: int) -> list:
+    deals = []
+    for _ in range(count):
+        deal = Deal(
+            client_id=client_id, manager_id=user_id, total_eur_request=amount(),
+            status=random.choice(list(DealStatus)).value
+        )
+        db.add(deal)
+        db.flush()
+        db.add_all([
+            Transaction(deal_id=deal.id, route_type=random.choice(ROUTE_TYPES), cost_usdt=amount())
+            for _ in range(random.randint(0, 3))
+        ])
+        refresh_deal_daily_stats(db, deal)
+        db.commit()
+        deals.append(deal)
+    return deals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deals", type=int, default=40, help="Количество сделок")
+    parser.add_argument("--changes", type=int, default=200, help="Количество случайных изменений")
+    args = parser.parse_args()
+
+    random.seed(5)
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    errors = []
+    try:
+        user = User(email=f"rollup-{suffix}@test.com", hashed_password="x", role=UserRole.MANAGER.value)
+        client = Client(name=f"Rollup client {suffix}")
+        db.add_all([user, client])
+        db.commit()
+        rebuild_deal_daily_stats(db)
+
+        deals = add_deals(db, args.deals, user.id, client.id)
+        statements_small = refresh_statements(db, deals[0])
+        deals += add_deals(db, args.deals, user.id, client.id)
+        statements_large = refresh_statements(db, deals[0])
+
+        for _ in range(args.changes):
+            deal = random.choice(deals)
+            change(db, deal)
+            refresh_deal_daily_stats(db, deal)
+            # Часть изменений откатывается - агрегаты и вклады откатываются вместе с ними
+            if random.random() < 0.1:
+                db.rollback()
+            else:
+                db.commit()
+        errors += mismatches(db)
+        print(f"{len(deals)} deals, {args.changes} changes: {len(errors)} mismatches")
+        print(f"refresh of one deal: {statements_small} statements ({args.deals} deals), "
+              f"{statements_large} statements ({args.deals * 2} deals)")
+
+        deal_ids = [deal.id for deal in deals]
+        discard_deal_daily_stats(db, deal_ids)
+        db.query(Transaction).filter(Transaction.deal_id.in_(deal_ids)).delete(synchronize_session=False)
+        db.query(Deal).filter(Deal.id.in_(deal_ids)).delete(synchronize_session=False)
+        db.query(Client).filter(Client.id == client.id).delete()
+        db.query(User).filter(User.id == user.id).delete()
+        db.commit()
+        errors += [f"after cleanup: {error}" for error in mismatches(db)]
+    finally:
+        db.close()
+
+    for error in errors[:10]:
+        print(f"❌ {error}")
+    if errors:
+        print("❌ Rollup differs from the source tables")
+        sys.exit(1)
+    if statements_small != statements_large:
+        print("❌ Refreshing one deal issues more statements when the day has more deals")
+        sys.exit(1)
+    print("✅ Incremental rollup matches the source tables in a constant number of statements")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Проверка GET /metrics.
+
+- каждая строка ответа - корректный сэмпл формата Prometheus;
+- гистограмма задержек считает запросы по шаблону маршрута
+  (/api/deals/{deal_id}), а не по конкретному пути;
+- есть метрики пулов соединений и попаданий в кэши;
+- бизнес-счётчики (созданные сделки, оплаченные транзакции, списания,
+  проводки по курсам) растут после commit и не растут после rollback;
+- /metrics и состояние пулов в /health закрыты без токена METRICS_TOKEN.
+
+Запускать на тестовой БД:
+    python scripts/check_metrics.py
+"""
+import sys
+import os
+import argparse
+import re
+import uuid
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.security import create_access_token
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal
+from app.models.transaction import Transaction, TransactionStatus
+from app.models.account_balance import AccountBalance
+from app.models.account_balance_history import AccountBalanceHistory
+from app.models.exchange_rate_transaction import ExchangeRateTransaction, TransactionType
+from app.services.balance_ledger import debit_crypto_account
+from app.main import app
+
+SAMPLE = re.compile(r'[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]+="([^"\\]|\\.)*",?)*\})? (-?[0-9.e+-]+|\+Inf|NaN)')
+
+
+def parse(text: str) -> dict:
+    """Сэмплы метрик: строка 'имя{метки}' -> значение"""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        if not SAMPLE.fullmatch(line):
+            raise ValueError(f"Malformed sample: {line}")
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+    return samples
+
+
+def business_events(db, suffix: str) -> tuple:
+    """Сделка с транзакцией, оплата, списание, проводка по курсу - и списание, отменённое rollback"""
+    user = User(email=f"metrics-{suffix}@test.com", hashed_password="x", role=UserRole.ACCOUNTANT.value)
+    client = Client(name=f"Metrics client {suffix}")
+    crypto = AccountBalance(account_name=f"USDT {suffix}", currency="USDT", balance=Decimal(1000))
+    db.add_all([user, client, crypto])
+    db.flush()
+
+    deal = Deal(client_id=client.id, manager_id=user.id, total_eur_request=1000)
+    db.add(deal)
+    db.flush()
+    transaction = Transaction(deal_id=deal.id, route_type="direct", status=TransactionStatus.PENDING)
+    db.add(transaction)
+    db.commit()
+
+    transaction.status = TransactionStatus.PAID
+    debit_crypto_account(db, crypto.id, Decimal(10), changed_by=user.id, deal_id=deal.id)
+    db.add(ExchangeRateTransaction(
+        crypto_account_id=crypto.id, transaction_type=TransactionType.INCOME, amount=Decimal(100),
+        currency_from="EUR", currency_to="USD", exchange_rate=Decimal("1.08"),
+        value_in_target_currency=Decimal(108), created_by=user.id
+    ))
+    db.commit()
+
+    debit_crypto_account(db, crypto.id, Decimal(10), changed_by=user.id, deal_id=deal.id)
+    db.flush()
+    db.rollback()
+    return user, client, crypto, deal
+
+
+def cleanup(db, user, client, crypto, deal):
+    db.query(ExchangeRateTransaction).filter(ExchangeRateTransaction.created_by == user.id).delete()
+    db.query(AccountBalanceHistory).filter(AccountBalanceHistory.account_balance_id == crypto.id).delete()
+    db.query(Transaction).filter(Transaction.deal_id == deal.id).delete()
+    db.query(Deal).filter(Deal.id == deal.id).delete()
+    db.query(AccountBalance).filter(AccountBalance.id == crypto.id).delete()
+    db.query(Client).filter(Client.id == client.id).delete()
+    db.query(User).filter(User.id == user.id).delete()
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    settings.METRICS_TOKEN = uuid.uuid4().hex
+    metrics_headers = {"Authorization": f"Bearer {settings.METRICS_TOKEN}"}
+    client = TestClient(app)
+    before = parse(client.get("/metrics", headers=metrics_headers).text)
+
+    db = SessionLocal()
+    errors = []
+    try:
+        user, deal_client, crypto, deal = business_events(db, uuid.uuid4().hex[:8])
+        deal_id = deal.id
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': user.email})}"
+        for _ in range(2):
+            client.get(f"/api/deals/{deal_id}")
+        client.get("/api/company-balances/summary")
+        client.get("/api/company-balances/summary")
+        client.get(f"/no-such-path/{deal_id}")
+
+        response = client.get("/metrics", headers=metrics_headers)
+        after = parse(response.text)
+        anonymous = TestClient(app)
+        anonymous_metrics = anonymous.get("/metrics")
+        wrong_token = anonymous.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        anonymous_health = anonymous.get("/health").json()
+        detailed_health = anonymous.get("/health", headers=metrics_headers).json()
+        cleanup(db, user, deal_client, crypto, deal)
+    finally:
+        db.close()
+
+    def delta(sample: str) -> float:
+        return after.get(sample, 0) - before.get(sample, 0)
+
+    expected_deltas = {
+        'http_request_duration_seconds_count{method="GET",route="/api/deals/{deal_id}",status="200"}': 2,
+        'http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}': 1,
+        "deals_created_total": 1,
+        'transactions_paid_total{route_type="direct"}': 1,
+        'balance_debits_total{account="crypto"}': 1,
+        'exchange_rate_postings_total{type="income"}': 1,
+    }
+    for sample, expected in expected_deltas.items():
+        if delta(sample) != expected:
+            errors.append(f"{sample}: expected +{expected}, got +{delta(sample)}")
+    if not response.headers["content-type"].startswith("text/plain; version=0.0.4"):
+        errors.append(f"unexpected content type {response.headers['content-type']}")
+    if delta('cache_requests_total{cache="balance_summary",result="hit"}') < 1:
+        errors.append("balance summary cache hit was not counted")
+    if not any(name.startswith('db_pool_connections{pool="sync"') for name in after):
+        errors.append("DB pool metrics are missing")
+    if any(f"/{deal_id}" in name for name in after):
+        errors.append("concrete path leaked into route labels")
+    if anonymous_metrics.status_code != 401 or wrong_token.status_code != 401:
+        errors.append(f"/metrics without a valid token: {anonymous_metrics.status_code}, {wrong_token.status_code}")
+    if anonymous_health != {"status": "ok"} or "database_pool" not in detailed_health:
+        errors.append(f"/health exposes pools without the token or hides them with it: {anonymous_health}")
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ /metrics reports route latencies, pools, caches and business counters to the token holder only")
+
+
+if __name__ == "__main__":
+    main()
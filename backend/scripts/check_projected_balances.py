@@ -0,0 +1,242 @@
+"""
+Проверка GET /api/company-balances/projected.
+
+Создаёт внутреннюю компанию со счетами, крипто-счета и N неисполненных
+сделок со всеми типами маршрутов, затем:
+- сравнивает предполагаемые остатки с эталоном, посчитанным по каждой
+  неоплаченной транзакции отдельно (как это делал старый обработчик);
+- проверяет, что число SQL-запросов не растёт при удвоении числа сделок;
+- меняет балансы UPDATE-ом в обход ORM (кэш сводки не сбрасывается) и
+  проверяет, что current и projected собраны по новым балансам, а не
+  по закэшированной сводке.
+
+Запускать на тестовой БД:
+    python scripts/check_projected_balances.py --deals 50
+"""
+import sys
+import os
+import argparse
+import random
+import uuid
+from decimal import Decimal
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+from app.core.database import SessionLocal, engine
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.transaction import Transaction, TransactionStatus
+from app.models.internal_company import InternalCompany
+from app.models.internal_company_account import InternalCompanyAccount
+from app.models.account_balance import AccountBalance
+from app.api.company_balances import (
+    build_projected_company_balances, company_balances_summary, PENDING_DEAL_STATUSES
+)
+from app.services.balance_summary_cache import invalidate_balance_summary
+
+
+def amount() -> Decimal:
+    return Decimal(random.randint(1, 1000000)) / 100
+
+
+def seed(db, suffix: str):
+    """Менеджер, клиент, внутренняя компания с EUR/USD счетами, USDT и BTC крипто-счета"""
+    user = User(email=f"projected-{suffix}@test.com", hashed_password="x", role=UserRole.MANAGER.value)
+    client = Client(name=f"Projected client {suffix}")
+    company = InternalCompany(name=f"Projected company {suffix}")
+    db.add_all([user, client, company])
+    db.flush()
+
+    accounts = [
+        InternalCompanyAccount(
+            company_id=company.id, account_name=f"{currency} {i}", account_number=f"{suffix}-{currency}-{i}",
+            currency=currency, balance=amount() * 100
+        )
+        for currency in ("EUR", "USD") for i in range(2)
+    ]
+    crypto = [
+        AccountBalance(account_name=f"{currency} {suffix}", currency=currency, balance=amount() * 100)
+        for currency in ("USDT", "BTC")
+    ]
+    db.add_all(accounts + crypto)
+    db.commit()
+    return user.id, client.id, company.id, [a.id for a in accounts], [c.id for c in crypto]
+
+
+def add_deals(db, deals: int, user_id: int, client_id: int, company_id: int, account_ids: list, crypto_ids: list):
+    """Сделки со всеми типами маршрутов в разных статусах"""
+    statuses = PENDING_DEAL_STATUSES + [DealStatus.COMPLETED.value]
+    for _ in range(deals):
+        deal = Deal(
+            client_id=client_id, manager_id=user_id, total_eur_request=1000,
+            status=random.choice(statuses)
+        )
+        db.add(deal)
+        db.flush()
+        db.add_all([
+            Transaction(
+                deal_id=deal.id, route_type="direct", internal_company_account_id=random.choice(account_ids),
+                amount_from_account=amount(), status=random.choice(list(TransactionStatus))
+            ),
+            Transaction(
+                deal_id=deal.id, route_type="exchange", crypto_account_id=random.choice(crypto_ids),
+                exchange_amount=random.choice([None, Decimal(0), amount()]),
+                amount_from_account=random.choice([None, amount()]),
+                crypto_exchange_rate=random.choice([None, Decimal("1.0850")]),
+                amount_for_client=amount(), status=TransactionStatus.PENDING
+            ),
+            Transaction(
+                deal_id=deal.id, route_type="partner", amount_to_partner_usdt=amount(),
+                status=TransactionStatus.PENDING
+            ),
+            Transaction(
+                deal_id=deal.id, route_type="partner_50_50", amount_to_partner_50_50_usdt=amount(),
+                status=TransactionStatus.PENDING
+            ),
+        ])
+    db.commit()
+
+
+def reference_debits(db):
+    """Эталон: обход каждой неоплаченной транзакции каждой неисполненной сделки"""
+    company_debits, crypto_debits = {}, {}
+    usdt_account = db.query(AccountBalance).filter(AccountBalance.currency == "USDT").order_by(AccountBalance.id).first()
+    transactions = db.query(Transaction).join(Deal, Deal.id == Transaction.deal_id).filter(
+        Deal.status.in_(PENDING_DEAL_STATUSES),
+        Transaction.status != TransactionStatus.PAID
+    ).all()
+    for t in transactions:
+        if t.route_type == "direct" and t.internal_company_account_id:
+            company_debits[t.internal_company_account_id] = (
+                company_debits.get(t.internal_company_account_id, Decimal(0)) + (t.amount_from_account or 0)
+            )
+        elif t.route_type == "exchange" and t.crypto_account_id:
+            if t.exchange_amount:
+                debit = t.exchange_amount
+            elif t.amount_from_account and t.crypto_exchange_rate:
+                debit = t.amount_from_account * t.crypto_exchange_rate
+            else:
+                debit = t.amount_for_client or 0
+            crypto_debits[t.crypto_account_id] = crypto_debits.get(t.crypto_account_id, Decimal(0)) + debit
+        elif t.route_type == "partner" and t.amount_to_partner_usdt and usdt_account:
+            crypto_debits[usdt_account.id] = crypto_debits.get(usdt_account.id, Decimal(0)) + t.amount_to_partner_usdt
+        elif t.route_type == "partner_50_50" and t.amount_to_partner_50_50_usdt and usdt_account:
+            crypto_debits[usdt_account.id] = (
+                crypto_debits.get(usdt_account.id, Decimal(0)) + t.amount_to_partner_50_50_usdt
+            )
+    return company_debits, crypto_debits
+
+
+def mismatches(db, result) -> list:
+    company_debits, crypto_debits = reference_debits(db)
+    balances = dict(db.query(InternalCompanyAccount.id, InternalCompanyAccount.balance).all())
+    crypto_balances = dict(db.query(AccountBalance.id, AccountBalance.balance).all())
+    errors = []
+    for company in result.current.companies:
+        for account in company.accounts:
+            if abs(account["balance"] - float(balances[account["id"]])) > 0.01:
+                errors.append(f"company account {account['id']}: current {account['balance']} != {balances[account['id']]}")
+    for company in result.projected.companies:
+        for account in company.accounts:
+            expected = float(balances[account["id"]] - company_debits.get(account["id"], Decimal(0)))
+            if abs(account["balance"] - expected) > 1e-6:
+                errors.append(f"company account {account['id']}: {account['balance']} != {expected}")
+    for current, projected in zip(result.current.crypto_balances, result.projected.crypto_balances):
+        balance = crypto_balances[current.account_id]
+        if current.balance != balance.quantize(Decimal("0.0001")):
+            errors.append(f"crypto account {current.account_id}: current {current.balance} != {balance}")
+        expected = (balance - crypto_debits.get(current.account_id, Decimal(0))).quantize(Decimal("0.0001"))
+        if projected.balance != expected:
+            errors.append(f"crypto account {current.account_id}: {projected.balance} != {expected}")
+    return errors
+
+
+def check_stale_cache(db, account_ids: list, crypto_ids: list) -> list:
+    """Сводка в кэше устарела (UPDATE в обход ORM): проекция всё равно по текущим балансам"""
+    invalidate_balance_summary()
+    company_balances_summary(db)
+    db.query(InternalCompanyAccount).filter(InternalCompanyAccount.id.in_(account_ids)).update(
+        {InternalCompanyAccount.balance: InternalCompanyAccount.balance + Decimal("123.456789")},
+        synchronize_session=False
+    )
+    db.query(AccountBalance).filter(AccountBalance.id.in_(crypto_ids)).update(
+        {AccountBalance.balance: AccountBalance.balance + Decimal("0.123456789")},
+        synchronize_session=False
+    )
+    db.commit()
+    request_db = SessionLocal()
+    try:
+        return mismatches(request_db, build_projected_company_balances(request_db))
+    finally:
+        request_db.close()
+        invalidate_balance_summary()
+
+
+def count_queries() -> tuple:
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        result = build_projected_company_balances(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return len(statements), result, db
+
+
+def cleanup(db, user_id: int, client_id: int, company_id: int, account_ids: list, crypto_ids: list):
+    deal_ids = [d for (d,) in db.query(Deal.id).filter(Deal.client_id == client_id).all()]
+    db.query(Transaction).filter(Transaction.deal_id.in_(deal_ids)).delete(synchronize_session=False)
+    db.query(Deal).filter(Deal.id.in_(deal_ids)).delete(synchronize_session=False)
+    db.query(InternalCompanyAccount).filter(InternalCompanyAccount.company_id == company_id).delete()
+    db.query(InternalCompany).filter(InternalCompany.id == company_id).delete()
+    db.query(AccountBalance).filter(AccountBalance.id.in_(crypto_ids)).delete(synchronize_session=False)
+    db.query(Client).filter(Client.id == client_id).delete()
+    db.query(User).filter(User.id == user_id).delete()
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deals", type=int, default=50, help="Сделок в первом наборе (второй набор удваивает их)")
+    args = parser.parse_args()
+
+    random.seed(19)
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    try:
+        seeded = seed(db, suffix)
+        add_deals(db, args.deals, *seeded)
+        queries_small, result, request_db = count_queries()
+        errors = mismatches(request_db, result)
+        request_db.close()
+
+        add_deals(db, args.deals, *seeded)
+        queries_large, result, request_db = count_queries()
+        errors += mismatches(request_db, result)
+        request_db.close()
+
+        errors += check_stale_cache(db, seeded[3], seeded[4])
+
+        print(f"{args.deals} deals: {queries_small} queries, {args.deals * 2} deals: {queries_large} queries")
+        cleanup(db, *seeded)
+    finally:
+        db.close()
+
+    for error in errors[:10]:
+        print(f"❌ {error}")
+    if errors:
+        print("❌ Projected balances differ from the per-transaction reference")
+        sys.exit(1)
+    if queries_large != queries_small:
+        print("❌ Query count grows with the number of deals")
+        sys.exit(1)
+    print("✅ Projected balances match the reference in a constant number of queries")
+
+
+if __name__ == "__main__":
+    main()
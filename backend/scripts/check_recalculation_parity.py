@@ -0,0 +1,237 @@
+"""
+Проверка совпадения векторного пересчёта маршрутов с DealCalculator (Decimal).
+
+1. Случайные маршруты всех типов (суммы, курсы, фиксированные и процентные
+   комиссии, пустые значения и точные половины цента вроде 1.00 × 1.005)
+   считаются route_income_engine.calculate_route_incomes и DealCalculator.
+   Каждое значение, не помеченное в fallback, должно совпасть в центах с
+   Decimal-результатом, округлённым ROUND_HALF_UP. Печатается доля
+   fallback-строк и время обоих расчётов.
+2. На БД создаются сделки с оплаченными и неоплаченными маршрутами;
+   recalculate_open_deals (what-if, затем с записью) сравнивается с
+   DealCalculator по каждому маршруту и summarize_deal_income по сделке.
+
+Запускать на тестовой БД:
+    python scripts/check_recalculation_parity.py --routes 200000
+"""
+import sys
+import os
+import argparse
+import random
+import time
+import uuid
+from decimal import Decimal
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import SessionLocal
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.route_commission import RouteCommission
+from app.models.transaction import Transaction, TransactionStatus
+from app.services.commission_cache import CommissionSnapshot, invalidate_commission_cache
+from app.services.deal_calculator import DealCalculator
+from app.services.deal_recalculation import RECALCULATED_FIELDS, recalculate_open_deals, summarize_deal_income
+from app.services.route_income_engine import (
+    COMMISSION_SLOTS, SCALED_COLUMNS, calculate_route_incomes, quantize_cents, route_columns
+)
+
+ROUTE_TYPES = ("direct", "exchange", "partner", "partner_50_50")
+RESULT_FIELDS = ("calculated_route_income",) + RECALCULATED_FIELDS
+
+
+def random_decimal(rng: random.Random, places: int, upper: int) -> Decimal:
+    return Decimal(rng.randrange(upper * 10 ** places)).scaleb(-places)
+
+
+def random_commissions(rng: random.Random, count: int) -> dict:
+    """Процентные, фиксированные и «фиксированные без суммы» (тогда применяется процент)"""
+    commissions = {}
+    for commission_id in range(1, count + 1):
+        fixed = rng.random() < 0.3
+        commissions[commission_id] = CommissionSnapshot(
+            id=commission_id,
+            route_type=rng.choice(ROUTE_TYPES),
+            commission_percent=random_decimal(rng, 2, 100),
+            commission_fixed=random_decimal(rng, 2, 1000) if fixed and rng.random() < 0.8 else None,
+            is_fixed_currency=fixed,
+            currency="EUR" if fixed else None,
+            is_active=True
+        )
+    return commissions
+
+
+def random_route(rng: random.Random, commission_ids: list) -> dict:
+    def maybe(value):
+        return None if rng.random() < 0.03 else value
+
+    if rng.random() < 0.05:
+        # Точная половина цента: ROUND_HALF_UP должен округлить вверх
+        amount, rate = Decimal("1.00"), Decimal("1.005")
+    else:
+        amount = random_decimal(rng, 2, rng.choice((100, 10 ** 5, 10 ** 9)))
+        rate = random_decimal(rng, 6, rng.choice((2, 10, 100)))
+    route = {
+        "route_type": rng.choice(ROUTE_TYPES),
+        "amount_from_account": maybe(amount),
+        "exchange_rate": maybe(rate),
+        "crypto_exchange_rate": maybe(random_decimal(rng, 6, 2)),
+    }
+    for slot in COMMISSION_SLOTS:
+        route[slot] = rng.choice(commission_ids) if rng.random() < 0.7 else None
+    return route
+
+
+def check_engine(routes_count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    commissions = random_commissions(rng, 40)
+    calculator = DealCalculator(None, commission_overrides=commissions)
+    routes = [random_route(rng, list(commissions)) for _ in range(routes_count)]
+
+    started = time.perf_counter()
+    expected = [calculator.calculate_route_income(route) for route in routes]
+    decimal_seconds = time.perf_counter() - started
+
+    # В пересчёте колонки приходят из БД уже целыми (deal_recalculation.ROUTE_COLUMNS)
+    columns = route_columns(routes)
+    columns.update({name: columns[name].astype(np.int64) for name in SCALED_COLUMNS})
+    started = time.perf_counter()
+    calculated = calculate_route_incomes(columns, calculator.get_commission)
+    engine_seconds = time.perf_counter() - started
+
+    errors = []
+    fallback = calculated["fallback"]
+    for i, route_calc in enumerate(expected):
+        if fallback[i]:
+            continue
+        for field in RESULT_FIELDS:
+            expected_cents = int(quantize_cents(route_calc.get(field)) * 100)
+            if int(calculated[field][i]) != expected_cents:
+                errors.append(
+                    f"route {routes[i]}: {field} {int(calculated[field][i])} cents, Decimal {expected_cents} cents"
+                )
+    print(
+        f"Engine: {routes_count} routes, {int(fallback.sum())} ({fallback.mean():.4%}) left to Decimal; "
+        f"Decimal {decimal_seconds:.3f} s, NumPy {engine_seconds:.3f} s"
+    )
+    return errors[:20]
+
+
+def seed_deals(db, suffix: str, rng: random.Random, deals_count: int) -> dict:
+    user = User(email=f"recalc-{suffix}@test.com", hashed_password="x", role=UserRole.MANAGER.value)
+    client = Client(name=f"Recalc client {suffix}")
+    commissions = [
+        RouteCommission(route_type="direct", commission_percent=Decimal("1.25")),
+        RouteCommission(route_type="exchange", commission_percent=Decimal("0.50"),
+                        commission_fixed=Decimal("15.00"), is_fixed_currency=True),
+        RouteCommission(route_type="partner", commission_percent=Decimal("33.33")),
+    ]
+    db.add_all([user, client, *commissions])
+    db.flush()
+    commission_ids = [commission.id for commission in commissions]
+
+    deal_ids = []
+    for _ in range(deals_count):
+        deal = Deal(
+            client_id=client.id, manager_id=user.id, total_eur_request=1000,
+            client_rate_percent=Decimal("2.5"), client_sends_currency="EUR", status=DealStatus.EXECUTION.value
+        )
+        db.add(deal)
+        db.flush()
+        for _ in range(rng.randint(1, 4)):
+            route = random_route(rng, commission_ids)
+            db.add(Transaction(
+                deal_id=deal.id, from_currency="EUR", to_currency="USDT",
+                status=TransactionStatus.PAID if rng.random() < 0.3 else TransactionStatus.PENDING,
+                calculated_route_income=random_decimal(rng, 2, 10 ** 4), **route
+            ))
+        deal_ids.append(deal.id)
+    db.commit()
+    return {"user_id": user.id, "client_id": client.id, "commission_ids": commission_ids, "deal_ids": deal_ids}
+
+
+def expected_deals(db, deal_ids: list) -> dict:
+    """Decimal-расчёт: маршруты через DealCalculator с округлением до центов, итоги через summarize_deal_income"""
+    calculator = DealCalculator(db)
+    expected = {}
+    for deal in db.query(Deal).filter(Deal.id.in_(deal_ids)).order_by(Deal.id):
+        routes = []
+        for transaction in sorted(deal.transactions, key=lambda t: t.id):
+            route = {column.name: getattr(transaction, column.name) for column in Transaction.__table__.columns}
+            if transaction.status == TransactionStatus.PAID:
+                income = quantize_cents(transaction.calculated_route_income)
+            else:
+                income = quantize_cents(calculator.calculate_route_income(route)["calculated_route_income"])
+            routes.append((income, Decimal(str(route["amount_from_account"] or 0)),
+                           Decimal(str(route["exchange_rate"] or 1))))
+        total = sum((income for income, _, _ in routes), Decimal("0"))
+        expected[deal.id] = {
+            "total_usdt_calculated": total,
+            **summarize_deal_income(routes, deal.client_rate_percent, Decimal("0"), deal.client_sends_currency)
+        }
+    return expected
+
+
+def compare_deals(result: dict, expected: dict, label: str) -> list:
+    errors = []
+    deals = {deal["deal_id"]: deal for deal in result["deals"]}
+    for deal_id, values in expected.items():
+        for field, value in values.items():
+            if deals[deal_id][field] != value:
+                errors.append(f"{label}: deal {deal_id} {field} {deals[deal_id][field]}, Decimal {value}")
+    return errors
+
+
+def check_database(deals_count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    errors = []
+    try:
+        seeded = seed_deals(db, suffix, rng, deals_count)
+        expected = expected_deals(db, seeded["deal_ids"])
+        db.rollback()
+        errors += compare_deals(recalculate_open_deals(db, dry_run=True), expected, "what-if")
+        result = recalculate_open_deals(db, dry_run=False)
+        errors += compare_deals(result, expected, "apply")
+        print(f"Database: {len(expected)} deals, {result['transactions_recalculated']} unpaid routes written, "
+              f"{result['routes_recalculated_with_decimal']} with Decimal")
+
+        db.expire_all()
+        for deal in db.query(Deal).filter(Deal.id.in_(seeded["deal_ids"])):
+            if deal.total_usdt_calculated != expected[deal.id]["total_usdt_calculated"]:
+                errors.append(f"deal {deal.id}: stored total {deal.total_usdt_calculated}, "
+                              f"expected {expected[deal.id]['total_usdt_calculated']}")
+
+        db.query(Transaction).filter(Transaction.deal_id.in_(seeded["deal_ids"])).delete(synchronize_session=False)
+        db.query(Deal).filter(Deal.id.in_(seeded["deal_ids"])).delete(synchronize_session=False)
+        db.query(RouteCommission).filter(RouteCommission.id.in_(seeded["commission_ids"])).delete(synchronize_session=False)
+        db.query(Client).filter(Client.id == seeded["client_id"]).delete()
+        db.query(User).filter(User.id == seeded["user_id"]).delete()
+        db.commit()
+        invalidate_commission_cache()
+    finally:
+        db.close()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", type=int, default=200000, help="Случайных маршрутов для сравнения движка")
+    parser.add_argument("--deals", type=int, default=50, help="Сделок для сравнения на БД")
+    parser.add_argument("--seed", type=int, default=1, help="Seed генератора случайных маршрутов")
+    args = parser.parse_args()
+
+    errors = check_engine(args.routes, args.seed)
+    errors += check_database(args.deals, args.seed)
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ Vectorized recalculation matches DealCalculator to the cent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Проверка профилирования запросов (RequestProfilingMiddleware).
+
+Для sync- и async-эндпоинтов:
+- в ответе есть заголовок Server-Timing (app, db, db-statements);
+- число выражений в заголовке совпадает с числом выражений, которое
+  видит независимый счётчик на событиях Engine;
+- при пороге SLOW_REQUEST_STATEMENTS=1 запрос попадает в лог медленных
+  запросов вместе со списком выражений, при отключённых порогах - нет.
+
+Для упавших выражений (обработчик handle_error на Engine):
+- вне запроса и внутри запроса наружу выходит исходная ошибка драйвера,
+  а упавшее выражение учитывается в Server-Timing;
+- pre-ping разорванного соединения возвращает False (пул пересоздаёт
+  соединение), а не падает.
+
+Запускать на тестовой БД:
+    python scripts/check_request_profiling.py
+"""
+import sys
+import os
+import argparse
+import logging
+import re
+import uuid
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+from app.core.security import create_access_token
+from app.models.user import User, UserRole
+from app.main import app
+
+# Sync-эндпоинт (пул потоков) и async-эндпоинты (AsyncSession, run_sync)
+ENDPOINTS = [
+    "/api/account-balances",
+    "/api/company-balances/summary",
+    "/api/deals?limit=10",
+]
+
+SERVER_TIMING = re.compile(r'app;dur=[\d.]+, db;dur=[\d.]+, db-statements;desc="(\d+)"')
+FAILING_STATEMENT = "SELECT * FROM request_profiling_missing_table"
+
+
+@app.get("/check-request-profiling/failing-statement")
+def failing_statement():
+    """Эндпоинт только для проверки: упавшее выражение, затем успешное"""
+    db = SessionLocal()
+    try:
+        try:
+            db.execute(text(FAILING_STATEMENT))
+            error = None
+        except DBAPIError as e:
+            error = type(e).__name__
+        db.rollback()
+        db.execute(text("SELECT 1"))
+        return {"error": error}
+    finally:
+        db.close()
+
+
+def check_error_path(client: TestClient) -> list:
+    """Ошибки выражений и pre-ping не подменяются ошибкой обработчика handle_error"""
+    errors = []
+    db = SessionLocal()
+    try:
+        db.execute(text(FAILING_STATEMENT))
+        errors.append("failing statement did not raise")
+    except DBAPIError as e:
+        print(f"failing statement outside a request: {type(e).__name__}")
+    except Exception as e:
+        errors.append(f"failing statement raised {type(e).__name__}: {e}")
+    finally:
+        db.close()
+
+    response, counted = request(client, "/check-request-profiling/failing-statement")
+    header = response.headers.get("server-timing", "")
+    match = SERVER_TIMING.fullmatch(header)
+    print(f"failing statement in a request: {response.status_code} {response.text}  Server-Timing: {header}")
+    if response.status_code != 200 or not response.json().get("error"):
+        errors.append(f"failing statement in a request: {response.status_code} {response.text}")
+    elif not match or int(match.group(1)) != counted:
+        errors.append(f"failing statement in a request: header {header!r}, counted {counted}")
+
+    raw = engine.raw_connection()
+    try:
+        raw.dbapi_connection.close()
+        alive = engine.dialect._do_ping_w_event(raw.dbapi_connection)
+        print(f"pre-ping of a closed connection: {alive}")
+        if alive is not False:
+            errors.append(f"pre-ping of a closed connection returned {alive}")
+    except Exception as e:
+        errors.append(f"pre-ping of a closed connection raised {type(e).__name__}: {e}")
+    finally:
+        raw.invalidate()
+    return errors
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def request(client: TestClient, path: str) -> tuple:
+    """Ответ и число выражений по независимому счётчику"""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+    return response, len(statements)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    suffix = uuid.uuid4().hex[:8]
+    db = SessionLocal()
+    user = User(email=f"profiling-{suffix}@test.com", hashed_password="x", role=UserRole.ACCOUNTANT.value)
+    db.add(user)
+    db.commit()
+
+    handler = CollectingHandler()
+    logging.getLogger("app.core.request_profiling").addHandler(handler)
+    thresholds = (settings.SLOW_REQUEST_MS, settings.SLOW_REQUEST_STATEMENTS)
+    errors = []
+    try:
+        client = TestClient(app)
+        client.headers["Authorization"] = f"Bearer {create_access_token({'sub': user.email})}"
+
+        settings.SLOW_REQUEST_MS, settings.SLOW_REQUEST_STATEMENTS = 0, 0
+        for path in ENDPOINTS:
+            response, counted = request(client, path)
+            header = response.headers.get("server-timing", "")
+            match = SERVER_TIMING.fullmatch(header)
+            print(f"{path:<35} {response.status_code}  Server-Timing: {header}  (counted {counted})")
+            if response.status_code != 200:
+                errors.append(f"{path}: status {response.status_code}")
+            elif not match:
+                errors.append(f"{path}: bad Server-Timing header {header!r}")
+            elif int(match.group(1)) != counted:
+                errors.append(f"{path}: header reports {match.group(1)} statements, counted {counted}")
+        if handler.messages:
+            errors.append("slow request logged with thresholds disabled")
+
+        settings.SLOW_REQUEST_STATEMENTS = 1
+        client.get(ENDPOINTS[0])
+        if not handler.messages or "Slow request GET /api/account-balances" not in handler.messages[0]:
+            errors.append("slow request was not logged")
+        elif "SELECT" not in handler.messages[0]:
+            errors.append("slow request log has no statements")
+        else:
+            print(handler.messages[0])
+
+        settings.SLOW_REQUEST_MS, settings.SLOW_REQUEST_STATEMENTS = 0, 0
+        errors += check_error_path(client)
+    finally:
+        settings.SLOW_REQUEST_MS, settings.SLOW_REQUEST_STATEMENTS = thresholds
+        logging.getLogger("app.core.request_profiling").removeHandler(handler)
+        db.query(User).filter(User.id == user.id).delete()
+        db.commit()
+        db.close()
+
+    for error in errors:
+        print(f"❌ {error}")
+    if errors:
+        sys.exit(1)
+    print("✅ Server-Timing and slow-request log match the executed statements, failures keep the driver error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Нагрузочный тест read-heavy эндпоинтов: пропускная способность и p95 задержки.
+
+N параллельных клиентов в течение заданного времени по кругу запрашивают
+эндпоинты дашборда, списка и деталей сделок, справочников, сводки остатков
+и курсов. Для сравнения sync- и async-слоя БД запустите тест против
+сервера до и после перевода эндпоинтов на AsyncSession с одинаковыми
+настройками (DB_POOL_SIZE, число воркеров uvicorn) и одной и той же БД.
+
+Нужен httpx (pip install httpx) и запущенный сервер:
+    uvicorn app.main:app --workers 1
+    python scripts/load_test_read_endpoints.py --base-url http://localhost:8000 \\
+        --email accountant@example.com --password secret --clients 200 --duration 30
+"""
+import sys
+import os
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+# Эндпоинты, переведённые на AsyncSession ({deal_id} подставляется из списка сделок)
+ENDPOINTS = [
+    "/api/statistics/dashboard",
+    "/api/company-balances/summary",
+    "/api/company-balances/projected",
+    "/api/deals?limit=50",
+    "/api/deals/{deal_id}?include_history=true",
+    "/api/deals/{deal_id}/history",
+    "/api/reference/clients",
+    "/api/reference/companies",
+    "/api/reference/route-commissions",
+    "/api/reference/manager-commissions",
+    "/api/reference/internal-company-accounts",
+    "/api/exchange-rates/averages",
+]
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> str:
+    response = await client.post("/api/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def worker(client: httpx.AsyncClient, paths: list, offset: int, deadline: float, latencies: dict, errors: dict):
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - started
+        template = path.split("?")[0]
+        if ok:
+            latencies[template].append(elapsed)
+        else:
+            errors[template] += 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        token = args.token or await login(client, args.email, args.password)
+        client.headers["Authorization"] = f"Bearer {token}"
+
+        deals = (await client.get("/api/deals?limit=1")).json()
+        paths = [p for p in ENDPOINTS if "{deal_id}" not in p]
+        if deals:
+            paths += [p.format(deal_id=deals[0]["id"]) for p in ENDPOINTS if "{deal_id}" in p]
+
+        # Прогрев: кэши приложения и пулы соединений
+        await asyncio.gather(*(client.get(p) for p in paths))
+
+        latencies, errors = defaultdict(list), defaultdict(int)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, paths, i, deadline, latencies, errors) for i in range(args.clients)
+        ))
+        elapsed = time.perf_counter() - started
+
+    print(f"{args.clients} clients, {elapsed:.1f}s")
+    print(f"{'endpoint':<45} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    all_latencies = []
+    for template in sorted(set(latencies) | set(errors)):
+        values = latencies[template]
+        all_latencies += values
+        if values:
+            print(
+                f"{template:<45} {len(values):>9} {errors[template]:>7} "
+                f"{percentile(values, 50) * 1000:>8.1f} {percentile(values, 95) * 1000:>8.1f} "
+                f"{percentile(values, 99) * 1000:>8.1f}"
+            )
+        else:
+            print(f"{template:<45} {0:>9} {errors[template]:>7}")
+
+    total_errors = sum(errors.values())
+    if all_latencies:
+        print(
+            f"total: {len(all_latencies) / elapsed:.1f} req/s, "
+            f"p50 {percentile(all_latencies, 50) * 1000:.1f} ms, "
+            f"p95 {percentile(all_latencies, 95) * 1000:.1f} ms, "
+            f"mean {statistics.mean(all_latencies) * 1000:.1f} ms, errors {total_errors}"
+        )
+    if total_errors or not all_latencies:
+        print("❌ Some requests failed")
+        sys.exit(1)
+    print("✅ Load test finished without errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000", help="Адрес сервера")
+    parser.add_argument("--email", help="Пользователь с доступом к статистике и остаткам (бухгалтер/директор)")
+    parser.add_argument("--password", help="Пароль пользователя")
+    parser.add_argument("--token", help="Готовый access token вместо email/пароля")
+    parser.add_argument("--clients", type=int, default=200, help="Параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность теста, секунд")
+    parser.add_argument("--timeout", type=float, default=30, help="Тайм-аут запроса, секунд")
+    args = parser.parse_args()
+    if not args.token and not (args.email and args.password):
+        parser.error("нужен --token или --email и --password")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
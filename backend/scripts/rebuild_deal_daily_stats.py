@@ -0,0 +1,30 @@
+"""
+Скрипт полной перестройки дневных агрегатов по сделкам (deal_daily_stats).
+
+Запускать после миграции h_deal_daily_stats: пока агрегаты не построены,
+дашборд считает статистику по исходным таблицам.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.services.deal_stats_rollup import rebuild_deal_daily_stats
+
+
+def rebuild():
+    db: Session = SessionLocal()
+    
+    try:
+        rows = rebuild_deal_daily_stats(db)
+        print(f"✅ deal_daily_stats rebuilt: {rows} rows")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error: {e}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    rebuild()
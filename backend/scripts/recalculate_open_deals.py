@@ -0,0 +1,78 @@
+"""
+Пакетный пересчёт всех незавершённых сделок (services.deal_recalculation).
+
+По умолчанию работает в режиме what-if и ничего не записывает:
+    python scripts/recalculate_open_deals.py
+    python scripts/recalculate_open_deals.py --commission 3=2.5 --rate EUR/USDT=1.08
+
+Записать пересчитанные значения (без подмен):
+    python scripts/recalculate_open_deals.py --apply
+"""
+import sys
+import os
+import argparse
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decimal import Decimal, InvalidOperation
+from app.core.database import SessionLocal
+from app.services.deal_recalculation import recalculate_open_deals
+
+
+def parse_override(value: str):
+    key, sep, number = value.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {value!r}")
+    try:
+        return key, Decimal(number)
+    except InvalidOperation:
+        raise argparse.ArgumentTypeError(f"Invalid number in {value!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="Записать результат (по умолчанию what-if)")
+    parser.add_argument("--commission", type=parse_override, action="append", default=[],
+                        metavar="ID=PERCENT", help="Подменить процент комиссии маршрута")
+    parser.add_argument("--rate", type=parse_override, action="append", default=[],
+                        metavar="FROM/TO=RATE", help="Подменить курс валютной пары")
+    args = parser.parse_args()
+
+    commission_overrides = {int(key): value for key, value in args.commission}
+    rate_overrides = {}
+    for pair, rate in args.rate:
+        currencies = pair.split("/")
+        if len(currencies) != 2:
+            parser.error(f"Invalid currency pair: {pair}. Expected FROM/TO")
+        rate_overrides[(currencies[0], currencies[1])] = rate
+
+    db = SessionLocal()
+    try:
+        result = recalculate_open_deals(
+            db,
+            dry_run=not args.apply,
+            commission_percent_overrides=commission_overrides,
+            exchange_rate_overrides=rate_overrides
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+    print(f"{'deal':>8} {'old total':>16} {'new total':>16} {'client sends':>14} {'costs':>14} {'net profit':>14}")
+    for deal in result["deals"]:
+        print(
+            f"{deal['deal_id']:>8} {str(deal['old_total_usdt_calculated']):>16} "
+            f"{str(deal['total_usdt_calculated']):>16} {deal['client_should_send']:>14} "
+            f"{deal['deal_costs']:>14} {deal['net_profit']:>14}"
+        )
+    mode = "what-if, nothing written" if result["dry_run"] else "applied"
+    print(
+        f"\n{result['deals_count']} open deals, {result['routes_count']} routes, "
+        f"{result['transactions_recalculated']} unpaid routes recalculated "
+        f"({result['routes_recalculated_with_decimal']} of them with Decimal, {mode})"
+    )
+
+
+if __name__ == "__main__":
+    main()
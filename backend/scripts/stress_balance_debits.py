@@ -0,0 +1,154 @@
+"""
+Нагрузочная проверка списаний с баланса при оплате транзакций.
+
+Создаёт синтетическую сделку с N транзакциями (маршрут Exchange) на один
+крипто-счёт и параллельно отмечает их оплаченными, отправляя каждую транзакцию
+дважды. Проверяет, что:
+  - каждая транзакция оплачена ровно один раз (вторая попытка получает 400);
+  - итоговый баланс равен начальному минус сумма списаний;
+  - сумма change_amount в истории совпадает с изменением баланса;
+  - сделка переведена в статус COMPLETED.
+
+Запускать на локальном PostgreSQL:
+    python scripts/stress_balance_debits.py --transactions 200 --workers 32
+"""
+import sys
+import os
+import argparse
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decimal import Decimal
+from fastapi import HTTPException
+from sqlalchemy import func
+from app.core.database import SessionLocal
+from app.models.user import User, UserRole
+from app.models.client import Client
+from app.models.deal import Deal, DealStatus
+from app.models.transaction import Transaction
+from app.models.account_balance import AccountBalance
+from app.models.account_balance_history import AccountBalanceHistory
+from app.api.transactions import mark_transaction_paid
+from app.services.deal_stats_rollup import discard_deal_daily_stats
+
+INITIAL_BALANCE = Decimal("1000000")
+
+
+def seed(db, count: int):
+    """Пользователь, клиент, сделка в EXECUTION, крипто-счёт и транзакции"""
+    suffix = uuid.uuid4().hex[:8]
+    user = User(
+        email=f"stress-{suffix}@test.com",
+        hashed_password="x",
+        full_name="Stress accountant",
+        role=UserRole.ACCOUNTANT.value
+    )
+    client = Client(name=f"Stress client {suffix}")
+    db.add_all([user, client])
+    db.flush()
+
+    account = AccountBalance(account_name=f"Stress USDT {suffix}", balance=INITIAL_BALANCE, currency="USDT")
+    deal = Deal(
+        client_id=client.id,
+        manager_id=user.id,
+        total_eur_request=Decimal("1000"),
+        status=DealStatus.EXECUTION.value
+    )
+    db.add_all([account, deal])
+    db.flush()
+
+    amounts = [Decimal(random.randint(1, 100000)) / 100 for _ in range(count)]
+    transactions = [
+        Transaction(
+            deal_id=deal.id,
+            route_type="exchange",
+            crypto_account_id=account.id,
+            exchange_amount=amount
+        )
+        for amount in amounts
+    ]
+    db.add_all(transactions)
+    db.commit()
+    return user.id, client.id, deal.id, account.id, [t.id for t in transactions], sum(amounts)
+
+
+def pay(transaction_id: int, user_id: int) -> str:
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).one()
+        mark_transaction_paid(transaction_id, None, db=db, current_user=user)
+        return "paid"
+    except HTTPException as e:
+        db.rollback()
+        return f"rejected {e.status_code}"
+    finally:
+        db.close()
+
+
+def cleanup(db, user_id: int, client_id: int, deal_id: int, account_id: int):
+    # Сделка попала в дневные агрегаты при завершении - вычитаем её вклад
+    discard_deal_daily_stats(db, [deal_id])
+    db.query(AccountBalanceHistory).filter(AccountBalanceHistory.account_balance_id == account_id).delete()
+    db.query(Transaction).filter(Transaction.deal_id == deal_id).delete()
+    db.query(AccountBalance).filter(AccountBalance.id == account_id).delete()
+    db.query(Deal).filter(Deal.id == deal_id).delete()
+    db.query(Client).filter(Client.id == client_id).delete()
+    db.query(User).filter(User.id == user_id).delete()
+    db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=200, help="Количество транзакций в сделке")
+    parser.add_argument("--workers", type=int, default=32, help="Количество параллельных потоков")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        user_id, client_id, deal_id, account_id, transaction_ids, expected_debit = seed(db, args.transactions)
+
+        # Каждая транзакция отправляется дважды вперемешку
+        attempts = transaction_ids * 2
+        random.shuffle(attempts)
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(pay, transaction_id, user_id) for transaction_id in attempts]
+            outcomes = [f.result() for f in futures]
+
+        db.expire_all()
+        balance = db.query(AccountBalance.balance).filter(AccountBalance.id == account_id).scalar()
+        history_sum, history_count = db.query(
+            func.coalesce(func.sum(AccountBalanceHistory.change_amount), 0),
+            func.count(AccountBalanceHistory.id)
+        ).filter(AccountBalanceHistory.account_balance_id == account_id).one()
+        deal_status = db.query(Deal.status).filter(Deal.id == deal_id).scalar()
+
+        paid = outcomes.count("paid")
+        rejected = outcomes.count("rejected 400")
+        print(f"Attempts: {len(attempts)}, paid: {paid}, rejected as already paid: {rejected}")
+        print(f"balance      {balance}  expected {INITIAL_BALANCE - expected_debit}")
+        print(f"history sum  {history_sum}  expected {-expected_debit} ({history_count} rows)")
+        print(f"deal status  {deal_status}")
+
+        ok = (
+            paid == args.transactions
+            and rejected == args.transactions
+            and balance == INITIAL_BALANCE - expected_debit
+            and history_sum == -expected_debit
+            and history_count == args.transactions
+            and deal_status == DealStatus.COMPLETED.value
+        )
+
+        cleanup(db, user_id, client_id, deal_id, account_id)
+    finally:
+        db.close()
+
+    if not ok:
+        print("❌ Lost updates, double payments or history mismatch detected")
+        sys.exit(1)
+    print("✅ Ledger history matches final balance")
+
+
+if __name__ == "__main__":
+    main()
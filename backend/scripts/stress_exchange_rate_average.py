@@ -0,0 +1,196 @@
+"""
+Нагрузочная проверка update_exchange_rate_average под конкурентной записью.
+
+Проводит по новой валютной паре начальный income-постинг, затем
+параллельно N постингов вперемешку: income через create_income_transaction
+и expense через create_expense_transaction (каждый в своей сессии и
+транзакции, со списанием и зачислением на один крипто-счёт). Начальный
+постинг покрывает все расходы, поэтому ни один постинг не должен быть
+отклонён.
+
+Итог расхода зависит от средней на момент списания, поэтому ожидаемое
+состояние строится последовательным повтором постингов в порядке истории
+(по id, как отдаёт /history) по тем же формулам и с округлением колонок
+Numeric. Проверяется:
+- balance_after/total_value_after/average_rate_after каждой строки истории
+  и итоговые balance/total_value/average_rate пары совпадают с повтором,
+  то есть ни одно обновление не потеряно и не применено к устаревшей средней;
+- баланс счёта равен начальному плюс доходы минус расходы;
+- created_at в истории не убывает.
+
+Запускать на локальном PostgreSQL:
+    python scripts/stress_exchange_rate_average.py --postings 500 --workers 32
+
+SQLite игнорирует SELECT ... FOR UPDATE: с --workers > 1 баланс счёта
+теряет обновления, и проверка это показывает. С --workers 1 скрипт
+проверяет сам повтор.
+"""
+import sys
+import os
+import argparse
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from decimal import Decimal, ROUND_HALF_UP
+from app.core.database import SessionLocal
+from app.models.user import User, UserRole
+from app.models.account_balance import AccountBalance
+from app.models.account_balance_history import AccountBalanceHistory
+from app.models.exchange_rate_average import ExchangeRateAverage
+from app.models.exchange_rate_transaction import ExchangeRateTransaction, TransactionType
+from app.schemas.exchange_rate import ExchangeRateTransactionCreate
+from app.api.exchange_rates import create_income_transaction, create_expense_transaction
+
+# Масштаб колонок ExchangeRateAverage/ExchangeRateTransaction: Numeric(15, 4) и Numeric(12, 6)
+AMOUNT_STEP = Decimal("0.0001")
+RATE_STEP = Decimal("0.000001")
+
+ENDPOINTS = {
+    TransactionType.INCOME: create_income_transaction,
+    TransactionType.EXPENSE: create_expense_transaction,
+}
+
+
+def post(transaction_type: TransactionType, currency_from: str, currency_to: str,
+         amount: Decimal, rate: Decimal, account_id: int, user_id: int):
+    db = SessionLocal()
+    try:
+        transaction_data = ExchangeRateTransactionCreate(
+            transaction_type=transaction_type, amount=amount,
+            currency_from=currency_from, currency_to=currency_to, exchange_rate=rate,
+            crypto_account_id=account_id
+        )
+        ENDPOINTS[transaction_type](transaction_data, db=db, current_user=db.get(User, user_id))
+    finally:
+        db.close()
+
+
+def replay(history: list) -> tuple:
+    """Последовательный повтор постингов; возвращает итог и число расхождений со строками истории"""
+    balance = total = average = Decimal(0)
+    mismatches = 0
+    for trans in history:
+        if trans.transaction_type == TransactionType.INCOME:
+            balance += trans.amount
+            total += trans.amount * trans.exchange_rate
+            average = total / balance if balance > 0 else Decimal(0)
+        else:
+            balance -= trans.amount
+            total -= trans.amount * average
+        # Состояние пары перечитывается из БД после каждого постинга, уже округлённым
+        balance = balance.quantize(AMOUNT_STEP, rounding=ROUND_HALF_UP)
+        total = total.quantize(AMOUNT_STEP, rounding=ROUND_HALF_UP)
+        average = average.quantize(RATE_STEP, rounding=ROUND_HALF_UP)
+        if (trans.balance_after, trans.total_value_after, trans.average_rate_after) != (balance, total, average):
+            mismatches += 1
+    return balance, total, average, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--postings", type=int, default=500, help="Количество параллельных постингов")
+    parser.add_argument("--workers", type=int, default=32, help="Количество параллельных потоков")
+    parser.add_argument("--expense-share", type=float, default=0.4, help="Доля expense среди постингов")
+    args = parser.parse_args()
+
+    # Уникальная пара, чтобы проверка не зависела от уже проведённых постингов
+    suffix = uuid.uuid4().hex[:6].upper()
+    currency_from, currency_to = f"ST{suffix}", f"SU{suffix}"
+
+    # Суммы с 2 знаками и курсы с 2 знаками: суммы в целевой валюте точно укладываются в Numeric(15, 4)
+    postings = [
+        (
+            TransactionType.EXPENSE if random.random() < args.expense_share else TransactionType.INCOME,
+            Decimal(random.randint(1, 100000)) / 100,
+            Decimal(random.randint(90, 130)) / 100
+        )
+        for _ in range(args.postings)
+    ]
+    opening_amount = sum(amount for kind, amount, _ in postings if kind == TransactionType.EXPENSE) + 1
+    opening_rate = Decimal("1.10")
+    # Счёт покрывает любые расходы при максимальном курсе
+    opening_account_balance = opening_amount * Decimal("1.30")
+
+    db = SessionLocal()
+    user = User(email=f"stress-{suffix.lower()}@test.com", hashed_password="x", role=UserRole.ACCOUNTANT.value)
+    db.add(user)
+    db.flush()
+    account = AccountBalance(account_name=f"Stress {suffix}", balance=opening_account_balance,
+                             currency=currency_to, created_by=user.id)
+    db.add(account)
+    db.commit()
+    user_id, account_id = user.id, account.id
+    db.close()
+
+    post(TransactionType.INCOME, currency_from, currency_to, opening_amount, opening_rate, account_id, user_id)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(post, kind, currency_from, currency_to, amount, rate, account_id, user_id)
+            for kind, amount, rate in postings
+        ]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+
+    db = SessionLocal()
+    try:
+        record = db.query(ExchangeRateAverage).filter(
+            ExchangeRateAverage.currency_from == currency_from,
+            ExchangeRateAverage.currency_to == currency_to
+        ).one()
+        account = db.get(AccountBalance, account_id)
+
+        # История в порядке /history: повтор по ней даёт ожидаемое состояние пары
+        history = db.query(ExchangeRateTransaction).filter(
+            ExchangeRateTransaction.currency_from == currency_from,
+            ExchangeRateTransaction.currency_to == currency_to
+        ).order_by(ExchangeRateTransaction.id).all()
+        expected_balance, expected_total, expected_average, mismatches = replay(history)
+        out_of_order = sum(
+            1 for previous, trans in zip(history, history[1:]) if trans.created_at < previous.created_at
+        )
+        expected_account = opening_account_balance + sum(
+            trans.value_in_target_currency if trans.transaction_type == TransactionType.INCOME
+            else -trans.value_in_target_currency
+            for trans in history
+        )
+        expenses = sum(1 for trans in history if trans.transaction_type == TransactionType.EXPENSE)
+
+        print(f"Pair {currency_from}->{currency_to}: 1 opening + {args.postings} postings "
+              f"({expenses} expenses), {len(errors)} errors")
+        print(f"balance      {record.balance}  replay {expected_balance}")
+        print(f"total_value  {record.total_value}  replay {expected_total}")
+        print(f"average_rate {record.average_rate}  replay {expected_average}")
+        print(f"account      {account.balance}  expected {expected_account}")
+        print(f"history      {len(history)} rows, {mismatches} differ from replay, {out_of_order} out of posting order")
+
+        ok = (
+            not errors
+            and record.balance == expected_balance
+            and record.total_value == expected_total
+            and record.average_rate == expected_average
+            and account.balance == expected_account
+            and len(history) == args.postings + 1
+            and mismatches == 0
+            and out_of_order == 0
+        )
+
+        db.query(ExchangeRateTransaction).filter(ExchangeRateTransaction.created_by == user_id).delete()
+        db.query(AccountBalanceHistory).filter(AccountBalanceHistory.account_balance_id == account_id).delete()
+        db.delete(record)
+        db.delete(account)
+        db.query(User).filter(User.id == user_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    if not ok:
+        for error in errors[:5]:
+            print(f"❌ {error!r}")
+        print("❌ Lost updates, rejected postings or history that differs from a serial replay")
+        sys.exit(1)
+    print("✅ Concurrent income and expense postings match a serial replay")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import { useInfiniteQuery } from '@tanstack/react-query';
+import { api } from './api';
+
+// Размер страницы истории сделки (бэкенд отдаёт не больше 200 записей за запрос)
+export const DEAL_HISTORY_PAGE_SIZE = 50;
+
+interface DealHistoryPage<T> {
+  items: T[];
+  nextCursor?: string;
+}
+
+// История сделки постранично: /api/deals/{id}/history, курсор следующей страницы - в заголовке X-Next-Cursor.
+// Ключ ['deal', id, 'history'] сбрасывается вместе с invalidateQueries({ queryKey: ['deal', id] }).
+export function useDealHistory<T>(dealId: string | number | null | undefined) {
+  const query = useInfiniteQuery({
+    queryKey: ['deal', dealId, 'history'],
+    queryFn: async ({ pageParam }): Promise<DealHistoryPage<T>> => {
+      const response = await api.get(`/api/deals/${dealId}/history`, {
+        params: { limit: DEAL_HISTORY_PAGE_SIZE, cursor: pageParam || undefined },
+      });
+      return { items: response.data, nextCursor: response.headers['x-next-cursor'] as string | undefined };
+    },
+    initialPageParam: '',
+    getNextPageParam: (lastPage) => lastPage.nextCursor,
+    enabled: !!dealId,
+  });
+
+  return {
+    history: query.data?.pages.flatMap((page) => page.items) ?? [],
+    hasMore: !!query.hasNextPage,
+    loadMore: () => query.fetchNextPage(),
+    isLoadingMore: query.isFetchingNextPage,
+  };
+}
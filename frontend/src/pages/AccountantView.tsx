@@ -1,5 +1,6 @@
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { api } from '../lib/api';
+import { useDealHistory } from '../lib/dealHistory';
 import { useState } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { CompanyBalancesDisplay } from '../components/CompanyBalancesDisplay';
@@ -284,12 +285,19 @@ export function AccountantView() {
   const { data: dealDetail } = useQuery<DealWithHistory>({
     queryKey: ['deal', selectedDeal],
     queryFn: async () => {
-      const response = await api.get(`/api/deals/${selectedDeal}?include_history=true`);
+      const response = await api.get(`/api/deals/${selectedDeal}`);
       return response.data;
     },
     enabled: !!selectedDeal,
   });
 
+  const {
+    history,
+    hasMore: hasMoreHistory,
+    loadMore: loadMoreHistory,
+    isLoadingMore: isLoadingMoreHistory,
+  } = useDealHistory<DealHistory>(selectedDeal);
+
   // Загружаем расчёт дохода
   const { data: dealIncome, refetch: refetchIncome } = useQuery<DealIncome>({
     queryKey: ['deal-income', selectedDeal],
@@ -836,7 +844,7 @@ export function AccountantView() {
               </div>
 
               {/* История сделки */}
-              {dealDetail.history && dealDetail.history.length > 0 && (
+              {history.length > 0 && (
                 <div className="mb-6 bg-gray-50 rounded-lg p-4">
                   <div className="flex justify-between items-center mb-3">
                     <h3 className="text-sm font-semibold text-gray-700">История сделки</h3>
@@ -844,12 +852,12 @@ export function AccountantView() {
                       onClick={() => setShowHistory(!showHistory)}
                       className="text-indigo-600 hover:text-indigo-800 text-sm"
                     >
-                      {showHistory ? 'Скрыть' : `Показать (${dealDetail.history.length})`}
+                      {showHistory ? 'Скрыть' : `Показать (${history.length}${hasMoreHistory ? '+' : ''})`}
                     </button>
                   </div>
                   {showHistory && (
                     <div className="space-y-4 max-h-80 overflow-y-auto">
-                      {dealDetail.history.map((h) => {
+                      {history.map((h) => {
                         // Format role capitalization: manager -> Manager, senior_manager -> Senior Manager
                         const roleDisplay = h.user_role
                           ? h.user_role
@@ -1038,6 +1046,15 @@ export function AccountantView() {
                           </div>
                         );
                       })}
+                      {hasMoreHistory && (
+                        <button
+                          onClick={() => loadMoreHistory()}
+                          disabled={isLoadingMoreHistory}
+                          className="text-indigo-600 hover:text-indigo-800 text-sm disabled:opacity-50"
+                        >
+                          {isLoadingMoreHistory ? 'Загрузка...' : 'Показать ещё'}
+                        </button>
+                      )}
                     </div>
                   )}
                 </div>
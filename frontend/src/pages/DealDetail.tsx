@@ -2,6 +2,7 @@ import { useState } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import { api } from '../lib/api';
+import { useDealHistory } from '../lib/dealHistory';
 import { useAuth } from '../contexts/AuthContext';
 
 interface Transaction {
@@ -228,11 +229,18 @@ export function DealDetail() {
   const { data: deal, isLoading, error } = useQuery<Deal>({
     queryKey: ['deal', id],
     queryFn: async () => {
-      const response = await api.get(`/api/deals/${id}?include_history=true`);
+      const response = await api.get(`/api/deals/${id}`);
       return response.data;
     },
   });
 
+  const {
+    history,
+    hasMore: hasMoreHistory,
+    loadMore: loadMoreHistory,
+    isLoadingMore: isLoadingMoreHistory,
+  } = useDealHistory<DealHistory>(id);
+
   const { data: clients } = useQuery<Client[]>({
     queryKey: ['reference-clients'],
     queryFn: async () => {
@@ -650,7 +658,7 @@ export function DealDetail() {
       )}
 
       {/* History Section */}
-      {deal.history && deal.history.length > 0 && (
+      {history.length > 0 && (
         <div className="mb-6 bg-white shadow rounded-lg p-4">
           <div className="flex justify-between items-center mb-3">
             <h2 className="text-sm font-semibold text-gray-700">История сделки</h2>
@@ -658,12 +666,12 @@ export function DealDetail() {
               onClick={() => setShowHistory(!showHistory)}
               className="text-indigo-600 hover:text-indigo-800 text-sm"
             >
-              {showHistory ? 'Скрыть' : `Показать (${deal.history.length})`}
+              {showHistory ? 'Скрыть' : `Показать (${history.length}${hasMoreHistory ? '+' : ''})`}
             </button>
           </div>
           {showHistory && (
             <div className="space-y-4 max-h-96 overflow-y-auto">
-              {deal.history.map((h) => {
+              {history.map((h) => {
                 // Format role capitalization: manager -> Manager, senior_manager -> Senior Manager
                 const roleDisplay = h.user_role
                   ? h.user_role
@@ -852,6 +860,15 @@ export function DealDetail() {
                   </div>
                 );
               })}
+              {hasMoreHistory && (
+                <button
+                  onClick={() => loadMoreHistory()}
+                  disabled={isLoadingMoreHistory}
+                  className="text-indigo-600 hover:text-indigo-800 text-sm disabled:opacity-50"
+                >
+                  {isLoadingMoreHistory ? 'Загрузка...' : 'Показать ещё'}
+                </button>
+              )}
             </div>
           )}
         </div>